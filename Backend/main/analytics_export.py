@@ -0,0 +1,291 @@
+import itertools
+import json
+import os
+import re
+import uuid
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Payment, Refund, SaleItem
+from .models_ext import SaleDayRevision
+from .optional import optional_import
+
+pa = optional_import('pyarrow')
+pq = optional_import('pyarrow.parquet')
+
+
+# ------------------------------ SALE-LINE PARQUET EXPORT ------------------------------
+#
+# Denormalized sale-line facts are written as Hive-style partitions, one directory per
+# business (local) date: <export dir>/business_date=YYYY-MM-DD/sale_lines.parquet.
+# Each run appends the closed days after the newest partition on disk, streaming rows
+# in sale-date order with .iterator() and flushing a row group every ROW_GROUP rows,
+# so memory stays bounded whatever the range. pandas, polars or DuckDB can read the
+# directory directly, e.g. read_parquet('.../*/*.parquet', hive_partitioning=true).
+#
+# MANIFEST records, per partition, the highest sale-line, refund and payment ids it has
+# been checked against. Later runs rewrite the exported days that gained lines (offline
+# sales are often backdated), refunds or payments since, and the days whose
+# SaleDayRevision moved because a refund or payment was edited or deleted
+# (mark_changed). Other edits need --rebuild.
+
+ROW_GROUP = 5000
+FILE_NAME = 'sale_lines.parquet'
+MANIFEST = '_watermarks.json'  # leading underscore: dataset readers skip it
+PARTITION = re.compile(r'^business_date=(\d{4}-\d{2}-\d{2})$')
+
+# (output column, queryset field)
+COLUMNS = [
+    ('sale_item_id', 'id'),
+    ('sale_id', 'sale_id'),
+    ('sold_at', 'sale__date'),
+    ('sale_type', 'sale__sale_type'),
+    ('sale_status', 'sale__status'),
+    ('payment_status', 'sale__payment_status'),
+    ('payment_method', 'sale__payment_method'),
+    ('product_id', 'product_id'),
+    ('product_name', 'product__name'),
+    ('category_id', 'product__category_id'),
+    ('category_name', 'product__category__name'),
+    ('batch_id', 'batch_id'),
+    ('batch_code', 'batch__batch_code'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'price_per_unit'),
+    ('line_total', 'total_price'),
+    ('unit_cost', 'snapshot__unit_cost'),
+    ('list_price', 'snapshot__list_price'),
+    ('cashier_id', 'sale__user_id'),
+    ('cashier', 'sale__user__username'),
+    ('customer_id', 'sale__customer_id'),
+    ('customer_name', 'sale__customer__name'),
+]
+
+
+def available():
+    return pa is not None
+
+
+def export_dir():
+    configured = getattr(settings, 'ANALYTICS_EXPORT_DIR', None)
+    if configured:
+        return str(configured)
+    return os.path.join(str(getattr(settings, 'BASE_DIR', os.getcwd())), 'exports', 'sale_lines')
+
+
+def schema():
+    money = pa.decimal128(14, 2)
+    # business_date is not stored in the files; readers take it from the partition path.
+    return pa.schema([
+        ('sale_item_id', pa.int64()),
+        ('sale_id', pa.int64()),
+        ('sold_at', pa.timestamp('us', tz='UTC')),
+        ('sale_type', pa.string()),
+        ('sale_status', pa.string()),
+        ('payment_status', pa.string()),
+        ('payment_method', pa.string()),
+        ('product_id', pa.int64()),
+        ('product_name', pa.string()),
+        ('category_id', pa.int64()),
+        ('category_name', pa.string()),
+        ('batch_id', pa.int64()),
+        ('batch_code', pa.string()),
+        ('quantity', pa.int64()),
+        ('unit_price', money),
+        ('line_total', money),
+        ('unit_cost', money),
+        ('list_price', money),
+        ('line_cost', money),
+        ('line_profit', money),
+        ('cashier_id', pa.int64()),
+        ('cashier', pa.string()),
+        ('customer_id', pa.int64()),
+        ('customer_name', pa.string()),
+    ])
+
+
+def partitions(directory=None):
+    """{business_date: path} of the partitions already written."""
+    directory = directory or export_dir()
+    found = {}
+    if not os.path.isdir(directory):
+        return found
+    for name in os.listdir(directory):
+        match = PARTITION.match(name)
+        path = os.path.join(directory, name, FILE_NAME)
+        if match and os.path.isfile(path):
+            found[datetime.strptime(match.group(1), '%Y-%m-%d').date()] = path
+    return found
+
+
+# (manifest key, model): a new row of these changes its sale's partition
+WATERMARKS = [('sale_item_id', SaleItem), ('refund_id', Refund), ('payment_id', Payment)]
+
+
+def _watermark():
+    return {key: model.objects.order_by('-id').values_list('id', flat=True).first() or 0 for key, model in WATERMARKS}
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as handle:
+            return {date.fromisoformat(day): marks for day, marks in json.load(handle).items()}
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(directory, manifest):
+    temp_path = os.path.join(directory, f"{MANIFEST}.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, 'w') as handle:
+        json.dump({day.isoformat(): marks for day, marks in sorted(manifest.items())}, handle)
+    os.replace(temp_path, os.path.join(directory, MANIFEST))
+
+
+def mark_changed(sales):
+    """Bump the revision of the local days of ``sales`` so the next export rewrites them."""
+    for day in {timezone.localtime(sale.date).date() for sale in sales}:
+        rows = SaleDayRevision.objects.filter(day=day)
+        if rows.update(revision=F('revision') + 1):
+            continue
+        _row, created = SaleDayRevision.objects.get_or_create(day=day, defaults={'revision': 1})
+        if not created:  # created concurrently
+            rows.update(revision=F('revision') + 1)
+
+
+def _changed_days(manifest, days, revisions):
+    """
+    Local days holding rows added after the oldest watermark of ``days``, ``days`` whose
+    revision moved, plus unrecorded ``days``.
+    """
+    marks = [manifest[day] for day in days if day in manifest]
+    changed = {day for day in days if day not in manifest}
+    changed.update(day for day in days if revisions.get(day, 0) > manifest.get(day, {}).get('revision', 0))
+    if marks:
+        for key, model in WATERMARKS:
+            changed.update(
+                model.objects.filter(id__gt=min(mark.get(key, 0) for mark in marks), sale__isnull=False)
+                .annotate(day=TruncDate('sale__date'))
+                .order_by()
+                .values_list('day', flat=True)
+                .distinct()
+            )
+    return changed
+
+
+def _fact_rows(start, end):
+    """(business_date, row) for local days start..end (inclusive), in sale-date order."""
+    start_at = timezone.make_aware(datetime.combine(start, time.min))
+    end_at = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    rows = (
+        SaleItem.objects.filter(sale__date__gte=start_at, sale__date__lt=end_at)
+        .order_by('sale__date', 'id')
+        .values_list(*[field for _column, field in COLUMNS])
+    )
+    names = [column for column, _field in COLUMNS]
+    for values in rows.iterator(chunk_size=ROW_GROUP):
+        row = dict(zip(names, values))
+        if row['unit_cost'] is not None:
+            row['line_cost'] = row['unit_cost'] * row['quantity']
+            row['line_profit'] = row['line_total'] - row['line_cost']
+        else:
+            row['line_cost'] = row['line_profit'] = None
+        yield timezone.localtime(row['sold_at']).date(), row
+
+
+class _PartitionWriter:
+    """Buffers one day's rows and writes them to a temp file, renamed into place on close."""
+
+    def __init__(self, directory, day, table_schema):
+        self.folder = os.path.join(directory, f"business_date={day.isoformat()}")
+        os.makedirs(self.folder, exist_ok=True)
+        self.path = os.path.join(self.folder, FILE_NAME)
+        # Unique per run so concurrent exports never share a temp file; hidden from readers.
+        self.temp_path = os.path.join(self.folder, f".{FILE_NAME}.{uuid.uuid4().hex}.tmp")
+        self.schema = table_schema
+        self.writer = pq.ParquetWriter(self.temp_path, table_schema, compression='snappy')
+        self.buffer = []
+        self.rows = 0
+
+    def add(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write_table(pa.Table.from_pylist(self.buffer, schema=self.schema))
+            self.rows += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.temp_path, self.path)
+        return self.rows
+
+
+def export_sale_lines(since=None, until=None, rebuild=False, directory=None):
+    """
+    Write partitions for closed days not exported yet and rewrite exported days that
+    changed since. ``since`` sets where a first run (or ``rebuild``) starts; ``until``
+    defaults to yesterday. With ``rebuild`` existing partitions in the range are
+    replaced. Returns {business_date: rows} written.
+    """
+    directory = directory or export_dir()
+    until = min(until or timezone.localdate() - timedelta(days=1), timezone.localdate() - timedelta(days=1))
+
+    # Taken first: rows added or edited while exporting are picked up next run.
+    mark = _watermark()
+    revisions = dict(SaleDayRevision.objects.values_list('day', 'revision'))
+    existing = partitions(directory)
+    manifest = _read_manifest(directory)
+    if manifest is None:  # partitions written before watermarks were kept
+        manifest = {day: {**mark, 'revision': revisions.get(day, 0)} for day in existing}
+
+    changed = set()
+    if not rebuild and existing:
+        first_new = max(existing) + timedelta(days=1)
+        changed = {
+            day for day in _changed_days(manifest, existing, revisions)
+            if day is not None and min(existing) <= day < first_new and day <= until
+        }
+        since = max(since, first_new) if since else first_new
+    if since is None:
+        first = SaleItem.objects.order_by('sale__date').values_list('sale__date', flat=True).first()
+        if first is None:
+            return {}
+        since = timezone.localtime(first).date()
+
+    ranges = [(day, day) for day in sorted(changed)]
+    if since <= until:
+        ranges.append((since, until))
+
+    table_schema = schema()
+    written, writer, writer_day = {}, None, None
+    try:
+        for day, row in itertools.chain.from_iterable(_fact_rows(start, end) for start, end in ranges):
+            if writer is not None and writer_day != day:
+                written[writer_day] = writer.close()
+                writer = None
+            if writer is None:
+                writer, writer_day = _PartitionWriter(directory, day, table_schema), day
+            writer.add(row)
+        if writer is not None:
+            written[writer_day] = writer.close()
+            writer = None
+    finally:
+        if writer is not None:  # failed mid-partition: leave no half-written file behind
+            writer.writer.close()
+            os.remove(writer.temp_path)
+
+    # Days checked above are now verified up to ``mark``, as are the ones just written.
+    checked = [] if rebuild else [day for day in existing if day <= until]
+    if checked or written:
+        _write_manifest(directory, {
+            **manifest,
+            **{day: {**mark, 'revision': revisions.get(day, 0)} for day in [*checked, *written]},
+        })
+    return written
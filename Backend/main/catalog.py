@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, ProductBatch
+from .models_ext import CatalogChange
+from .sequences import horizon, settled
+from .versioning import CATALOG, bump
+
+
+# ------------------------------ CATALOG CHANGE SEQUENCE ------------------------------
+#
+# ORM saves and deletes of Product/ProductBatch are logged by the receivers below.
+# Set-based writes (QuerySet.update) skip signals, so code doing them calls
+# record_changes() itself -- see stock.py. Cursors only move through settled ids (see
+# sequences.py). The log is pruned by the prune_change_logs command; a till whose
+# cursor predates the oldest kept change gets the full catalog again.
+
+MAX_CHANGES = 5000
+
+PRODUCT_FIELDS = ['id', 'name', 'category_id', 'threshold']
+BATCH_FIELDS = [
+    'id', 'product_id', 'batch_code', 'expiry_date',
+    'selling_price', 'wholesale_price', 'quantity',
+]
+
+
+def record_changes(kind, object_ids):
+    CatalogChange.objects.bulk_create([
+        CatalogChange(kind=kind, object_id=object_id) for object_id in set(object_ids)
+    ])
+    bump(CATALOG)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def _product_changed(sender, instance, **kwargs):
+    record_changes('product', [instance.id])
+
+
+@receiver(post_save, sender=ProductBatch)
+@receiver(post_delete, sender=ProductBatch)
+def _batch_changed(sender, instance, **kwargs):
+    record_changes('batch', [instance.id])
+
+
+def current_sequence():
+    return horizon(CatalogChange)
+
+
+def full_catalog():
+    return {
+        "cursor": current_sequence(),
+        "full": True,
+        "more": False,
+        "products": list(Product.objects.values(*PRODUCT_FIELDS)),
+        "batches": list(ProductBatch.objects.values(*BATCH_FIELDS)),
+        "deleted": {"products": [], "batches": []},
+    }
+
+
+def changes_since(since):
+    """Rows changed after ``since``, newest state only, plus tombstones for deletes."""
+    oldest = CatalogChange.objects.order_by('id').values_list('id', flat=True).first()
+    if oldest is not None and since < oldest - 1:
+        return full_catalog()  # changes after ``since`` may have been pruned
+
+    rows = list(
+        CatalogChange.objects.filter(id__gt=since)
+        .order_by('id')
+        .values_list('id', 'created_at', 'kind', 'object_id')[:MAX_CHANGES]
+    )
+    changes = settled(rows, since)
+    product_ids = {object_id for _, _, kind, object_id in changes if kind == 'product'}
+    batch_ids = {object_id for _, _, kind, object_id in changes if kind == 'batch'}
+
+    products = list(Product.objects.filter(id__in=product_ids).values(*PRODUCT_FIELDS)) if product_ids else []
+    batches = list(ProductBatch.objects.filter(id__in=batch_ids).values(*BATCH_FIELDS)) if batch_ids else []
+
+    return {
+        "cursor": changes[-1][0] if changes else since,
+        "full": False,
+        "more": len(rows) == MAX_CHANGES,
+        "products": products,
+        "batches": batches,
+        "deleted": {
+            "products": sorted(product_ids - {p['id'] for p in products}),
+            "batches": sorted(batch_ids - {b['id'] for b in batches}),
+        },
+    }
+
+
+def prune_changes(keep_days):
+    """Drop changes older than ``keep_days``; the newest change is always kept."""
+    newest = CatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+    if newest is None:
+        return 0
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    deleted, _ = CatalogChange.objects.filter(id__lt=newest, created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,113 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from .models import Product
+from .models_ext import ProductClassification, SaleItemSnapshot
+from .versioning import CATALOG, bump
+
+
+# ------------------------------ ABC CLASSIFICATION ------------------------------
+#
+# Revenue, profit and units per product over the window come out of one grouped
+# aggregate over the sale-time snapshots (the same rows the profit reports read).
+# Products are ranked by each measure and classed by the cumulative share of the
+# products ranked above them: the ones that make up the first ``a_share`` are A, up to
+# ``b_share`` B, the rest C. Products with nothing (or a loss) to contribute are C.
+
+DEFAULT_DAYS = 365
+A_SHARE = Decimal('0.80')
+B_SHARE = Decimal('0.95')
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def contributions(start):
+    """{product_id: (quantity, revenue, profit)} for confirmed sales since ``start``."""
+    since = timezone.make_aware(datetime.combine(start, time.min))
+    rows = (
+        SaleItemSnapshot.objects.filter(sale__status='confirmed', sale__date__gte=since)
+        .values('product_id')
+        .annotate(
+            units=Sum('quantity'),
+            revenue=Sum(ExpressionWrapper(F('quantity') * F('unit_price'), output_field=MONEY)),
+            profit=Sum(ExpressionWrapper(F('quantity') * (F('unit_price') - F('unit_cost')), output_field=MONEY)),
+        )
+        .values_list('product_id', 'units', 'revenue', 'profit')
+    )
+    return {product_id: (units, revenue, profit) for product_id, units, revenue, profit in rows}
+
+
+def rank(values, a_share=A_SHARE, b_share=B_SHARE):
+    """
+    ``values``: {product_id: amount}. Returns {product_id: (rank, cumulative_share, class)}.
+    A product is A while the share *before* it is under ``a_share``, so the product that
+    crosses the boundary belongs to the higher class.
+    """
+    ordered = sorted(values.items(), key=lambda item: (-item[1], item[0]))
+    total = sum((amount for _, amount in ordered if amount > 0), Decimal('0'))
+
+    ranked, running = {}, Decimal('0')
+    for position, (product_id, amount) in enumerate(ordered, start=1):
+        before = running / total if total else Decimal('1')
+        if amount > 0:
+            running += amount
+        share = running / total if total else Decimal('0')
+        if amount <= 0:
+            grade = 'C'
+        elif before < a_share:
+            grade = 'A'
+        elif before < b_share:
+            grade = 'B'
+        else:
+            grade = 'C'
+        ranked[product_id] = (position, share.quantize(Decimal('0.000001')), grade)
+    return ranked
+
+
+@transaction.atomic
+def classify_products(days=DEFAULT_DAYS, a_share=A_SHARE, b_share=B_SHARE):
+    """Recompute and replace every product's classification. Returns the class counts."""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    computed_at = timezone.now()
+
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    sold = contributions(start)
+    zero = (0, Decimal('0'), Decimal('0'))
+
+    by_revenue = rank({pid: sold.get(pid, zero)[1] for pid in product_ids}, a_share, b_share)
+    by_profit = rank({pid: sold.get(pid, zero)[2] for pid in product_ids}, a_share, b_share)
+
+    rows = []
+    for product_id in product_ids:
+        units, revenue, profit = sold.get(product_id, zero)
+        revenue_rank, revenue_share, abc_class = by_revenue[product_id]
+        profit_rank, profit_share, profit_class = by_profit[product_id]
+        rows.append(ProductClassification(
+            product_id=product_id,
+            quantity=units or 0,
+            revenue=revenue or 0,
+            profit=profit or 0,
+            revenue_share=revenue_share,
+            profit_share=profit_share,
+            revenue_rank=revenue_rank,
+            profit_rank=profit_rank,
+            abc_class=abc_class,
+            profit_class=profit_class,
+            period_start=start,
+            period_end=today,
+            computed_at=computed_at,
+        ))
+
+    ProductClassification.objects.all().delete()
+    ProductClassification.objects.bulk_create(rows, batch_size=1000)
+    bump(CATALOG)  # product list ETags include the classes
+
+    counts = {'A': 0, 'B': 0, 'C': 0}
+    for row in rows:
+        counts[row.abc_class] += 1
+    return counts
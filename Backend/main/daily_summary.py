@@ -0,0 +1,210 @@
+from calendar import monthrange
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Expense, Refund, Sale
+from .models_ext import DailySummary, SaleItemSnapshot
+
+
+# ------------------------------ DAILY SUMMARY ------------------------------
+#
+# One DailySummary row per local day, updated with F() increments in the transaction
+# that posts the sale, refund or expense. Period comparisons then read the handful of
+# day rows they span in a single conditional aggregate instead of scanning sales.
+
+FIELDS = [
+    'sales_count', 'sales_total', 'profit', 'loans_count', 'loans_total',
+    'refunds_count', 'refunds_total', 'expenses_count', 'expenses_total',
+]
+
+PERIODS = ('day', 'week', 'month', 'year')
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _day(moment):
+    return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+
+
+def _apply(deltas):
+    """``deltas``: {day: {field: amount}}, added onto the day rows."""
+    for day, values in deltas.items():
+        values = {field: value for field, value in values.items() if value}
+        if not values:
+            continue
+        rows = DailySummary.objects.filter(day=day)
+        increments = {field: F(field) + value for field, value in values.items()}
+        if rows.update(**increments):
+            continue
+        _row, created = DailySummary.objects.get_or_create(day=day, defaults=values)
+        if not created:  # created concurrently
+            rows.update(**increments)
+
+
+def tally_sales(sales, snapshots=()):
+    """New ``sales`` and the SaleItemSnapshot rows of their items (for profit)."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    sale_days = {}
+    for sale in sales:
+        day = sale_days[sale.id] = _day(sale.date)
+        deltas[day]['sales_count'] += 1
+        deltas[day]['sales_total'] += sale.final_amount or 0
+        if sale.is_loan:
+            deltas[day]['loans_count'] += 1
+            deltas[day]['loans_total'] += sale.final_amount or 0
+    for snapshot in snapshots:
+        deltas[sale_days[snapshot.sale_id]]['profit'] += snapshot.quantity * (snapshot.unit_price - snapshot.unit_cost)
+    _apply(deltas)
+
+
+def tally_refunds(refunds, sign=1):
+    deltas = defaultdict(lambda: defaultdict(int))
+    for refund in refunds:
+        day = _day(refund.refund_date or timezone.now())
+        deltas[day]['refunds_count'] += sign
+        deltas[day]['refunds_total'] += sign * (refund.refund_amount or 0)
+    _apply(deltas)
+
+
+def tally_expenses(expenses, sign=1):
+    deltas = defaultdict(lambda: defaultdict(int))
+    for expense in expenses:
+        day = _day(expense.date)
+        deltas[day]['expenses_count'] += sign
+        deltas[day]['expenses_total'] += sign * expense.amount
+    _apply(deltas)
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """Recompute day rows from sales, snapshots, refunds and expenses (from ``since`` on)."""
+    since_at = timezone.make_aware(datetime.combine(since, time.min)) if since else None
+
+    def grouped(queryset, moment, **aggregates):
+        if since_at is not None:
+            queryset = queryset.filter(**{f"{moment}__gte": since_at})
+        return queryset.annotate(day=TruncDate(moment)).values('day').annotate(**aggregates).order_by()
+
+    days = defaultdict(dict)
+    sources = [
+        grouped(
+            Sale.objects.all(), 'date',
+            sales_count=Count('id'),
+            sales_total=Sum('final_amount'),
+            loans_count=Count('id', filter=Q(is_loan=True)),
+            loans_total=Sum('final_amount', filter=Q(is_loan=True)),
+        ),
+        grouped(
+            SaleItemSnapshot.objects.all(), 'sale__date',
+            profit=Sum(ExpressionWrapper(F('quantity') * (F('unit_price') - F('unit_cost')), output_field=MONEY)),
+        ),
+        grouped(Refund.objects.all(), 'refund_date', refunds_count=Count('id'), refunds_total=Sum('refund_amount')),
+        grouped(Expense.objects.all(), 'date', expenses_count=Count('id'), expenses_total=Sum('amount')),
+    ]
+    for rows in sources:
+        for row in rows:
+            day = row.pop('day')
+            days[day].update({field: value or 0 for field, value in row.items()})
+
+    existing = DailySummary.objects.all()
+    if since is not None:
+        existing = existing.filter(day__gte=since)
+    existing.delete()
+    DailySummary.objects.bulk_create(
+        [DailySummary(day=day, **values) for day, values in sorted(days.items())], batch_size=1000
+    )
+    return len(days)
+
+
+# ------------------------------ PERIOD COMPARISON ------------------------------
+
+def _shift_months(day, months):
+    years, month = divmod(day.month - 1 + months, 12)
+    year = day.year + years
+    return day.replace(year=year, month=month + 1, day=min(day.day, monthrange(year, month + 1)[1]))
+
+
+def period_bounds(anchor, period):
+    if period == 'day':
+        return anchor, anchor
+    if period == 'week':
+        start = anchor - timedelta(days=anchor.weekday())
+        return start, start + timedelta(days=6)
+    if period == 'month':
+        return anchor.replace(day=1), anchor.replace(day=monthrange(anchor.year, anchor.month)[1])
+    return anchor.replace(month=1, day=1), anchor.replace(month=12, day=31)
+
+
+def comparison_spans(period, anchor, to_date=True):
+    """
+    Current, previous and year-ago (start, end) spans. With ``to_date`` each span stops
+    at the same point into its period as ``anchor`` does, so partial periods compare
+    like for like. Weeks compare with the same ISO weekday 52 weeks back.
+    """
+    previous_anchor = {
+        'day': anchor - timedelta(days=1),
+        'week': anchor - timedelta(days=7),
+        'month': _shift_months(anchor, -1),
+        'year': _shift_months(anchor, -12),
+    }[period]
+    year_ago_anchor = anchor - timedelta(weeks=52) if period == 'week' else _shift_months(anchor, -12)
+
+    def span(point):
+        start, end = period_bounds(point, period)
+        return start, point if to_date else end
+
+    return {"current": span(anchor), "previous": span(previous_anchor), "year_ago": span(year_ago_anchor)}
+
+
+def _change(now, then):
+    change = now - then
+    pct = round(Decimal(change) * 100 / abs(Decimal(then)), 1) if then else None
+    return change, pct
+
+
+def compare(period, anchor, to_date=True):
+    spans = comparison_spans(period, anchor, to_date)
+    lowest = min(start for start, _end in spans.values())
+    highest = max(end for _start, end in spans.values())
+
+    aggregates = {
+        f"{label}_{field}": Sum(field, filter=Q(day__gte=start, day__lte=end))
+        for label, (start, end) in spans.items()
+        for field in FIELDS
+    }
+    totals = DailySummary.objects.filter(day__gte=lowest, day__lte=highest).aggregate(**aggregates)
+
+    figures = {}
+    for label in spans:
+        values = {field: totals[f"{label}_{field}"] or 0 for field in FIELDS}
+        values['net_sales'] = values['sales_total'] - values['refunds_total']
+        values['profit_after_expenses'] = values['profit'] - values['expenses_total']
+        figures[label] = values
+
+    comparison = {}
+    for field in figures["current"]:
+        current, previous, year_ago = (figures[label][field] for label in ("current", "previous", "year_ago"))
+        change, change_pct = _change(current, previous)
+        year_change, year_change_pct = _change(current, year_ago)
+        comparison[field] = {
+            "current": current,
+            "previous": previous,
+            "year_ago": year_ago,
+            "change": change,
+            "change_pct": change_pct,
+            "year_change": year_change,
+            "year_change_pct": year_change_pct,
+        }
+
+    return {
+        "period": period,
+        "to_date": to_date,
+        "spans": {label: {"start": start, "end": end} for label, (start, end) in spans.items()},
+        "figures": comparison,
+    }
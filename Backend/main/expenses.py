@@ -0,0 +1,158 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .daily_summary import tally_expenses
+from .models import Expense
+from .models_ext import ExpenseDaily
+from .versioning import EXPENSES, bump
+
+
+# ------------------------------ EXPENSE ROLLUP ------------------------------
+#
+# ExpenseDaily keeps count and total per (local day, category). Recording, editing,
+# deleting or importing expenses calls post_expenses() in the same transaction, which
+# also feeds the DailySummary. Summaries by day or month then read the rollup rows for
+# the range instead of grouping the expenses table on every call.
+
+GROUPS = ('day', 'month')
+
+IMPORT_FIELDS = ('description', 'amount', 'category', 'date')
+MAX_IMPORT_ROWS = 2000
+IMPORT_BATCH = 500
+
+
+def _day(moment):
+    return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+
+
+def post_expenses(expenses, sign=1):
+    """Add (or with ``sign=-1`` remove) ``expenses`` to the rollup and the daily summary."""
+    expenses = list(expenses)
+    buckets = defaultdict(lambda: [0, Decimal('0')])
+    for expense in expenses:
+        bucket = buckets[(_day(expense.date), expense.category or '')]
+        bucket[0] += sign
+        bucket[1] += sign * expense.amount
+
+    for (day, category), (count, amount) in buckets.items():
+        rows = ExpenseDaily.objects.filter(day=day, category=category)
+        increments = {'expense_count': F('expense_count') + count, 'total_amount': F('total_amount') + amount}
+        if rows.update(**increments):
+            continue
+        _row, created = ExpenseDaily.objects.get_or_create(
+            day=day, category=category, defaults={'expense_count': count, 'total_amount': amount},
+        )
+        if not created:  # created concurrently
+            rows.update(**increments)
+
+    tally_expenses(expenses, sign)
+    if expenses:  # bulk_create sends no signals
+        bump(EXPENSES)
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """Recompute the rollup from the expenses table, from local day ``since`` or entirely."""
+    rows = ExpenseDaily.objects.all()
+    expenses = Expense.objects.all()
+    if since is not None:
+        rows = rows.filter(day__gte=since)
+        expenses = expenses.filter(date__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    rows.delete()
+
+    grouped = (
+        expenses.annotate(day=TruncDate('date'))
+        .values('day', 'category')
+        .annotate(expense_count=Count('id'), total_amount=Sum('amount'))
+        .order_by()
+    )
+    buckets = defaultdict(lambda: [0, Decimal('0')])
+    for row in grouped:  # '' and NULL categories share one bucket
+        bucket = buckets[(row['day'], row['category'] or '')]
+        bucket[0] += row['expense_count']
+        bucket[1] += row['total_amount'] or 0
+
+    ExpenseDaily.objects.bulk_create([
+        ExpenseDaily(day=day, category=category, expense_count=count, total_amount=amount)
+        for (day, category), (count, amount) in sorted(buckets.items())
+    ], batch_size=1000)
+    return len(buckets)
+
+
+def summary(start, end, group='month', category=None):
+    """Expense count and total per category and day (or month) for local days ``start``..``end``."""
+    rows = ExpenseDaily.objects.filter(day__gte=start, day__lte=end)
+    if category is not None:
+        rows = rows.filter(category=category)
+
+    if group == 'month':
+        rows = rows.annotate(period=TruncMonth('day'))
+    else:
+        rows = rows.annotate(period=F('day'))
+    grouped = (
+        rows.values('period', 'category')
+        .annotate(count=Sum('expense_count'), total=Sum('total_amount'))
+        .order_by('period', 'category')
+    )
+
+    periods, categories = [], defaultdict(lambda: {"count": 0, "total": Decimal('0')})
+    for row in grouped:
+        if not row['count'] and not row['total']:
+            continue  # every expense in the bucket was deleted
+        period = row['period'].strftime('%Y-%m') if group == 'month' else row['period'].isoformat()
+        periods.append({"period": period, "category": row['category'], "count": row['count'], "total": row['total']})
+        categories[row['category']]["count"] += row['count']
+        categories[row['category']]["total"] += row['total']
+
+    return {
+        "start": start,
+        "end": end,
+        "group": group,
+        "rows": periods,
+        "categories": [
+            {"category": name, **figures}
+            for name, figures in sorted(categories.items(), key=lambda item: -item[1]["total"])
+        ],
+        "count": sum(figures["count"] for figures in categories.values()),
+        "total": sum((figures["total"] for figures in categories.values()), Decimal('0')),
+    }
+
+
+# ------------------------------ BULK IMPORT ------------------------------
+
+def read_csv(upload):
+    """Rows of an uploaded CSV as dicts keyed by IMPORT_FIELDS (headers are case-insensitive)."""
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    rows = []
+    for record in reader:
+        row = {
+            key.strip().lower(): (value or '').strip()
+            for key, value in record.items() if key is not None  # None holds surplus cells
+        }
+        if not any(row.values()):
+            continue  # blank line
+        rows.append({field: row[field] for field in IMPORT_FIELDS if row.get(field)})
+    return rows
+
+
+@transaction.atomic
+def import_expenses(rows, user):
+    """
+    Create expenses from validated ``rows`` in batches, recorded by ``user``, and post
+    them to the rollup and the daily summary. Imported expenses are not added to the
+    user's open shift: they are usually backdated or not paid out of the till.
+    """
+    expenses = Expense.objects.bulk_create(
+        [Expense(recorded_by=user, **row) for row in rows], batch_size=IMPORT_BATCH
+    )
+    post_expenses(expenses)
+    return expenses
@@ -0,0 +1,140 @@
+import math
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Product, ProductBatch, SaleItem
+from .optional import optional_import
+
+np = optional_import('numpy')
+
+
+# ------------------------------ DEMAND FORECASTING ------------------------------
+#
+# Daily units sold per product come out of one grouped SaleItem query and are scattered
+# into a (products x days) matrix. Demand, variability, reorder points and order
+# quantities are then computed for the whole catalog with array operations:
+#   sma: mean of the last ``window`` days
+#   ses: simple exponential smoothing, l_t = a*x_t + (1-a)*l_(t-1), as one weighted dot
+# Safety stock is z * sigma_daily * sqrt(lead_time); below the reorder point the
+# suggestion orders up to lead_time + cover_days of demand plus safety stock.
+
+METHODS = ('sma', 'ses')
+MAX_HISTORY_DAYS = 730
+
+DEFAULTS = {
+    "method": 'sma',
+    "history_days": 365,
+    "window": 28,
+    "alpha": 0.3,
+    "lead_time": 7,
+    "cover_days": 30,
+    "service_z": 1.65,  # ~95% cycle service level
+}
+
+
+def available():
+    return np is not None
+
+
+def sales_matrix(start, days, product_ids):
+    """(len(product_ids) x days) array of units sold per product per local day."""
+    index = {product_id: row for row, product_id in enumerate(product_ids)}
+    matrix = np.zeros((len(product_ids), days), dtype=np.float64)
+
+    since = timezone.make_aware(datetime.combine(start, time.min))
+    rows = (
+        SaleItem.objects.filter(sale__status='confirmed', sale__date__gte=since)
+        .annotate(day=TruncDate('sale__date'))
+        .values('product_id', 'day')
+        .annotate(units=Sum('quantity'))
+        .values_list('product_id', 'day', 'units')
+    )
+    product_rows, day_cols, units = [], [], []
+    for product_id, day, quantity in rows.iterator(chunk_size=10000):
+        col = (day - start).days
+        if product_id in index and 0 <= col < days:
+            product_rows.append(index[product_id])
+            day_cols.append(col)
+            units.append(quantity)
+    if units:
+        np.add.at(matrix, (np.array(product_rows), np.array(day_cols)), np.array(units, dtype=np.float64))
+    return matrix
+
+
+def on_hand(product_ids, today):
+    """Sellable (in-stock, unexpired) units per product, aligned with ``product_ids``."""
+    totals = dict(
+        ProductBatch.objects.filter(quantity__gt=0)
+        .filter(Q(expiry_date__isnull=True) | Q(expiry_date__gte=today))
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    return np.array([totals.get(product_id, 0) for product_id in product_ids], dtype=np.float64)
+
+
+def smoothed_demand(matrix, method, window, alpha):
+    if method == 'ses':
+        days = matrix.shape[1]
+        # l_T = sum_t a(1-a)^(T-t) x_t for t >= 1, plus (1-a)^T x_0 for the seed value.
+        weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+        weights[0] = (1 - alpha) ** (days - 1)
+        return matrix @ weights
+    return matrix[:, -window:].mean(axis=1)
+
+
+def forecast(**params):
+    """
+    Reorder suggestions for every product. ``params`` override DEFAULTS.
+    Returns (rows, options) with rows ordered by days of cover, shortest first.
+    """
+    options = {**DEFAULTS, **{k: v for k, v in params.items() if v is not None}}
+    days = min(int(options["history_days"]), MAX_HISTORY_DAYS)
+    window = min(int(options["window"]), days)
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+
+    products = list(Product.objects.order_by('id').values_list('id', 'name', 'threshold'))
+    product_ids = [product[0] for product in products]
+    if not products:
+        return [], options
+
+    matrix = sales_matrix(start, days, product_ids)
+    stock = on_hand(product_ids, today)
+
+    demand = smoothed_demand(matrix, options["method"], window, float(options["alpha"]))
+    sigma = matrix[:, -window:].std(axis=1)
+    lead_time = float(options["lead_time"])
+    cover_days = float(options["cover_days"])
+
+    safety = float(options["service_z"]) * sigma * math.sqrt(lead_time)
+    reorder_point = demand * lead_time + safety
+    order_up_to = demand * (lead_time + cover_days) + safety
+    needs_reorder = (stock <= reorder_point) & (demand > 0)
+    suggested = np.where(needs_reorder, np.ceil(np.maximum(order_up_to - stock, 0)), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(demand > 0, stock / demand, np.inf)
+    sold = matrix[:, -window:].sum(axis=1)
+
+    rows = []
+    for i in np.argsort(cover, kind='stable'):
+        product_id, name, threshold = products[i]
+        rows.append({
+            "product_id": product_id,
+            "product_name": name,
+            "threshold": threshold,
+            "on_hand": int(stock[i]),
+            "sold_in_window": int(sold[i]),
+            "daily_demand": round(float(demand[i]), 3),
+            "days_of_cover": None if math.isinf(cover[i]) else round(float(cover[i]), 1),
+            "safety_stock": round(float(safety[i]), 1),
+            "reorder_point": round(float(reorder_point[i]), 1),
+            "needs_reorder": bool(needs_reorder[i]),
+            "suggested_quantity": int(suggested[i]),
+        })
+
+    options.update(history_days=days, window=window, start=start, end=today)
+    return rows, options
@@ -0,0 +1,73 @@
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import SaleItem
+from main.models_ext import PriceRevisionLine, SaleItemSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Create cost/list-price snapshots for SaleItems sold before snapshots existed. "
+        "Uses the batch's current buying price, and its selling price as of the sale date "
+        "where bulk price revisions recorded it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+
+        # Revision times and the selling price before each revision, per batch, in time order.
+        revised_at = defaultdict(list)
+        price_before = defaultdict(list)
+        for batch_id, created_at, old_selling in PriceRevisionLine.objects.order_by(
+            'revision__created_at', 'id'
+        ).values_list('batch_id', 'revision__created_at', 'old_selling_price'):
+            revised_at[batch_id].append(created_at)
+            price_before[batch_id].append(old_selling)
+
+        def list_price_at(batch_id, sold_at, current):
+            # The first revision after the sale still remembers the price it was sold at.
+            index = bisect_right(revised_at.get(batch_id, ()), sold_at)
+            return price_before[batch_id][index] if index < len(revised_at.get(batch_id, ())) else current
+
+        items = (
+            SaleItem.objects.filter(snapshot__isnull=True)
+            .order_by('id')
+            .values_list(
+                'id', 'sale_id', 'product_id', 'quantity', 'price_per_unit',
+                'batch_id', 'batch__buying_price', 'batch__selling_price', 'sale__date',
+            )
+        )
+
+        created = 0
+        pending = []
+        for (item_id, sale_id, product_id, quantity, unit_price,
+             batch_id, buying, selling, sold_at) in items.iterator(chunk_size=chunk):
+            pending.append(SaleItemSnapshot(
+                sale_item_id=item_id,
+                sale_id=sale_id,
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=unit_price,
+                unit_cost=buying if buying is not None else Decimal('0'),
+                list_price=list_price_at(batch_id, sold_at, selling if selling is not None else unit_price),
+            ))
+            if len(pending) >= chunk:
+                created += self._flush(pending)
+        created += self._flush(pending)
+
+        self.stdout.write(self.style.SUCCESS(f"Created {created} sale item snapshots."))
+
+    @staticmethod
+    def _flush(pending):
+        with transaction.atomic():
+            SaleItemSnapshot.objects.bulk_create(pending, ignore_conflicts=True)
+        count = len(pending)
+        pending.clear()
+        return count
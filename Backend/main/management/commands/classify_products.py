@@ -0,0 +1,25 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.classification import A_SHARE, B_SHARE, DEFAULT_DAYS, classify_products
+
+
+class Command(BaseCommand):
+    help = "Recompute ABC (Pareto) classes by revenue and profit for every product (schedule nightly)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="Sales window to classify over.")
+        parser.add_argument('--a-share', type=Decimal, default=A_SHARE, help="Cumulative share covered by class A.")
+        parser.add_argument('--b-share', type=Decimal, default=B_SHARE, help="Cumulative share covered by A and B.")
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError("--days must be at least 1.")
+        if not 0 < options['a_share'] < options['b_share'] <= 1:
+            raise CommandError("Shares must satisfy 0 < a-share < b-share <= 1.")
+
+        counts = classify_products(options['days'], options['a_share'], options['b_share'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Classified {sum(counts.values())} products: A {counts['A']}, B {counts['B']}, C {counts['C']}."
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from main.analytics_export import available, export_dir, export_sale_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Append date-partitioned Parquet files of sale-line facts for closed days not exported yet, "
+        "and rewrite exported days that changed since."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First business date (YYYY-MM-DD) for a first run or --rebuild.")
+        parser.add_argument('--until', help="Last business date to export (defaults to yesterday).")
+        parser.add_argument('--rebuild', action='store_true', help="Rewrite partitions in the range that already exist.")
+        parser.add_argument('--dir', help="Export directory (defaults to settings.ANALYTICS_EXPORT_DIR).")
+
+    def handle(self, *args, **options):
+        if not available():
+            raise CommandError("Parquet export needs pyarrow installed.")
+
+        dates = {}
+        for name in ('since', 'until'):
+            dates[name] = parse_date(options[name]) if options[name] else None
+            if options[name] and dates[name] is None:
+                raise CommandError(f"--{name} must be a date (YYYY-MM-DD).")
+
+        directory = options['dir'] or export_dir()
+        written = export_sale_lines(dates['since'], dates['until'], options['rebuild'], directory)
+        for day, rows in sorted(written.items()):
+            self.stdout.write(f"{day}: {rows} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(written)} partitions ({sum(written.values())} rows) to {directory}."
+        ))
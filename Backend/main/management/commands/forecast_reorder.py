@@ -0,0 +1,53 @@
+import csv
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.forecasting import DEFAULTS, METHODS, available, forecast
+
+
+class Command(BaseCommand):
+    help = "Forecast daily demand per product and print (or write as CSV) reorder suggestions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=METHODS, default=DEFAULTS['method'])
+        parser.add_argument('--history-days', type=int, default=DEFAULTS['history_days'])
+        parser.add_argument('--window', type=int, default=DEFAULTS['window'])
+        parser.add_argument('--alpha', type=float, default=DEFAULTS['alpha'])
+        parser.add_argument('--lead-time', type=float, default=DEFAULTS['lead_time'])
+        parser.add_argument('--cover-days', type=float, default=DEFAULTS['cover_days'])
+        parser.add_argument('--all', action='store_true', help="Include products that do not need reordering.")
+        parser.add_argument('--csv', help="Write the full result to this CSV file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if not available():
+            raise CommandError("Forecasting needs NumPy installed.")
+        if not all(math.isfinite(options[key]) and options[key] >= 0 for key in ('lead_time', 'cover_days')):
+            raise CommandError("--lead-time and --cover-days must be finite and not negative.")
+
+        rows, used = forecast(
+            method=options['method'],
+            history_days=options['history_days'],
+            window=options['window'],
+            alpha=options['alpha'],
+            lead_time=options['lead_time'],
+            cover_days=options['cover_days'],
+        )
+        if not options['all']:
+            rows = [row for row in rows if row['needs_reorder']]
+
+        if options['csv']:
+            with open(options['csv'], 'w', newline='') as handle:
+                writer = csv.DictWriter(handle, fieldnames=list(rows[0]) if rows else ['product_id'])
+                writer.writeheader()
+                writer.writerows(rows)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(rows)} rows to {options['csv']}."))
+            return
+
+        self.stdout.write(f"{used['method']} over {used['start']}..{used['end']}, window {used['window']} days")
+        for row in rows:
+            cover = '-' if row['days_of_cover'] is None else row['days_of_cover']
+            self.stdout.write(
+                f"{row['product_name'][:40]:40} on hand {row['on_hand']:>7}  demand/day {row['daily_demand']:>8}"
+                f"  cover {cover:>7}  reorder {row['suggested_quantity']:>7}"
+            )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.catalog import prune_changes
+from main.order_feed import prune_events
+
+
+class Command(BaseCommand):
+    help = "Delete old catalog changes and order events (schedule daily)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days', type=int, default=30,
+            help="Keep this many days of changes; tills with older cursors resync the full catalog.",
+        )
+
+    def handle(self, *args, **options):
+        if options['keep_days'] < 1:
+            raise CommandError("--keep-days must be at least 1.")
+        changes = prune_changes(options['keep_days'])
+        events = prune_events(options['keep_days'])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {changes} catalog changes and {events} order events."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from main.expenses import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-day, per-category expense rollup (entirely, or from --since)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only rebuild local days from this date (YYYY-MM-DD) on.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError("--since must be a date (YYYY-MM-DD).")
+
+        count = rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} expense rollup rows."))
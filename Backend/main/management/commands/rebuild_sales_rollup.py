@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from main.sales_rollup import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly sales rollup behind the sales heatmap (entirely, or from --since)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only rebuild local days from this date (YYYY-MM-DD) on.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError("--since must be a date (YYYY-MM-DD).")
+
+        count = rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} hourly sales buckets."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Product
+from main.stock_alerts import refresh_levels
+
+
+class Command(BaseCommand):
+    help = "Recompute stored stock levels for every product (run once after deploying stock alerts)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=500)
+        parser.add_argument(
+            '--record-events', action='store_true',
+            help="Also record transitions for levels that changed (off by default for the initial fill).",
+        )
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        chunk = options['chunk']
+        for start in range(0, len(product_ids), chunk):
+            refresh_levels(product_ids[start:start + chunk], record_events=options['record_events'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed stock levels for {len(product_ids)} products."))
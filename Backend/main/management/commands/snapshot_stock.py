@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from main.stock_history import prune_snapshots, take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Record per-batch stock balances for point-in-time stock reports (schedule daily, and monthly at month end)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=['daily', 'monthly'], default='daily')
+        parser.add_argument(
+            '--keep-daily', type=int, default=62,
+            help="Delete daily snapshots older than this many days (monthly snapshots are kept).",
+        )
+
+    def handle(self, *args, **options):
+        snapshot = take_snapshot(options['period'])
+        pruned = prune_snapshots(options['keep_daily'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {snapshot} with {snapshot.batch_count} batches; pruned {pruned} old rows."
+        ))
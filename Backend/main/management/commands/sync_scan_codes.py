@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import ProductBatch
+from main.models_ext import ScanCode
+
+
+class Command(BaseCommand):
+    help = "Rebuild batch-code scan rows from ProductBatch (run once after deploying ScanCode)."
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        ScanCode.objects.filter(batch__isnull=False).delete()
+
+        seen, rows, skipped = set(), [], []
+        for batch_id, product_id, batch_code in ProductBatch.objects.order_by('id').values_list(
+            'id', 'product_id', 'batch_code'
+        ):
+            if not batch_code or (product_id, batch_code) in seen:
+                skipped.append(batch_id)
+                continue
+            seen.add((product_id, batch_code))
+            rows.append(ScanCode(code=batch_code, product_id=product_id, batch_id=batch_id))
+
+        ScanCode.objects.bulk_create(rows, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(rows)} batch codes."))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(skipped)} batches with an empty or duplicate code: {skipped[:20]}"
+            ))
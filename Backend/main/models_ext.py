@@ -0,0 +1,450 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+# ------------------------------ ORDER CHANGE FEED ------------------------------
+
+class OrderEvent(models.Model):
+    """Append-only log of order changes; the auto id doubles as the feed cursor."""
+    EVENT_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('rejected', 'Rejected'),
+        ('confirmed', 'Confirmed'),
+        ('deleted', 'Deleted'),
+    ]
+
+    # Plain ids so events outlive deleted orders.
+    order_id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField(null=True, blank=True, db_index=True)
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    status = models.CharField(max_length=20)
+    summary = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Order {self.order_id} {self.event}"
+
+
+# ------------------------------ OFFLINE TERMINAL SYNC ------------------------------
+
+class SyncReceipt(models.Model):
+    """One row per offline sale accepted from a terminal; replays are answered from here."""
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    terminal_id = models.CharField(max_length=64, blank=True, db_index=True)
+    sale = models.ForeignKey('main.Sale', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    result = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.idempotency_key
+
+
+# ------------------------------ CATALOG CHANGE LOG ------------------------------
+
+class CatalogChange(models.Model):
+    """
+    One row per product/batch write. The auto id is the monotonically increasing
+    change sequence terminals sync against; deletes are detected by the row being gone.
+    """
+    KIND_CHOICES = [
+        ('product', 'Product'),
+        ('batch', 'Batch'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'object_id'])]
+
+
+# ------------------------------ DATA VERSIONS ------------------------------
+
+class DataVersion(models.Model):
+    """Counter per data scope, bumped on every write; feeds ETag/Last-Modified."""
+    scope = models.CharField(max_length=30, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.scope}@{self.version}"
+
+
+# ------------------------------ SCAN CODES ------------------------------
+
+class ScanCode(models.Model):
+    """
+    Exact-match lookup table for scanners. Rows with a batch mirror that batch's
+    batch_code (kept in sync by main.scanning); rows without one are product barcodes.
+    """
+    code = models.CharField(max_length=100)
+    product = models.ForeignKey('main.Product', on_delete=models.CASCADE, related_name='scan_codes')
+    batch = models.OneToOneField(
+        'main.ProductBatch', null=True, blank=True, on_delete=models.CASCADE, related_name='scan_code'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['code', 'product'], condition=models.Q(batch__isnull=False),
+                name='unique_batch_code_per_product',
+            ),
+            models.UniqueConstraint(
+                fields=['code'], condition=models.Q(batch__isnull=True),
+                name='unique_product_barcode',
+            ),
+        ]
+        indexes = [models.Index(fields=['code'])]
+
+    def __str__(self):
+        return self.code
+
+
+# ------------------------------ PRICE HISTORY ------------------------------
+
+class PriceRevision(models.Model):
+    """One bulk repricing run; its lines hold the before/after prices per batch."""
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name='+')
+    scope = models.JSONField(default=dict, blank=True)
+    note = models.CharField(max_length=255, blank=True)
+    batch_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Price revision {self.id} ({self.batch_count} batches)"
+
+
+class PriceRevisionLine(models.Model):
+    revision = models.ForeignKey(PriceRevision, on_delete=models.CASCADE, related_name='lines')
+    # Plain ids so history outlives deleted batches.
+    batch_id = models.IntegerField(db_index=True)
+    product_id = models.IntegerField()
+    old_selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    new_selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    old_wholesale_price = models.DecimalField(max_digits=10, decimal_places=2)
+    new_wholesale_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"Batch {self.batch_id}: {self.old_selling_price} -> {self.new_selling_price}"
+
+
+# ------------------------------ SALE ITEM SNAPSHOTS ------------------------------
+
+class SaleItemSnapshot(models.Model):
+    """
+    Unit cost and list price of a SaleItem's batch frozen at sale time, alongside the
+    quantity and unit price, so profit reports never read (possibly edited) batches.
+    """
+    sale_item = models.OneToOneField('main.SaleItem', primary_key=True, on_delete=models.CASCADE, related_name='snapshot')
+    sale = models.ForeignKey('main.Sale', on_delete=models.CASCADE, related_name='item_snapshots')
+    product = models.ForeignKey('main.Product', on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    list_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"Sale item {self.sale_item_id} @ cost {self.unit_cost}"
+
+
+# ------------------------------ STOCK BALANCE SNAPSHOTS ------------------------------
+
+class StockSnapshot(models.Model):
+    PERIOD_CHOICES = [
+        ('daily', 'Daily'),
+        ('monthly', 'Monthly'),
+    ]
+
+    taken_at = models.DateTimeField(db_index=True)
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, default='daily')
+    batch_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-taken_at']
+
+    def __str__(self):
+        return f"{self.period} stock snapshot {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey(StockSnapshot, on_delete=models.CASCADE, related_name='lines')
+    # Plain ids so balances survive deleted batches.
+    batch_id = models.IntegerField()
+    product_id = models.IntegerField()
+    quantity = models.IntegerField()
+    buying_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot', 'batch_id'], name='unique_snapshot_batch'),
+        ]
+
+
+# ------------------------------ STOCK TAKES ------------------------------
+
+class StockTake(models.Model):
+    """A physical count session. Counts accumulate while open and are applied on close."""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('closed', 'Closed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    name = models.CharField(max_length=100)
+    # Optional scope: only batches of this category are expected (and zeroed if uncounted).
+    category = models.ForeignKey('main.Category', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open', db_index=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    closed_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    closed_at = models.DateTimeField(null=True, blank=True)
+    summary = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class StockTakeCount(models.Model):
+    """
+    Quantity of one batch counted on one device. Devices counting different shelves
+    add up; a device re-submitting a batch replaces its own earlier count.
+    """
+    stock_take = models.ForeignKey(StockTake, on_delete=models.CASCADE, related_name='counts')
+    batch = models.ForeignKey('main.ProductBatch', on_delete=models.CASCADE, related_name='+')
+    device_id = models.CharField(max_length=64, blank=True, default='')
+    counted_quantity = models.PositiveIntegerField()
+    # Batch quantity on record when this count was submitted; closing applies the
+    # difference to it, so movements after the count are kept.
+    system_quantity = models.IntegerField(null=True, blank=True)
+    counted_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name='+')
+    counted_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock_take', 'batch', 'device_id'], name='unique_stock_take_count'),
+        ]
+
+
+# ------------------------------ STOCK LEVEL ALERTS ------------------------------
+
+STOCK_STATE_CHOICES = [
+    ('ok', 'In stock'),
+    ('low', 'Low stock'),
+    ('out', 'Out of stock'),
+]
+
+
+class StockLevel(models.Model):
+    """Last known total stock and alert state per product, maintained on every stock write."""
+    # Plain id: the row is removed with its product by main.stock_alerts.
+    product_id = models.IntegerField(primary_key=True)
+    state = models.CharField(max_length=3, choices=STOCK_STATE_CHOICES, db_index=True)
+    quantity = models.IntegerField()
+    threshold = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Product {self.product_id}: {self.state}"
+
+
+class StockAlertEvent(models.Model):
+    """One row per state transition; the id is the cursor dashboards poll with."""
+    product_id = models.IntegerField(db_index=True)
+    from_state = models.CharField(max_length=3, choices=STOCK_STATE_CHOICES, null=True, blank=True)
+    to_state = models.CharField(max_length=3, choices=STOCK_STATE_CHOICES)
+    quantity = models.IntegerField()
+    threshold = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"Product {self.product_id}: {self.from_state} -> {self.to_state}"
+
+
+# ------------------------------ ABC CLASSIFICATION ------------------------------
+
+ABC_CHOICES = [
+    ('A', 'A'),
+    ('B', 'B'),
+    ('C', 'C'),
+]
+
+
+class ProductClassification(models.Model):
+    """
+    Revenue and profit contribution per product over the last classification window,
+    recomputed nightly by main.classification. Products without sales are class C.
+    """
+    product = models.OneToOneField('main.Product', primary_key=True, on_delete=models.CASCADE, related_name='classification')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Cumulative shares (0-1) of the products ranked at or above this one.
+    revenue_share = models.DecimalField(max_digits=7, decimal_places=6, default=0)
+    profit_share = models.DecimalField(max_digits=7, decimal_places=6, default=0)
+    revenue_rank = models.IntegerField(db_index=True)
+    profit_rank = models.IntegerField(db_index=True)
+    abc_class = models.CharField(max_length=1, choices=ABC_CHOICES, db_index=True)
+    profit_class = models.CharField(max_length=1, choices=ABC_CHOICES, db_index=True)
+    period_start = models.DateField()
+    period_end = models.DateField()
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Product {self.product_id}: {self.abc_class}/{self.profit_class}"
+
+
+# ------------------------------ HOURLY SALES ROLLUP ------------------------------
+
+class SalesHourly(models.Model):
+    """
+    Non-refunded sales per local hour, cashier and sale type, maintained as sales are
+    confirmed or fully refunded (main.sales_rollup) and rebuilt by rebuild_sales_rollup.
+    """
+    day = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    weekday = models.PositiveSmallIntegerField()  # 0 = Monday
+    # Plain id so the rollup survives deleted users.
+    user_id = models.IntegerField(null=True, blank=True)
+    sale_type = models.CharField(max_length=20)
+    sale_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'hour', 'user_id', 'sale_type'], name='unique_sales_hour_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.hour:02d}:00 {self.sale_type}: {self.sale_count}"
+
+
+# ------------------------------ CASHIER SHIFTS ------------------------------
+
+class Shift(models.Model):
+    """A cashier's till session. Totals accumulate in ShiftTotal; closing stores the Z-report."""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('closed', 'Closed'),
+    ]
+
+    cashier = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='shifts')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open', db_index=True)
+    opening_float = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    counted_cash = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    opened_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    closed_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    z_report = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ['-opened_at']
+        constraints = [
+            models.UniqueConstraint(fields=['cashier'], condition=models.Q(status='open'), name='one_open_shift_per_cashier'),
+        ]
+
+    def __str__(self):
+        return f"Shift {self.id} ({self.status})"
+
+
+class ShiftTotal(models.Model):
+    """Running count and amount per shift, kind of movement and payment method."""
+    KIND_CHOICES = [
+        ('sale', 'Sales'),
+        ('collected', 'Collected at sale'),
+        ('loan_payment', 'Loan payment'),
+        ('refund', 'Refund'),
+        ('expense', 'Expense'),
+    ]
+
+    shift = models.ForeignKey(Shift, on_delete=models.CASCADE, related_name='totals')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payment_method = models.CharField(max_length=20, blank=True, default='')
+    count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shift', 'kind', 'payment_method'], name='unique_shift_total'),
+        ]
+
+    def __str__(self):
+        return f"Shift {self.shift_id} {self.kind}/{self.payment_method}: {self.amount}"
+
+
+# ------------------------------ DAILY SUMMARY ------------------------------
+
+class DailySummary(models.Model):
+    """
+    Per local day figures for period comparisons, maintained as sales, refunds and
+    expenses post (main.daily_summary) and rebuilt by rebuild_daily_summary.
+    Sales are gross (by sale day); refunds are counted on the day they are made.
+    """
+    day = models.DateField(unique=True)
+    sales_count = models.IntegerField(default=0)
+    sales_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    loans_count = models.IntegerField(default=0)
+    loans_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refunds_count = models.IntegerField(default=0)
+    refunds_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expenses_count = models.IntegerField(default=0)
+    expenses_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.sales_total}"
+
+
+# ------------------------------ EXPENSE ROLLUP ------------------------------
+
+class ExpenseDaily(models.Model):
+    """
+    Count and total of expenses per local day and category, maintained as expenses are
+    recorded, edited or deleted (main.expenses) and rebuilt by rebuild_expense_rollup.
+    """
+    day = models.DateField()
+    category = models.CharField(max_length=50, blank=True, default='')
+    expense_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_expense_day_category'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.category or '-'}: {self.total_amount}"
+
+
+# ------------------------------ SALE-LINE EXPORT ------------------------------
+
+class SaleDayRevision(models.Model):
+    """
+    Counter per local sale day, bumped when a refund or payment of that day's sales is
+    edited or deleted; the Parquet export rewrites days whose revision moved.
+    """
+    day = models.DateField(unique=True)
+    revision = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}@{self.revision}"
@@ -0,0 +1,35 @@
+import importlib
+import importlib.util
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+# ------------------------------ OPTIONAL DEPENDENCIES ------------------------------
+#
+# NumPy (pivots, forecasting) and pyarrow (Parquet export) are listed in
+# requirements-optional.txt rather than required: modules load them with
+# optional_import() and the views that need them call require(), which answers 503
+# when the package is missing. Everything else works without them.
+
+PACKAGES = {'numpy': 'NumPy', 'pyarrow': 'pyarrow'}
+
+
+class DependencyMissing(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "A package this feature needs is not installed on the server."
+    default_code = 'dependency_missing'
+
+
+def optional_import(name):
+    """The imported module, or None when it is not installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def require(package, feature):
+    """Raise DependencyMissing (503) for ``feature`` unless ``package`` is installed."""
+    if importlib.util.find_spec(package) is None:
+        raise DependencyMissing(f"{feature} is unavailable ({PACKAGES.get(package, package)} is not installed).")
@@ -0,0 +1,107 @@
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models_ext import OrderEvent
+from .sequences import horizon, settled
+
+
+# ------------------------------ ORDER CHANGE FEED ------------------------------
+#
+# Writers append OrderEvent rows and, once the transaction commits, wake every
+# long-poll waiting in this process. Waiters in other processes fall back to a
+# cheap primary-key probe on OrderEvent every FALLBACK_INTERVAL seconds. The cursor
+# only moves through settled ids (see sequences.py), so events committed late by a
+# long transaction are still delivered.
+
+FALLBACK_INTERVAL = 5
+MAX_WAIT = 30
+MAX_EVENTS = 200
+
+_condition = threading.Condition()
+_generation = 0
+
+
+def order_summary(order):
+    return {
+        "status": order.status,
+        "order_type": order.order_type,
+        "user_id": order.user_id,
+        "customer_id": order.customer_id,
+        "discount_amount": str(order.discount_amount or 0),
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+    }
+
+
+def _notify():
+    global _generation
+    with _condition:
+        _generation += 1
+        _condition.notify_all()
+
+
+def publish(orders, event):
+    """Record ``event`` for each order and wake local waiters after commit."""
+    if not isinstance(orders, (list, tuple)):
+        orders = [orders]
+    events = OrderEvent.objects.bulk_create([
+        OrderEvent(
+            order_id=order.id,
+            user_id=order.user_id,
+            event=event,
+            status='deleted' if event == 'deleted' else order.status,
+            summary=order_summary(order),
+        )
+        for order in orders
+    ])
+    if events:
+        transaction.on_commit(_notify)
+    return events
+
+
+def latest_cursor():
+    return horizon(OrderEvent)
+
+
+def _events_since(since, user=None):
+    rows = OrderEvent.objects.filter(id__gt=since).order_by('id')[:MAX_EVENTS]
+    events = settled([(event.id, event.created_at, event) for event in rows], since)
+    cursor = events[-1][0] if events else since
+    events = [event for _, _, event in events if user is None or event.user_id == user.id]
+    return events, cursor
+
+
+def wait_for_events(since, timeout=MAX_WAIT, user=None):
+    """
+    Block until events newer than ``since`` exist or ``timeout`` expires and return
+    (events, cursor). ``user`` restricts the feed to that user's own orders (staff);
+    the cursor still moves past other users' events.
+    """
+    if not math.isfinite(timeout):  # min() would pass nan through and never time out
+        timeout = MAX_WAIT
+    deadline = time.monotonic() + max(0, min(timeout, MAX_WAIT))
+    seen = _generation
+    while True:
+        events, cursor = _events_since(since, user)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events, cursor
+
+        with _condition:
+            if _generation == seen:
+                _condition.wait(min(FALLBACK_INTERVAL, remaining))
+            seen = _generation
+
+
+def prune_events(keep_days):
+    """Drop events older than ``keep_days``; the newest event is always kept."""
+    newest = OrderEvent.objects.order_by('-id').values_list('id', flat=True).first()
+    if newest is None:
+        return 0
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    deleted, _ = OrderEvent.objects.filter(id__lt=newest, created_at__lt=cutoff).delete()
+    return deleted
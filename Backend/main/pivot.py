@@ -0,0 +1,279 @@
+import threading
+from datetime import date, datetime, time, timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import DecimalField, F, Q, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Category, Customer, Product, SaleItem
+from .optional import optional_import
+from .versioning import CATALOG, SALES, current_versions
+
+np = optional_import('numpy')
+
+
+# ------------------------------ SALES PIVOT ENGINE ------------------------------
+#
+# Confirmed sale lines are loaded into column arrays (streamed queries) and kept per
+# process: past days as a history block, today's lines re-read whenever the sales or
+# catalog data version moves. A pivot is then a mask over the arrays, np.unique over
+# the stacked dimension keys and one bincount per measure.
+#   revenue  = line total less the line's share of the sale discount
+#   discount = that share (sale discount x line total / sale total)
+#   cost     = quantity x unit cost frozen at sale time (batch buying price if missing)
+#   profit   = revenue - cost
+
+DIMENSIONS = ('day', 'week', 'month', 'cashier', 'customer', 'category', 'product', 'sale_type')
+MEASURES = ('qty', 'revenue', 'cost', 'profit', 'discount')
+TIME_DIMENSIONS = ('day', 'week', 'month')
+KEYS = ('day', 'cashier', 'customer', 'category', 'product', 'sale_type')
+SALE_TYPES = ('retail', 'wholesale')
+
+LOAD_CHUNK = 20000
+DEFAULT_LIMIT = 1000
+
+EPOCH = date(1970, 1, 1)
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def available():
+    return np is not None
+
+
+def history_days():
+    return getattr(settings, 'PIVOT_HISTORY_DAYS', 730)
+
+
+def history_ttl():
+    return getattr(settings, 'PIVOT_HISTORY_TTL', 900)
+
+
+def _lines(since):
+    return (
+        SaleItem.objects.filter(sale__status='confirmed', sale__date__gte=since)
+        .annotate(
+            day=TruncDate('sale__date'),
+            unit_cost=Coalesce(F('snapshot__unit_cost'), F('batch__buying_price'), Value(0), output_field=MONEY),
+        )
+        .values_list(
+            'id', 'day', 'sale__user_id', 'sale__customer_id', 'product__category_id', 'product_id',
+            'sale__sale_type', 'quantity', 'total_price', 'unit_cost',
+            'sale__total_amount', 'sale__discount_amount',
+        )
+    )
+
+
+def _read(rows):
+    """Stream ``rows`` into (columns, last line id)."""
+    chunks, pending = [], []
+
+    def flush():
+        if not pending:
+            return
+        (ids, days, cashiers, customers, categories, products, sale_types,
+         qty, line_total, unit_cost, sale_total, sale_discount) = zip(*pending)
+        chunks.append({
+            'id': np.array(ids, dtype=np.int64),
+            'day': np.array(days, dtype='datetime64[D]').astype(np.int64),
+            'cashier': np.array([c or 0 for c in cashiers], dtype=np.int64),
+            'customer': np.array([c or 0 for c in customers], dtype=np.int64),
+            'category': np.array([c or 0 for c in categories], dtype=np.int64),
+            'product': np.array(products, dtype=np.int64),
+            'sale_type': np.array([SALE_TYPES.index(t) if t in SALE_TYPES else len(SALE_TYPES) for t in sale_types], dtype=np.int64),
+            'qty': np.array(qty, dtype=np.float64),
+            'line_total': np.array(line_total, dtype=np.float64),
+            'unit_cost': np.array(unit_cost, dtype=np.float64),
+            'sale_total': np.array(sale_total, dtype=np.float64),
+            'sale_discount': np.array([d or 0 for d in sale_discount], dtype=np.float64),
+        })
+        pending.clear()
+
+    for row in rows.iterator(chunk_size=LOAD_CHUNK):
+        pending.append(row)
+        if len(pending) >= LOAD_CHUNK:
+            flush()
+    flush()
+
+    names = ('id', 'day', 'cashier', 'customer', 'category', 'product', 'sale_type',
+             'qty', 'line_total', 'unit_cost', 'sale_total', 'sale_discount')
+    if chunks:
+        raw = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in names}
+    else:
+        raw = {name: np.zeros(0, dtype=np.int64 if name in KEYS + ('id',) else np.float64) for name in names}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(raw['sale_total'] > 0, raw['line_total'] / raw['sale_total'], 0.0)
+    discount = raw['sale_discount'] * share
+    revenue = raw['line_total'] - discount
+    cost = raw['qty'] * raw['unit_cost']
+
+    columns = {
+        **{name: raw[name] for name in KEYS},
+        'qty': raw['qty'],
+        'revenue': revenue,
+        'cost': cost,
+        'profit': revenue - cost,
+        'discount': discount,
+    }
+    return columns, int(raw['id'].max()) if len(raw['id']) else 0
+
+
+class SalesCube:
+    """
+    Column arrays of confirmed sale lines. Lines from before today are loaded once per
+    day (or every PIVOT_HISTORY_TTL seconds, to pick up edits to past sales); each new
+    data version only re-reads today's lines and lines added since (offline syncs are
+    often backdated). Loading happens outside the lock: while one request refreshes,
+    the others are answered from the previous snapshot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._history = None  # (first_day, today, loaded_at, columns, last_id)
+        self._current = None  # (version, columns, first_day)
+
+    def _load_history(self, first_day, today):
+        since = timezone.make_aware(datetime.combine(first_day, time.min))
+        before = timezone.make_aware(datetime.combine(today, time.min))
+        columns, last_id = _read(_lines(since).filter(sale__date__lt=before))
+        return first_day, today, monotonic(), columns, last_id
+
+    def _refresh(self, version, first_day, today):
+        history = self._history
+        if history is None or history[:2] != (first_day, today) or monotonic() - history[2] > history_ttl():
+            history = self._load_history(first_day, today)
+        _first_day, _today, _loaded_at, past, last_id = history
+
+        since = timezone.make_aware(datetime.combine(first_day, time.min))
+        midnight = timezone.make_aware(datetime.combine(today, time.min))
+        recent, _ = _read(_lines(since).filter(Q(sale__date__gte=midnight) | Q(id__gt=last_id)))
+        columns = {name: np.concatenate([past[name], recent[name]]) for name in past}
+
+        with self._lock:
+            self._history = history
+            self._current = (version, columns, first_day)
+        return columns, first_day
+
+    def snapshot(self):
+        """(columns, first_day) for the current data versions, refreshing if they moved."""
+        today = timezone.localdate()
+        first_day = today - timedelta(days=history_days() - 1)
+        version = current_versions(SALES, CATALOG) + (today,)
+        with self._lock:
+            current = self._current
+            if current is not None and (current[0] == version or (self._refreshing and current[2] == first_day)):
+                return current[1], current[2]
+            self._refreshing = True
+        try:
+            return self._refresh(version, first_day, today)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+sales_cube = SalesCube()
+
+
+def _dimension_keys(columns, dimension):
+    days = columns['day']
+    if dimension == 'day':
+        return days
+    if dimension == 'week':
+        return days - (days + 3) % 7  # 1970-01-01 was a Thursday; keys are Mondays
+    if dimension == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return columns[dimension]
+
+
+def _labels(dimension, keys):
+    keys = [int(key) for key in keys]
+    if dimension in ('day', 'week'):
+        return {key: (EPOCH + timedelta(days=key)).isoformat() for key in keys}
+    if dimension == 'month':
+        return {key: f"{1970 + key // 12:04d}-{key % 12 + 1:02d}" for key in keys}
+    if dimension == 'sale_type':
+        return {key: SALE_TYPES[key] if key < len(SALE_TYPES) else 'other' for key in keys}
+
+    model, field = {
+        'cashier': (get_user_model(), 'username'),
+        'customer': (Customer, 'name'),
+        'category': (Category, 'name'),
+        'product': (Product, 'name'),
+    }[dimension]
+    names = dict(model.objects.filter(id__in=keys).values_list('id', field))
+    return {key: names.get(key) for key in keys}
+
+
+def pivot(dimensions, measures, start=None, end=None, filters=None, order=None, limit=DEFAULT_LIMIT):
+    """
+    Group confirmed sale lines by ``dimensions`` and sum ``measures``.
+    ``filters`` may hold cashier, customer, category, product (ids) and sale_type.
+    Rows come ordered by ``order`` (a measure, descending) or by the dimension keys.
+    """
+    columns, first_day = sales_cube.snapshot()
+    filters = filters or {}
+
+    start = max(start or first_day, first_day)
+    end = end or timezone.localdate()
+    mask = (columns['day'] >= (start - EPOCH).days) & (columns['day'] <= (end - EPOCH).days)
+    for name, value in filters.items():
+        if name == 'sale_type':
+            value = SALE_TYPES.index(value)
+        mask &= columns[name] == value
+
+    totals = {measure: float(columns[measure][mask].sum()) for measure in measures}
+    if dimensions:
+        # Factorize each dimension, fold the codes into one int64 key, then group on it.
+        uniques, combined = [], np.zeros(int(mask.sum()), dtype=np.int64)
+        for dimension in dimensions:
+            values, codes = np.unique(_dimension_keys(columns, dimension)[mask], return_inverse=True)
+            uniques.append(values)
+            combined = combined * len(values) + codes.reshape(-1)
+        keys, inverse = np.unique(combined, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        groups = np.empty((len(keys), len(dimensions)), dtype=np.int64)
+        for position in range(len(dimensions) - 1, -1, -1):
+            keys, codes = np.divmod(keys, len(uniques[position]))
+            groups[:, position] = uniques[position][codes]
+        sums = {
+            measure: np.bincount(inverse, weights=columns[measure][mask], minlength=len(groups))
+            for measure in measures
+        }
+    else:
+        groups = np.zeros((1, 0), dtype=np.int64)
+        sums = {measure: np.array([totals[measure]]) for measure in measures}
+
+    if order in measures:
+        sequence = np.argsort(-sums[order], kind='stable')
+    else:
+        sequence = np.arange(len(groups))
+    sequence = sequence[:limit]
+
+    labels = {
+        dimension: _labels(dimension, np.unique(groups[sequence, position]))
+        for position, dimension in enumerate(dimensions)
+    }
+    rows = []
+    for index in sequence:
+        row = {}
+        for position, dimension in enumerate(dimensions):
+            key = int(groups[index, position])
+            row[dimension] = labels[dimension][key]
+            if dimension not in TIME_DIMENSIONS + ('sale_type',):
+                row[f"{dimension}_id"] = key or None
+        row.update({measure: round(float(sums[measure][index]), 2) for measure in measures})
+        rows.append(row)
+
+    return {
+        "start": start,
+        "end": end,
+        "dimensions": list(dimensions),
+        "measures": list(measures),
+        "group_count": len(groups),
+        "totals": {measure: round(value, 2) for measure, value in totals.items()},
+        "rows": rows,
+    }
@@ -0,0 +1,304 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F, Q
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import ProductBatch
+from .models_ext import SaleItemSnapshot
+from .rounding import round_two
+
+
+# ------------------------------ BATCH PRICING ------------------------------
+
+def batch_price(batch, order_type):
+    """Unit price a batch sells at for the given order/sale type."""
+    return batch.wholesale_price if order_type == 'wholesale' else batch.selling_price
+
+
+def load_batches(lines):
+    """
+    Fetch, in one query, every batch the lines name explicitly plus the in-stock,
+    unexpired batches of products sent without a batch.
+    """
+    explicit = {line['batch_id'] for line in lines if line.get('batch_id')}
+    unbatched = {line['product_id'] for line in lines if not line.get('batch_id')}
+
+    query = Q(id__in=explicit)
+    if unbatched:
+        query |= Q(product_id__in=unbatched, quantity__gt=0) & (
+            Q(expiry_date__isnull=True) | Q(expiry_date__gte=timezone.now().date())
+        )
+    return list(ProductBatch.objects.filter(query).order_by(F('expiry_date').asc(nulls_last=True), 'id'))
+
+
+def load_stock(lines, lock=False):
+    """
+    Live quantities ({batch_id: quantity}) of every batch ``lines`` can draw from: the
+    batches they name plus all batches of products sent without one. With ``lock`` the
+    rows are locked, in id order like every other batch lock.
+    """
+    explicit = {line['batch_id'] for line in lines if line.get('batch_id')}
+    unbatched = {line['product_id'] for line in lines if not line.get('batch_id')}
+    if not explicit and not unbatched:
+        return {}
+    rows = ProductBatch.objects.filter(Q(id__in=explicit) | Q(product_id__in=unbatched))
+    if lock:
+        rows = rows.select_for_update()
+    return dict(rows.order_by('id').values_list('id', 'quantity'))
+
+
+def allocate(lines, order_type, available=None):
+    """
+    Price ``lines`` ({product_id, batch_id?, quantity}) from their batches.
+
+    Lines without a batch are spread over the product's batches, earliest expiry first.
+    Returns (allocations, shortages); each allocation is a dict with the batch (a
+    BatchPrice), quantity, unit_price and line_total, and each shortage says how much of
+    a line could not be covered. Unknown batches or batches of another product raise a
+    ValidationError.
+
+    Prices and expiry come from the shared price table -- the lookup order confirmation
+    uses -- so quotes, sales and confirmed orders price a batch identically. Quantities
+    are live: ``available`` ({batch_id: qty}) lets several baskets draw on the same
+    stock and is updated in place; without it they are read with load_stock().
+    """
+    explicit = {line['batch_id'] for line in lines if line.get('batch_id')}
+    unbatched = {line['product_id'] for line in lines if not line.get('batch_id')}
+    by_id = price_table.batch_prices(explicit) if explicit else {}
+    by_product = price_table.product_batches(unbatched) if unbatched else {}
+    if available is None:
+        available = {batch_id: max(quantity, 0) for batch_id, quantity in load_stock(lines).items()}
+    today = timezone.now().date()
+    allocations, shortages = [], []
+
+    for index, line in enumerate(lines):
+        product_id, quantity = line['product_id'], line['quantity']
+
+        if line.get('batch_id'):
+            batch = by_id.get(line['batch_id'])
+            if batch is None:
+                raise serializers.ValidationError({"items": f"Line {index + 1}: batch not found."})
+            if batch.product_id != product_id:
+                raise serializers.ValidationError({"items": f"Line {index + 1}: batch does not belong to the selected product."})
+            # An explicit batch takes the whole line; any shortfall is reported.
+            on_hand = available.get(batch.id, 0)
+            if on_hand < quantity:
+                shortages.append({
+                    "line": index, "product_id": product_id, "batch_id": batch.id,
+                    "requested": quantity, "available": on_hand,
+                })
+            available[batch.id] = max(on_hand - quantity, 0)
+            takes = [(batch, quantity)]
+        else:
+            takes, remaining = [], quantity
+            for batch in by_product.get(product_id, ()):
+                if batch.expiry_date is not None and batch.expiry_date < today:
+                    continue
+                take = min(remaining, available.get(batch.id, 0))
+                if take > 0:
+                    takes.append((batch, take))
+                    available[batch.id] -= take
+                    remaining -= take
+                if remaining == 0:
+                    break
+            if remaining > 0:
+                shortages.append({
+                    "line": index, "product_id": product_id, "batch_id": None,
+                    "requested": quantity, "available": quantity - remaining,
+                })
+
+        for batch, take in takes:
+            unit_price = round_two(batch_price(batch, order_type))
+            allocations.append({
+                "line": index,
+                "product_id": product_id,
+                "batch": batch,
+                "quantity": take,
+                "unit_price": unit_price,
+                "line_total": round_two(unit_price * take),
+            })
+
+    return allocations, shortages
+
+
+def subtotal(allocations):
+    return round_two(sum((a['line_total'] for a in allocations), Decimal('0')))
+
+
+# ------------------------------ PRICE TABLE CACHE ------------------------------
+#
+# Process-local LRU of product -> batches with their prices and expiry. Quantities are
+# deliberately not cached: stock checks stay in the conditional UPDATE in stock.py.
+# Anything that edits batch prices/expiry or adds/removes batches sends
+# ``batches_changed``; the receiver evicts locally and bumps a version in the Django
+# cache so other processes drop their tables on their next lookup. That version only
+# reaches other workers through a shared backend (Redis, Memcached, database); with a
+# per-process cache (LocMemCache, DummyCache) entries also expire after a few seconds,
+# so another worker's edit is picked up within PRICE_TABLE_TTL at worst.
+
+BatchPrice = namedtuple(
+    'BatchPrice', ['id', 'product_id', 'batch_code', 'selling_price', 'wholesale_price', 'expiry_date']
+)
+
+batches_changed = Signal()  # kwargs: product_ids
+
+PRICE_TABLE_VERSION_KEY = 'pricing:price-table-version'
+
+SHARED_CACHE_TTL = 300
+LOCAL_CACHE_TTL = 5
+
+
+def price_table_ttl():
+    configured = getattr(settings, 'PRICE_TABLE_TTL', None)
+    if configured is not None:
+        return configured
+    local = isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+    return LOCAL_CACHE_TTL if local else SHARED_CACHE_TTL
+
+
+class PriceTable:
+    def __init__(self, max_products=2048):
+        self.max_products = max_products
+        self._lock = threading.Lock()
+        self._products = OrderedDict()  # product_id -> tuple of BatchPrice
+        self._batches = {}              # batch_id -> BatchPrice
+        self._loaded_at = {}            # product_id -> time.monotonic() of the load
+        self._version = None
+
+    def _check_version(self):
+        version = cache.get(PRICE_TABLE_VERSION_KEY)
+        if version is None:
+            cache.add(PRICE_TABLE_VERSION_KEY, 1)
+            version = cache.get(PRICE_TABLE_VERSION_KEY)
+        if version != self._version:
+            self._products.clear()
+            self._batches.clear()
+            self._loaded_at.clear()
+            self._version = version
+
+    def _evict(self, product_id):
+        for row in self._products.pop(product_id, ()):
+            self._batches.pop(row.id, None)
+        self._loaded_at.pop(product_id, None)
+
+    def _expire(self):
+        """Drop products loaded more than the TTL ago; _loaded_at is kept in load order."""
+        cutoff = time.monotonic() - price_table_ttl()
+        while self._loaded_at:
+            product_id, loaded_at = next(iter(self._loaded_at.items()))
+            if loaded_at >= cutoff:
+                break
+            self._evict(product_id)
+
+    def _store(self, product_id, rows):
+        self._evict(product_id)
+        self._products[product_id] = rows
+        self._loaded_at[product_id] = time.monotonic()
+        for row in rows:
+            self._batches[row.id] = row
+        while len(self._products) > self.max_products:
+            self._evict(next(iter(self._products)))
+
+    def _load(self, product_ids):
+        rows = defaultdict(list)
+        for values in ProductBatch.objects.filter(product_id__in=product_ids).order_by(
+            F('expiry_date').asc(nulls_last=True), 'id'
+        ).values_list(*BatchPrice._fields):
+            batch = BatchPrice(*values)
+            rows[batch.product_id].append(batch)
+        for product_id in product_ids:
+            self._store(product_id, tuple(rows.get(product_id, ())))
+
+    def product_batches(self, product_ids):
+        """{product_id: (BatchPrice, ...)} earliest expiry first; misses cost one query."""
+        with self._lock:
+            self._check_version()
+            self._expire()
+            missing = [pid for pid in set(product_ids) if pid not in self._products]
+            if missing:
+                self._load(missing)
+            result = {}
+            for pid in set(product_ids):
+                self._products.move_to_end(pid)
+                result[pid] = self._products[pid]
+            return result
+
+    def batch_prices(self, batch_ids):
+        """{batch_id: BatchPrice}; unknown batches are simply absent."""
+        with self._lock:
+            self._check_version()
+            self._expire()
+            missing = {bid for bid in batch_ids if bid not in self._batches}
+            if missing:
+                product_ids = set(
+                    ProductBatch.objects.filter(id__in=missing).values_list('product_id', flat=True)
+                )
+                self._load(list(product_ids))
+            return {bid: self._batches[bid] for bid in batch_ids if bid in self._batches}
+
+    def invalidate(self, product_ids=None):
+        with self._lock:
+            if product_ids is None:
+                self._products.clear()
+                self._batches.clear()
+                self._loaded_at.clear()
+            else:
+                for pid in product_ids:
+                    self._evict(pid)
+            try:
+                version = cache.incr(PRICE_TABLE_VERSION_KEY)
+            except ValueError:
+                cache.add(PRICE_TABLE_VERSION_KEY, 1)
+                version = None
+            # Our own eviction is already done; only other writers should force a full reload.
+            if version is not None and self._version == version - 1:
+                self._version = version
+
+
+price_table = PriceTable()
+
+
+@receiver(batches_changed)
+def _invalidate_price_table(sender, product_ids=None, **kwargs):
+    product_ids = list(product_ids) if product_ids is not None else None
+    # Evict after commit so no process can re-cache the pre-edit rows.
+    transaction.on_commit(lambda: price_table.invalidate(product_ids))
+
+
+# ------------------------------ SALE COST SNAPSHOTS ------------------------------
+
+def snapshot_sale_items(sale_items):
+    """
+    Freeze each new SaleItem's batch cost and list (selling) price. Call right after
+    bulk-creating the items, inside the same transaction.
+    """
+    batch_ids = {item.batch_id for item in sale_items if item.batch_id}
+    costs = {
+        batch_id: (buying, selling)
+        for batch_id, buying, selling in ProductBatch.objects.filter(id__in=batch_ids).values_list(
+            'id', 'buying_price', 'selling_price'
+        )
+    }
+    snapshots = []
+    for item in sale_items:
+        unit_cost, list_price = costs.get(item.batch_id, (Decimal('0'), item.price_per_unit))
+        snapshots.append(SaleItemSnapshot(
+            sale_item_id=item.pk,
+            sale_id=item.sale_id,
+            product_id=item.product_id,
+            quantity=item.quantity,
+            unit_price=item.price_per_unit,
+            unit_cost=unit_cost,
+            list_price=list_price,
+        ))
+    return SaleItemSnapshot.objects.bulk_create(snapshots)
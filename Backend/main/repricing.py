@@ -0,0 +1,115 @@
+from decimal import Decimal
+
+from django.db.models import DecimalField
+from rest_framework import serializers
+
+from .catalog import record_changes
+from .models import ProductBatch
+from .models_ext import PriceRevision, PriceRevisionLine
+from .pricing import batches_changed
+from .rounding import round_two
+from .stock import CASE_CHUNK, per_batch
+
+
+# ------------------------------ BULK REPRICING ------------------------------
+#
+# A revision is planned from one read of the affected batches (locked), written with
+# set-based UPDATEs and recorded as a PriceRevision with one line per batch. A dry run
+# stops after planning. Both percentage and explicit revisions write each line's planned
+# prices (a CASE per column, chunked to keep statements bounded), so the stored lines
+# are exactly what was applied -- rounding happens once, in Python.
+
+PREVIEW_LIMIT = 50
+
+PRICE_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+
+def batch_scope(category_id=None, product_ids=None, batch_ids=None):
+    batches = ProductBatch.objects.all()
+    if category_id:
+        batches = batches.filter(product__category_id=category_id)
+    if product_ids:
+        batches = batches.filter(product_id__in=product_ids)
+    if batch_ids:
+        batches = batches.filter(id__in=batch_ids)
+    return batches
+
+
+def _factor(pct):
+    return Decimal('1') + Decimal(pct) / Decimal('100')
+
+
+def _current_prices(batches):
+    return list(
+        batches.select_for_update(of=('self',))
+        .order_by('id')
+        .values_list('id', 'product_id', 'selling_price', 'wholesale_price')
+    )
+
+
+def plan_percentage(batches, selling_pct=None, wholesale_pct=None):
+    lines = []
+    for batch_id, product_id, selling, wholesale in _current_prices(batches):
+        lines.append(PriceRevisionLine(
+            batch_id=batch_id,
+            product_id=product_id,
+            old_selling_price=selling,
+            new_selling_price=round_two(selling * _factor(selling_pct)) if selling_pct is not None else selling,
+            old_wholesale_price=wholesale,
+            new_wholesale_price=round_two(wholesale * _factor(wholesale_pct)) if wholesale_pct is not None else wholesale,
+        ))
+    return lines
+
+
+def plan_explicit(prices):
+    """``prices``: [{batch_id, selling_price?, wholesale_price?}]."""
+    by_batch = {entry['batch_id']: entry for entry in prices}
+    current = _current_prices(ProductBatch.objects.filter(id__in=by_batch))
+    missing = sorted(set(by_batch) - {row[0] for row in current})
+    if missing:
+        raise serializers.ValidationError({"prices": f"Batches not found: {missing}"})
+
+    lines = []
+    for batch_id, product_id, selling, wholesale in current:
+        entry = by_batch[batch_id]
+        lines.append(PriceRevisionLine(
+            batch_id=batch_id,
+            product_id=product_id,
+            old_selling_price=selling,
+            new_selling_price=round_two(entry.get('selling_price', selling)),
+            old_wholesale_price=wholesale,
+            new_wholesale_price=round_two(entry.get('wholesale_price', wholesale)),
+        ))
+    return lines
+
+
+def apply_lines(lines):
+    for start in range(0, len(lines), CASE_CHUNK):
+        chunk = lines[start:start + CASE_CHUNK]
+        ProductBatch.objects.filter(id__in=[line.batch_id for line in chunk]).update(
+            selling_price=per_batch({line.batch_id: line.new_selling_price for line in chunk}, PRICE_FIELD),
+            wholesale_price=per_batch({line.batch_id: line.new_wholesale_price for line in chunk}, PRICE_FIELD),
+        )
+
+
+def line_preview(line):
+    return {
+        "batch_id": line.batch_id,
+        "product_id": line.product_id,
+        "old_selling_price": line.old_selling_price,
+        "new_selling_price": line.new_selling_price,
+        "old_wholesale_price": line.old_wholesale_price,
+        "new_wholesale_price": line.new_wholesale_price,
+    }
+
+
+def record_revision(lines, user, scope, note=''):
+    """Store the revision and tell the catalog feed and price table what moved."""
+    revision = PriceRevision.objects.create(created_by=user, scope=scope, note=note, batch_count=len(lines))
+    for line in lines:
+        line.revision = revision
+    PriceRevisionLine.objects.bulk_create(lines, batch_size=1000)
+
+    record_changes('batch', [line.batch_id for line in lines])
+    batches_changed.send(sender=PriceRevision, product_ids={line.product_id for line in lines})
+    return revision
@@ -0,0 +1,124 @@
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Sale
+from .models_ext import SalesHourly
+
+
+# ------------------------------ HOURLY SALES ROLLUP ------------------------------
+#
+# SalesHourly keeps count and value of non-refunded sales per (local day, hour, cashier,
+# sale type). Every path that creates sales calls record_sales() with the new rows; a
+# full refund calls it with sign=-1, matching reports that exclude refunded sales.
+# Heatmaps then read at most 24 rows per day per cashier and sale type instead of
+# every sale; rebuild() regroups the sales table when the rollup needs resetting.
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+REBUILD_CHUNK = 2000
+
+
+def _bucket(moment):
+    local = timezone.localtime(moment)
+    return local.date(), local.hour
+
+
+def record_sales(sales, sign=1):
+    """Add (or with ``sign=-1`` remove) ``sales`` to their hour buckets."""
+    buckets = defaultdict(lambda: [0, Decimal('0')])
+    for sale in sales:
+        day, hour = _bucket(sale.date)
+        bucket = buckets[(day, hour, sale.user_id, sale.sale_type)]
+        bucket[0] += sign
+        bucket[1] += sign * (sale.final_amount or 0)
+
+    for (day, hour, user_id, sale_type), (count, amount) in buckets.items():
+        rows = SalesHourly.objects.filter(day=day, hour=hour, user_id=user_id, sale_type=sale_type)
+        if rows.update(sale_count=F('sale_count') + count, total_amount=F('total_amount') + amount):
+            continue
+        _row, created = SalesHourly.objects.get_or_create(
+            day=day, hour=hour, user_id=user_id, sale_type=sale_type,
+            defaults={'weekday': day.weekday(), 'sale_count': count, 'total_amount': amount},
+        )
+        if not created:  # another till created the bucket first
+            rows.update(sale_count=F('sale_count') + count, total_amount=F('total_amount') + amount)
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """Recompute the rollup from the sales table, from local day ``since`` or entirely."""
+    buckets = SalesHourly.objects.all()
+    sales = Sale.objects.exclude(status='refunded')
+    if since is not None:
+        buckets = buckets.filter(day__gte=since)
+        sales = sales.filter(date__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    buckets.delete()
+
+    grouped = (
+        sales.annotate(bucket=TruncHour('date'))
+        .values('bucket', 'user_id', 'sale_type')
+        .annotate(sale_count=Count('id'), total_amount=Sum('final_amount'))
+        .order_by()
+        .values_list('bucket', 'user_id', 'sale_type', 'sale_count', 'total_amount')
+    )
+
+    count, pending = 0, []
+    for bucket, user_id, sale_type, sale_count, total_amount in grouped.iterator(chunk_size=REBUILD_CHUNK):
+        day, hour = _bucket(bucket)
+        pending.append(SalesHourly(
+            day=day, hour=hour, weekday=day.weekday(), user_id=user_id, sale_type=sale_type,
+            sale_count=sale_count, total_amount=total_amount or 0,
+        ))
+        if len(pending) >= REBUILD_CHUNK:
+            SalesHourly.objects.bulk_create(pending)
+            count += len(pending)
+            pending = []
+    SalesHourly.objects.bulk_create(pending)
+    return count + len(pending)
+
+
+def heatmap(start, end, user_id=None, sale_type=None):
+    """
+    Weekday x hour grid of sale counts and values for local days ``start``..``end``.
+    ``counts``/``amounts`` are 7 rows (Monday first) of 24 hours each.
+    """
+    rows = SalesHourly.objects.filter(day__gte=start, day__lte=end)
+    if user_id is not None:
+        rows = rows.filter(user_id=user_id)
+    if sale_type:
+        rows = rows.filter(sale_type=sale_type)
+
+    counts = [[0] * 24 for _ in WEEKDAYS]
+    amounts = [[Decimal('0')] * 24 for _ in WEEKDAYS]
+    for weekday, hour, sale_count, total_amount in (
+        rows.values('weekday', 'hour')
+        .annotate(sale_count=Sum('sale_count'), total_amount=Sum('total_amount'))
+        .values_list('weekday', 'hour', 'sale_count', 'total_amount')
+    ):
+        counts[weekday][hour] = sale_count
+        amounts[weekday][hour] = total_amount
+
+    busiest = max(
+        ((weekday, hour) for weekday in range(7) for hour in range(24)),
+        key=lambda cell: (counts[cell[0]][cell[1]], amounts[cell[0]][cell[1]]),
+    )
+    return {
+        "start": start,
+        "end": end,
+        "weekdays": WEEKDAYS,
+        "counts": counts,
+        "amounts": amounts,
+        "total_count": sum(map(sum, counts)),
+        "total_amount": sum((sum(row, Decimal('0')) for row in amounts), Decimal('0')),
+        "busiest": {
+            "weekday": WEEKDAYS[busiest[0]],
+            "hour": busiest[1],
+            "count": counts[busiest[0]][busiest[1]],
+        } if counts[busiest[0]][busiest[1]] else None,
+    }
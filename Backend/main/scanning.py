@@ -0,0 +1,112 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ProductBatch
+from .models_ext import ScanCode
+from .pricing import batch_price, load_batches
+
+
+# ------------------------------ SCAN CODES ------------------------------
+#
+# ScanCode mirrors every batch_code (one row per batch) and holds optional product
+# barcodes, so a scanned label resolves with a single indexed equality lookup.
+# Batch rows disappear with their batch through the FK cascade. Saves that leave the
+# code and product alone (quantity and price updates) do not touch ScanCode; batches
+# without a code, or whose code another batch of the product already owns, are not
+# indexed -- the same rows sync_scan_codes skips.
+
+logger = logging.getLogger(__name__)
+
+SCAN_FIELDS = {'batch_code', 'product', 'product_id'}
+
+
+def _scan_key(instance):
+    # Read from __dict__ so deferred fields are not fetched just to compare them.
+    return instance.__dict__.get('batch_code'), instance.__dict__.get('product_id')
+
+
+@receiver(post_init, sender=ProductBatch)
+def _remember_batch_code(sender, instance, **kwargs):
+    instance._scan_key = _scan_key(instance)
+
+
+@receiver(post_save, sender=ProductBatch)
+def _sync_batch_code(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not SCAN_FIELDS.intersection(update_fields):
+        return
+    key = _scan_key(instance)
+    if not created and key == getattr(instance, '_scan_key', None):
+        return
+    instance._scan_key = key
+
+    code, product_id = key
+    if not code:
+        ScanCode.objects.filter(batch_id=instance.id).delete()
+        return
+    try:
+        with transaction.atomic():  # a conflict must not break the caller's transaction
+            updated = ScanCode.objects.filter(batch_id=instance.id).update(code=code, product_id=product_id)
+            if not updated:
+                ScanCode.objects.create(code=code, product_id=product_id, batch=instance)
+    except IntegrityError:
+        logger.warning(
+            "Batch %s: code %r is already used by another batch of product %s; scan mapping left unchanged.",
+            instance.id, code, product_id,
+        )
+
+
+def set_barcode(product, barcode):
+    """Replace the product's barcode; an empty value removes it."""
+    ScanCode.objects.filter(product=product, batch__isnull=True).delete()
+    if barcode:
+        ScanCode.objects.create(code=barcode, product=product)
+
+
+def compact_record(product, batch, order_type='retail', matched_on='batch_code'):
+    today = timezone.now().date()
+    return {
+        "product_id": product.id,
+        "product_name": product.name,
+        "category_name": product.category.name if product.category_id else None,
+        "matched_on": matched_on,
+        "batch_id": batch.id if batch else None,
+        "batch_code": batch.batch_code if batch else None,
+        "expiry_date": batch.expiry_date if batch else None,
+        "expired": bool(batch and batch.expiry_date and batch.expiry_date < today),
+        "quantity": batch.quantity if batch else 0,
+        "unit_price": batch_price(batch, order_type) if batch else None,
+        "selling_price": batch.selling_price if batch else None,
+        "wholesale_price": batch.wholesale_price if batch else None,
+    }
+
+
+def resolve_code(code, order_type='retail'):
+    """
+    Resolve a scanned code to compact product+batch+price records.
+
+    A batch label resolves in one query. A product barcode resolves to the batch the
+    till would sell next (earliest expiry with stock), which costs one more query.
+    """
+    matches = list(
+        ScanCode.objects.filter(code=code).select_related('product__category', 'batch')
+    )
+    barcode_hits = [match for match in matches if match.batch_id is None]
+
+    next_batch = {}
+    if barcode_hits:
+        for batch in load_batches([{"product_id": match.product_id} for match in barcode_hits]):
+            next_batch.setdefault(batch.product_id, batch)
+
+    return [
+        compact_record(
+            match.product,
+            match.batch if match.batch_id else next_batch.get(match.product_id),
+            order_type,
+            matched_on='batch_code' if match.batch_id else 'barcode',
+        )
+        for match in matches
+    ]
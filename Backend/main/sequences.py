@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+# ------------------------------ CHANGE-LOG CURSORS ------------------------------
+#
+# CatalogChange and OrderEvent ids double as sync cursors, but ids are handed out at
+# insert time and rows become visible at commit time: a long transaction can commit id
+# N after a reader has already moved past N. Readers therefore only advance through the
+# gap-free part of the log. A gap is either a transaction still in flight or one that
+# rolled back; once the row after it is older than CHANGE_SETTLE_SECONDS it is treated
+# as rolled back and skipped.
+
+HORIZON_SCAN = 1000
+
+
+def settle_seconds():
+    return getattr(settings, 'CHANGE_SETTLE_SECONDS', 60)
+
+
+def settled(rows, since):
+    """Leading part of ``rows`` -- (id, created_at, ...) after ``since``, by id -- safe to serve."""
+    settle_before = timezone.now() - timedelta(seconds=settle_seconds())
+    expected = since + 1
+    for position, row in enumerate(rows):
+        if row[0] != expected and row[1] > settle_before:
+            return rows[:position]
+        expected = row[0] + 1
+    return rows
+
+
+def horizon(model):
+    """Cursor for a reader starting now: the last id with no possibly in-flight id below it."""
+    newest = list(model.objects.order_by('-id').values_list('id', 'created_at')[:HORIZON_SCAN])[::-1]
+    if not newest:
+        return 0
+    # Rows older than the newest HORIZON_SCAN are taken as settled.
+    return (settled(newest[1:], newest[0][0]) or newest[:1])[-1][0]
@@ -1,16 +1,29 @@
+import uuid
+from collections import defaultdict
 from datetime import timedelta
 from django.utils import timezone
+from django.db.models import Case, DateTimeField, Sum, Value, When
 from rest_framework import serializers
 from .models import (
     Category, Customer, ProductBatch, Refund, User, Product, StockEntry,
     Sale, SaleItem, Expense, Payment,
     Order, OrderItem
 )
+from .models_ext import OrderEvent, PriceRevisionLine, Shift, StockTake, SyncReceipt
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import update_last_login
 from django.db import transaction
 from .rounding import round_two
+from .pricing import allocate, batch_price, load_stock, price_table, snapshot_sale_items, subtotal
+from .daily_summary import tally_refunds, tally_sales
+from .sales_rollup import record_sales
+from .shifts import accumulate, post_sales
+from .stock import deduct_stock, restore_stock
+from .repricing import (
+    PREVIEW_LIMIT, apply_lines, batch_scope, line_preview,
+    plan_explicit, plan_percentage, record_revision,
+)
 from decimal import Decimal, ROUND_HALF_UP
 
 
@@ -144,13 +157,16 @@ class ProductSerializer(serializers.ModelSerializer):
     soon_expiring_batches = serializers.SerializerMethodField()
     expired_batches = serializers.SerializerMethodField()
     batches = serializers.SerializerMethodField()  # change this
+    abc_class = serializers.CharField(source='classification.abc_class', read_only=True)
+    profit_class = serializers.CharField(source='classification.profit_class', read_only=True)
 
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'category', 'category_name', 'threshold',
             'created_at', 'total_stock', 'low_stock',
-            'soon_expiring_batches', 'expired_batches', 'batches'
+            'soon_expiring_batches', 'expired_batches', 'batches',
+            'abc_class', 'profit_class',
         ]
 
     def get_batches(self, obj):
@@ -197,6 +213,95 @@ class ProductSerializer(serializers.ModelSerializer):
         return ProductBatchSerializer(expired_batches, many=True).data
 
 
+class RepriceLineSerializer(serializers.Serializer):
+    batch_id = serializers.IntegerField()
+    selling_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    wholesale_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+
+    def validate(self, data):
+        if 'selling_price' not in data and 'wholesale_price' not in data:
+            raise serializers.ValidationError("Give a selling_price and/or wholesale_price.")
+        return data
+
+
+class RepriceSerializer(serializers.Serializer):
+    """
+    Bulk price revision. Either percentages over a scope (category, products and/or
+    batches) or an explicit per-batch price list. ``dry_run`` returns the preview only.
+    """
+    category_id = serializers.IntegerField(required=False)
+    product_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    batch_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    selling_pct = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal('-99.99'), required=False)
+    wholesale_pct = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal('-99.99'), required=False)
+    prices = RepriceLineSerializer(many=True, required=False, allow_empty=False)
+    dry_run = serializers.BooleanField(default=False)
+    note = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+    def validate(self, data):
+        percentage = 'selling_pct' in data or 'wholesale_pct' in data
+        scoped = any(key in data for key in ('category_id', 'product_ids', 'batch_ids'))
+
+        if percentage and 'prices' in data:
+            raise serializers.ValidationError("Use either percentages or an explicit price list, not both.")
+        if not percentage and 'prices' not in data:
+            raise serializers.ValidationError("Give selling_pct/wholesale_pct or a prices list.")
+        if percentage and not scoped:
+            raise serializers.ValidationError("Percentage revisions need a category_id, product_ids or batch_ids.")
+        if 'prices' in data:
+            batch_ids = [entry['batch_id'] for entry in data['prices']]
+            if len(set(batch_ids)) != len(batch_ids):
+                raise serializers.ValidationError({"prices": "Each batch can only be listed once."})
+        return data
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        selling_pct = validated_data.get('selling_pct')
+        wholesale_pct = validated_data.get('wholesale_pct')
+
+        if 'prices' in validated_data:
+            lines = plan_explicit(validated_data['prices'])
+            scope = {"batch_ids": [line.batch_id for line in lines]}
+        else:
+            scope = {
+                key: validated_data[key]
+                for key in ('category_id', 'product_ids', 'batch_ids') if key in validated_data
+            }
+            lines = plan_percentage(batch_scope(**scope), selling_pct, wholesale_pct)
+            scope.update({
+                "selling_pct": str(selling_pct) if selling_pct is not None else None,
+                "wholesale_pct": str(wholesale_pct) if wholesale_pct is not None else None,
+            })
+
+        result = {
+            "dry_run": validated_data['dry_run'],
+            "revision_id": None,
+            "batch_count": len(lines),
+            "product_count": len({line.product_id for line in lines}),
+            "lines": [line_preview(line) for line in lines[:PREVIEW_LIMIT]],
+        }
+        if validated_data['dry_run'] or not lines:
+            return result
+
+        apply_lines(lines)
+        result['revision_id'] = record_revision(lines, user, scope, validated_data['note']).id
+        return result
+
+
+class PriceRevisionLineSerializer(serializers.ModelSerializer):
+    revision_date = serializers.DateTimeField(source='revision.created_at', read_only=True)
+    revised_by = serializers.CharField(source='revision.created_by', read_only=True, default=None)
+    note = serializers.CharField(source='revision.note', read_only=True)
+
+    class Meta:
+        model = PriceRevisionLine
+        fields = [
+            'revision', 'revision_date', 'revised_by', 'note',
+            'old_selling_price', 'new_selling_price',
+            'old_wholesale_price', 'new_wholesale_price',
+        ]
+
+
 # ------------------------------ CUSTOMER ------------------------------
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -226,6 +331,40 @@ class StockEntrySerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_id', 'batch', 'entry_type', 'quantity', 'date', 'recorded_by']
 
 
+class StockTakeSerializer(serializers.ModelSerializer):
+    created_by = serializers.StringRelatedField(read_only=True)
+    closed_by = serializers.StringRelatedField(read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True, default=None)
+
+    class Meta:
+        model = StockTake
+        fields = [
+            'id', 'name', 'category', 'category_name', 'status',
+            'created_by', 'created_at', 'closed_by', 'closed_at', 'summary',
+        ]
+        read_only_fields = ['id', 'status', 'created_at', 'closed_at', 'summary']
+
+
+class StockCountLineSerializer(serializers.Serializer):
+    batch_id = serializers.IntegerField()
+    counted_quantity = serializers.IntegerField(min_value=0)
+
+
+class StockCountSubmitSerializer(serializers.Serializer):
+    device_id = serializers.CharField(max_length=64, required=False, allow_blank=True, default='')
+    counts = StockCountLineSerializer(many=True, allow_empty=False)
+
+    def validate_counts(self, value):
+        batch_ids = [entry['batch_id'] for entry in value]
+        if len(set(batch_ids)) != len(batch_ids):
+            raise serializers.ValidationError("Each batch can only be listed once per submission.")
+        return value
+
+
+class StockTakeCloseSerializer(serializers.Serializer):
+    zero_uncounted = serializers.BooleanField(default=False)
+
+
 
 # ------------------------------ ORDERS ------------------------------
 
@@ -337,6 +476,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
         with transaction.atomic():
             order = Order.objects.create(user=request.user, **validated_data)
+            prices = price_table.batch_prices([item['batch'].id for item in items_data if item.get('batch')])
 
             order_items = []
             for item_data in items_data:
@@ -349,7 +489,7 @@ class OrderSerializer(serializers.ModelSerializer):
                 if batch.product_id != product.id:
                     raise serializers.ValidationError("Batch does not belong to the selected product.")
 
-                unit_price = batch.wholesale_price if order_type == 'wholesale' else batch.selling_price
+                unit_price = batch_price(prices[batch.id], order_type)
 
                 order_items.append(OrderItem(
                     order=order,
@@ -364,6 +504,48 @@ class OrderSerializer(serializers.ModelSerializer):
         return order
 
 
+class OrderListItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    batch_code = serializers.CharField(source='batch.batch_code', read_only=True, default=None)
+    line_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product_id', 'product_name', 'batch_id', 'batch_code', 'quantity', 'unit_price', 'line_total']
+
+    def get_line_total(self, obj):
+        return str(round_two(obj.unit_price * obj.quantity))
+
+
+class OrderListSerializer(serializers.ModelSerializer):
+    """
+    Flat, read-only order rows for list pages. Expects items, products and batches
+    to be prefetched so a page costs a fixed number of queries.
+    """
+    user = serializers.CharField(source='user.username', read_only=True, default=None)
+    customer_name = serializers.CharField(source='customer.name', read_only=True, default=None)
+    items = OrderListItemSerializer(many=True, read_only=True)
+    subtotal = serializers.SerializerMethodField()
+    total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'user_id', 'user', 'customer_id', 'customer_name',
+            'order_type', 'status', 'notes', 'discount_amount', 'created_at',
+            'items', 'subtotal', 'total',
+        ]
+
+    def _subtotal(self, obj):
+        return sum((item.unit_price * item.quantity for item in obj.items.all()), Decimal('0'))
+
+    def get_subtotal(self, obj):
+        return str(round_two(self._subtotal(obj)))
+
+    def get_total(self, obj):
+        return str(round_two(max(self._subtotal(obj) - (obj.discount_amount or 0), Decimal('0'))))
+
+
 class OrderUpdateSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
     customer_id = serializers.PrimaryKeyRelatedField(
@@ -426,35 +608,64 @@ class OrderUpdateSerializer(serializers.ModelSerializer):
             instance.save()
 
             if items_data is not None:
-                # Delete old items first
-                instance.items.all().delete()
-
-                order_type = validated_data.get('order_type', instance.order_type)
-                order_items = []
+                self.merge_items(instance, items_data, validated_data.get('order_type', instance.order_type))
 
-                for item_data in items_data:
-                    batch = item_data.get('batch')
-                    product = item_data.get('product')
-                    quantity = item_data.get('quantity')
-
-                    if not batch:
-                        raise serializers.ValidationError("Batch is required for each item.")
-                    if batch.product_id != product.id:
-                        raise serializers.ValidationError("Batch does not belong to the selected product.")
+        return instance
 
-                    unit_price = batch.wholesale_price if order_type == 'wholesale' else batch.selling_price
+    def merge_items(self, instance, items_data, order_type):
+        """
+        Match incoming lines to existing items by (product, batch): changed lines are
+        bulk-updated, new ones bulk-created and only the dropped ones deleted.
+        """
+        incoming = {}
+        for item_data in items_data:
+            batch = item_data.get('batch')
+            product = item_data.get('product')
 
-                    order_items.append(OrderItem(
-                        order=instance,
-                        product=product,
-                        batch=batch,
-                        quantity=quantity,
-                        unit_price=unit_price,
-                    ))
+            if not batch:
+                raise serializers.ValidationError("Batch is required for each item.")
+            if batch.product_id != product.id:
+                raise serializers.ValidationError("Batch does not belong to the selected product.")
 
-                OrderItem.objects.bulk_create(order_items)
+            key = (product.id, batch.id)
+            if key in incoming:
+                incoming[key]['quantity'] += item_data.get('quantity')
+            else:
+                incoming[key] = {'batch': batch, 'quantity': item_data.get('quantity')}
+
+        existing = {}
+        to_delete = []
+        for item in instance.items.all():
+            key = (item.product_id, item.batch_id)
+            if key in incoming and key not in existing:
+                existing[key] = item
+            else:
+                to_delete.append(item.id)
+
+        prices = price_table.batch_prices([batch_id for _product_id, batch_id in incoming])
+        to_update, to_create = [], []
+        for (product_id, batch_id), line in incoming.items():
+            unit_price = batch_price(prices[batch_id], order_type)
+            item = existing.get((product_id, batch_id))
+            if item is None:
+                to_create.append(OrderItem(
+                    order=instance,
+                    product_id=product_id,
+                    batch_id=batch_id,
+                    quantity=line['quantity'],
+                    unit_price=unit_price,
+                ))
+            elif item.quantity != line['quantity'] or item.unit_price != unit_price:
+                item.quantity = line['quantity']
+                item.unit_price = unit_price
+                to_update.append(item)
 
-        return instance
+        if to_delete:
+            OrderItem.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            OrderItem.objects.bulk_update(to_update, ['quantity', 'unit_price'])
+        if to_create:
+            OrderItem.objects.bulk_create(to_create)
 
 
 
@@ -503,6 +714,13 @@ class SaleItemSerializer(serializers.ModelSerializer):
         return data
 
 
+class SaleLineInputSerializer(serializers.Serializer):
+    """Plain ids so a basket is resolved with one batch query instead of one per line."""
+    product_id = serializers.IntegerField()
+    batch_id = serializers.IntegerField(required=False, allow_null=True)
+    quantity = serializers.IntegerField(min_value=1)
+
+
 class SaleSerializer(serializers.ModelSerializer):
     items = SaleItemSerializer(many=True, read_only=True)
     user = serializers.StringRelatedField(read_only=True)
@@ -521,7 +739,7 @@ class SaleSerializer(serializers.ModelSerializer):
         max_digits=10, decimal_places=2, required=False, min_value=0, default=0
     )
 
-    items_input = SaleItemSerializer(many=True, write_only=True, source='items')
+    items_input = SaleLineInputSerializer(many=True, write_only=True, source='items', allow_empty=False)
 
     class Meta:
         model = Sale
@@ -544,95 +762,84 @@ class SaleSerializer(serializers.ModelSerializer):
             if not customer_name or not customer_phone:
                 raise serializers.ValidationError("Wholesale sales require customer name and phone.")
 
-        # Optional sanity check: discount cannot exceed subtotal
-        if 'items' in self.initial_data:
-            subtotal = 0
-            for item in self.initial_data['items']:
-                price = float(item.get('unit_price', 0))
-                qty = float(item.get('quantity', 0))
-                subtotal += price * qty
+        # Price every line from its batch in one lookup; client prices are ignored.
+        allocations, shortages = allocate(data.get('items', []), sale_type)
+        if shortages:
+            raise serializers.ValidationError({"detail": "Insufficient stock.", "shortages": shortages})
 
-            discount = float(data.get('discount_amount', 0))
-            if discount > subtotal:
-                raise serializers.ValidationError("Discount cannot exceed subtotal.")
+        # Sanity check: discount cannot exceed subtotal
+        if (data.get('discount_amount') or 0) > subtotal(allocations):
+            raise serializers.ValidationError("Discount cannot exceed subtotal.")
 
+        data['allocations'] = allocations
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         request = self.context['request']
-        items_data = validated_data.pop('items')
+        validated_data.pop('items')
+        allocations = validated_data.pop('allocations')
         sale_type = validated_data.get('sale_type', 'retail')
         user = request.user
 
         # Handle customer logic
         customer = validated_data.pop('customer', None)
+        name = validated_data.pop('customer_name', None)
+        phone = validated_data.pop('customer_phone', None)
         if sale_type == 'wholesale':
-            name = validated_data.pop('customer_name', None)
-            phone = validated_data.pop('customer_phone', None)
-
             if not customer and not (name and phone):
                 raise serializers.ValidationError("Wholesale sales require customer name and phone.")
 
             if not customer:
                 customer, _ = Customer.objects.get_or_create(phone=phone, defaults={'name': name})
             validated_data['customer'] = customer
-        else:
-            validated_data.pop('customer', None)
 
         # Get discount and paid amount safely
-        discount_amount = validated_data.get('discount_amount') or 0
-        paid_amount = validated_data.get('paid_amount') or 0
+        discount_amount = validated_data.get('discount_amount') or Decimal('0')
+        paid_amount = validated_data.get('paid_amount') or Decimal('0')
+
+        total = subtotal(allocations)
+        # Apply raw discount amount
+        final_amount = round_two(max(total - discount_amount, Decimal('0')))
 
-        # Create sale instance
+        validated_data.update(
+            total_amount=total,
+            discount_amount=discount_amount,
+            final_amount=final_amount,
+            paid_amount=paid_amount,
+            payment_status=payment_state(paid_amount, final_amount)[0],
+        )
         sale = Sale.objects.create(user=user, **validated_data)
+        record_sales([sale])
+        post_sales(user, [sale])
 
-        total = 0
-        for item_data in items_data:
-            product = item_data['product']
-            batch = item_data.get('batch', None)
-            quantity = item_data['quantity']
-            price = product.wholesale_price if sale_type == 'wholesale' else product.selling_price
-            price = round_two(price)
-            total_price = round_two(price * quantity)
-
-            SaleItem.objects.create(
+        sale_items = SaleItem.objects.bulk_create([
+            SaleItem(
                 sale=sale,
-                product=product,
-                batch=batch,
-                quantity=quantity,
-                price_per_unit=price,
-                total_price=total_price
+                product_id=a['product_id'],
+                batch_id=a['batch'].id,
+                quantity=a['quantity'],
+                price_per_unit=a['unit_price'],
+                total_price=a['line_total'],
             )
+            for a in allocations
+        ])
+        tally_sales([sale], snapshot_sale_items(sale_items))
 
-            # Deduct stock with batch-aware logic
-            if batch:
-                batch.remove_stock(quantity, user)
-            else:
-                product.remove_stock(quantity, user)
+        # Deduct stock for the whole basket in one conditional update
+        deduct_stock([(a['product_id'], a['batch'].id, a['quantity']) for a in allocations], user)
 
-            total += total_price
+        return sale
 
-        # Round total amount
-        total = round_two(total)
-        # Apply raw discount amount
-        final_amount = round_two(max(total - float(discount_amount), 0))
-
-        sale.total_amount = total
-        sale.discount_amount = discount_amount
-        sale.final_amount = final_amount
-        sale.paid_amount = paid_amount
-
-        # Payment status logic
-        if paid_amount >= final_amount:
-            sale.payment_status = 'paid'
-        elif paid_amount > 0:
-            sale.payment_status = 'partial'
-        else:
-            sale.payment_status = 'not_paid'
 
-        sale.save()
-        return sale
 
+def payment_state(amount_paid, final_amount):
+    """Return (payment_status, is_loan) for what was paid against the final amount."""
+    if amount_paid >= final_amount:
+        return 'paid', False
+    if amount_paid > 0:
+        return 'partial', True
+    return 'not_paid', True
 
 
 class ConfirmOrderSerializer(serializers.Serializer):
@@ -653,30 +860,29 @@ class ConfirmOrderSerializer(serializers.Serializer):
         payment_method = validated_data.get('payment_method')
         amount_paid = validated_data.get('amount_paid', Decimal('0'))
 
-        total_amount = Decimal('0')
-        for item in order.items.all():
-            batch = getattr(item, 'batch', None)
-            if not batch:
+        items = list(order.items.all())
+        for item in items:
+            if not item.batch_id:
                 raise serializers.ValidationError(f"Order item {item.id} is missing a batch.")
 
-            # Get price from batch depending on order type
-            price = batch.wholesale_price if order.order_type == 'wholesale' else batch.selling_price
-            total_amount += price * item.quantity
+        # Prices come from the shared price table; stock is checked by deduct_stock.
+        prices = price_table.batch_prices([item.batch_id for item in items])
+        missing = [item.id for item in items if item.batch_id not in prices]
+        if missing:
+            raise serializers.ValidationError(f"Order items {missing} reference batches that no longer exist.")
+        unit_prices = {
+            item.id: round_two(batch_price(prices[item.batch_id], order.order_type))
+            for item in items
+        }
 
-        total_amount = round_two(total_amount)
+        total_amount = round_two(sum(
+            (unit_prices[item.id] * item.quantity for item in items), Decimal('0')
+        ))
         discount_amount = order.discount_amount or Decimal('0')
         final_amount = round_two(max(total_amount - discount_amount, Decimal('0')))
 
         # Determine payment status and loan flag
-        if amount_paid >= final_amount:
-            payment_status = 'paid'
-            is_loan = False
-        elif amount_paid > 0:
-            payment_status = 'partial'
-            is_loan = True
-        else:
-            payment_status = 'not_paid'
-            is_loan = True
+        payment_status, is_loan = payment_state(amount_paid, final_amount)
 
         # Create Sale
         sale = Sale.objects.create(
@@ -693,23 +899,23 @@ class ConfirmOrderSerializer(serializers.Serializer):
             sale_type=order.order_type,
             is_loan=is_loan,
         )
+        record_sales([sale])
+        post_sales(cashier, [sale])
 
-        # Create SaleItems and handle stock
-        for item in order.items.all():
-            batch = getattr(item, 'batch', None)
-            price = batch.wholesale_price if order.order_type == 'wholesale' else batch.selling_price
-
-            SaleItem.objects.create(
+        # Create SaleItems and take the stock off in one UPDATE
+        sale_items = SaleItem.objects.bulk_create([
+            SaleItem(
                 sale=sale,
-                product=item.product,
-                batch=batch,
+                product_id=item.product_id,
+                batch_id=item.batch_id,
                 quantity=item.quantity,
-                price_per_unit=round_two(price),
-                total_price=round_two(price * item.quantity),
+                price_per_unit=unit_prices[item.id],
+                total_price=round_two(unit_prices[item.id] * item.quantity),
             )
-
-            # Update batch quantity
-            batch.remove_stock(item.quantity, cashier)
+            for item in items
+        ])
+        tally_sales([sale], snapshot_sale_items(sale_items))
+        deduct_stock([(item.product_id, item.batch_id, item.quantity) for item in items], cashier)
 
         # Record Payment if any
         if amount_paid > 0:
@@ -728,6 +934,381 @@ class ConfirmOrderSerializer(serializers.Serializer):
         return sale
 
 
+class BatchConfirmEntrySerializer(serializers.Serializer):
+    order_id = serializers.IntegerField()
+    payment_method = serializers.CharField()
+    amount_paid = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, default=0)
+
+
+class BatchConfirmOrderSerializer(serializers.Serializer):
+    """
+    Confirms many pending orders at once. Stock demand is checked per batch up front;
+    orders that cannot be served are reported back and the rest are confirmed with
+    bulk inserts. Returns one result per requested order.
+    """
+    orders = BatchConfirmEntrySerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, value):
+        order_ids = [entry['order_id'] for entry in value]
+        if len(set(order_ids)) != len(order_ids):
+            raise serializers.ValidationError("Each order can only be listed once.")
+        return value
+
+    def create(self, validated_data):
+        cashier = self.context['request'].user
+        entries = validated_data['orders']
+
+        orders = (
+            Order.objects.select_for_update()
+            .filter(id__in=[entry['order_id'] for entry in entries], status__in=['pending', 'updated'])
+            .in_bulk()
+        )
+        items_by_order = defaultdict(list)
+        for item in OrderItem.objects.filter(order_id__in=orders).order_by('id'):
+            items_by_order[item.order_id].append(item)
+
+        batch_ids = {item.batch_id for items in items_by_order.values() for item in items if item.batch_id}
+        available = dict(
+            ProductBatch.objects.select_for_update().filter(id__in=batch_ids).order_by('id').values_list('id', 'quantity')
+        )
+        prices = price_table.batch_prices(batch_ids)
+
+        # Serve orders in the order they were sent, reserving stock as we go.
+        results = {}
+        accepted = []
+        for entry in entries:
+            order_id = entry['order_id']
+            order = orders.get(order_id)
+            if order is None:
+                results[order_id] = {"order_id": order_id, "status": "failed", "error": "Order not found or already processed."}
+                continue
+
+            items = items_by_order[order_id]
+            if not items:
+                results[order_id] = {"order_id": order_id, "status": "failed", "error": "Order has no items."}
+                continue
+            missing = [item.id for item in items if not item.batch_id]
+            if missing:
+                results[order_id] = {"order_id": order_id, "status": "failed", "error": f"Order items {missing} are missing a batch."}
+                continue
+
+            demand = defaultdict(int)
+            for item in items:
+                demand[item.batch_id] += item.quantity
+            short = [batch_id for batch_id, qty in demand.items() if available.get(batch_id, 0) < qty]
+            if short:
+                results[order_id] = {"order_id": order_id, "status": "failed", "error": f"Insufficient stock in batches {short}."}
+                continue
+
+            for batch_id, qty in demand.items():
+                available[batch_id] -= qty
+            accepted.append((order, items, entry))
+
+        sales = []
+        for order, items, entry in accepted:
+            total_amount = round_two(sum(
+                (round_two(batch_price(prices[item.batch_id], order.order_type)) * item.quantity for item in items), Decimal('0')
+            ))
+            discount_amount = order.discount_amount or Decimal('0')
+            final_amount = round_two(max(total_amount - discount_amount, Decimal('0')))
+            amount_paid = entry.get('amount_paid') or Decimal('0')
+            payment_status, is_loan = payment_state(amount_paid, final_amount)
+
+            sales.append(Sale(
+                order=order,
+                user=cashier,
+                customer_id=order.customer_id,
+                total_amount=total_amount,
+                discount_amount=discount_amount,
+                final_amount=final_amount,
+                paid_amount=amount_paid,
+                payment_status=payment_status,
+                payment_method=entry['payment_method'],
+                status='confirmed',
+                sale_type=order.order_type,
+                is_loan=is_loan,
+            ))
+        Sale.objects.bulk_create(sales)
+        record_sales(sales)
+        post_sales(cashier, sales)
+
+        sale_items, payments, stock_lines = [], [], []
+        for sale, (order, items, entry) in zip(sales, accepted):
+            for item in items:
+                price = round_two(batch_price(prices[item.batch_id], order.order_type))
+                sale_items.append(SaleItem(
+                    sale=sale,
+                    product_id=item.product_id,
+                    batch_id=item.batch_id,
+                    quantity=item.quantity,
+                    price_per_unit=round_two(price),
+                    total_price=round_two(price * item.quantity),
+                ))
+                stock_lines.append((item.product_id, item.batch_id, item.quantity))
+
+            if sale.paid_amount > 0:
+                payments.append(Payment(
+                    sale=sale,
+                    amount_paid=sale.paid_amount,
+                    cashier=cashier,
+                    payment_method=sale.payment_method,
+                ))
+
+            results[order.id] = {
+                "order_id": order.id,
+                "status": "confirmed",
+                "sale_id": sale.id,
+                "final_amount": sale.final_amount,
+                "payment_status": sale.payment_status,
+            }
+
+        SaleItem.objects.bulk_create(sale_items)
+        tally_sales(sales, snapshot_sale_items(sale_items))
+        Payment.objects.bulk_create(payments)
+        deduct_stock(stock_lines, cashier)
+        Order.objects.filter(id__in=[order.id for order, _items, _entry in accepted]).update(status='confirmed')
+
+        return [results[entry['order_id']] for entry in entries]
+
+
+class QuoteSerializer(serializers.Serializer):
+    """
+    Prices a basket exactly as confirmation would, without creating anything.
+    Shortages do not fail the quote; each line reports what can actually be served.
+    """
+    order_type = serializers.ChoiceField(choices=['retail', 'wholesale'], default='retail')
+    discount_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0, default=0)
+    items = SaleLineInputSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        allocations, shortages = allocate(data['items'], data['order_type'])
+        if (data.get('discount_amount') or 0) > subtotal(allocations):
+            raise serializers.ValidationError("Discount cannot exceed subtotal.")
+        data['allocations'] = allocations
+        data['shortages'] = shortages
+        return data
+
+    def to_representation(self, data):
+        by_line = defaultdict(list)
+        for allocation in data['allocations']:
+            by_line[allocation['line']].append(allocation)
+        short = {shortage['line']: shortage for shortage in data['shortages']}
+
+        lines = []
+        for index, line in enumerate(data['items']):
+            allocations = by_line[index]
+            lines.append({
+                "line": index,
+                "product_id": line['product_id'],
+                "batch_id": line.get('batch_id'),
+                "quantity": line['quantity'],
+                "available": short[index]['available'] if index in short else line['quantity'],
+                "in_stock": index not in short,
+                "unit_price": allocations[0]['unit_price'] if len(allocations) == 1 else None,
+                "line_total": round_two(sum((a['line_total'] for a in allocations), Decimal('0'))),
+                "allocations": [
+                    {
+                        "batch_id": a['batch'].id,
+                        "batch_code": a['batch'].batch_code,
+                        "expiry_date": a['batch'].expiry_date,
+                        "quantity": a['quantity'],
+                        "unit_price": a['unit_price'],
+                        "line_total": a['line_total'],
+                    }
+                    for a in allocations
+                ],
+            })
+
+        total_amount = subtotal(data['allocations'])
+        discount_amount = data.get('discount_amount') or Decimal('0')
+        return {
+            "order_type": data['order_type'],
+            "lines": lines,
+            "total_amount": total_amount,
+            "discount_amount": round_two(discount_amount),
+            "final_amount": round_two(max(total_amount - discount_amount, Decimal('0'))),
+            "available": not data['shortages'],
+        }
+
+
+class OfflineSaleSerializer(serializers.Serializer):
+    idempotency_key = serializers.CharField(max_length=64)
+    sale_type = serializers.ChoiceField(choices=['retail', 'wholesale'], default='retail')
+    items = SaleLineInputSerializer(many=True, allow_empty=False)
+    discount_amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, default=0)
+    paid_amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0, default=0)
+    payment_method = serializers.CharField(default='cash')
+    customer_id = serializers.IntegerField(required=False, allow_null=True)
+    customer_name = serializers.CharField(required=False, allow_blank=True)
+    customer_phone = serializers.CharField(required=False, allow_blank=True)
+    captured_at = serializers.DateTimeField(required=False)
+
+
+class SaleSyncSerializer(serializers.Serializer):
+    """
+    Applies a batch of sales captured offline by a till. Each sale carries a
+    client-generated idempotency key so a replayed upload returns the stored result
+    instead of selling twice. Sales that stock cannot cover come back as conflicts
+    and are not recorded, so the terminal can resend them later.
+    """
+    terminal_id = serializers.CharField(max_length=64, required=False, allow_blank=True, default='')
+    sales = OfflineSaleSerializer(many=True, allow_empty=False)
+
+    def validate_sales(self, value):
+        keys = [entry['idempotency_key'] for entry in value]
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError("Idempotency keys must be unique within a batch.")
+        customer_ids = {entry['customer_id'] for entry in value if entry.get('customer_id')}
+        unknown = customer_ids - set(Customer.objects.filter(id__in=customer_ids).values_list('id', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown customer ids: {sorted(unknown)}.")
+        return value
+
+    def create(self, validated_data):
+        cashier = self.context['request'].user
+        terminal_id = validated_data['terminal_id']
+        entries = validated_data['sales']
+        keys = [entry['idempotency_key'] for entry in entries]
+
+        # Claim every key with a placeholder receipt first. A concurrent upload of the
+        # same key waits on the unique index, then finds this request's final receipt
+        # and answers "duplicate" instead of selling twice or failing.
+        claim = {"claim": uuid.uuid4().hex}
+        SyncReceipt.objects.bulk_create(
+            [SyncReceipt(idempotency_key=key, terminal_id=terminal_id, result=claim) for key in keys],
+            ignore_conflicts=True,
+        )
+        receipts = SyncReceipt.objects.in_bulk(keys, field_name='idempotency_key')
+        claimed = {key: receipt for key, receipt in receipts.items() if receipt.sale_id is None and receipt.result == claim}
+        fresh = [entry for entry in entries if entry['idempotency_key'] in claimed]
+
+        # Customers: known ids plus get-or-create by phone, all in bulk.
+        phones = {
+            entry['customer_phone']: entry.get('customer_name') or entry['customer_phone']
+            for entry in fresh
+            if not entry.get('customer_id') and entry.get('customer_phone')
+        }
+        customers = {c.phone: c.id for c in Customer.objects.filter(phone__in=phones)}
+        missing = [Customer(phone=phone, name=name) for phone, name in phones.items() if phone not in customers]
+        for customer in Customer.objects.bulk_create(missing):
+            customers[customer.phone] = customer.id
+
+        # Lock the batches so a concurrent till sale cannot make deduct_stock fail the
+        # whole upload: conflicts are decided here, against stock nobody else can move.
+        available = {
+            batch_id: max(quantity, 0)
+            for batch_id, quantity in load_stock([line for entry in fresh for line in entry['items']], lock=True).items()
+        }
+
+        results = {}
+        accepted = []
+        for entry in fresh:
+            key = entry['idempotency_key']
+            customer_id = entry.get('customer_id') or customers.get(entry.get('customer_phone'))
+            if entry['sale_type'] == 'wholesale' and not customer_id:
+                results[key] = {"idempotency_key": key, "status": "conflict", "error": "Wholesale sales require a customer."}
+                continue
+
+            trial = dict(available)
+            try:
+                allocations, shortages = allocate(entry['items'], entry['sale_type'], available=trial)
+            except serializers.ValidationError as exc:
+                results[key] = {"idempotency_key": key, "status": "conflict", "error": exc.detail}
+                continue
+            if shortages:
+                results[key] = {"idempotency_key": key, "status": "conflict", "shortages": shortages}
+                continue
+
+            available = trial
+            accepted.append((entry, customer_id, allocations))
+
+        sales = []
+        for entry, customer_id, allocations in accepted:
+            total_amount = subtotal(allocations)
+            final_amount = round_two(max(total_amount - entry['discount_amount'], Decimal('0')))
+            payment_status, is_loan = payment_state(entry['paid_amount'], final_amount)
+            sale = Sale(
+                user=cashier,
+                customer_id=customer_id,
+                sale_type=entry['sale_type'],
+                total_amount=total_amount,
+                discount_amount=entry['discount_amount'],
+                final_amount=final_amount,
+                paid_amount=entry['paid_amount'],
+                payment_status=payment_status,
+                payment_method=entry['payment_method'],
+                status='confirmed',
+                is_loan=is_loan,
+            )
+            sales.append(sale)
+        Sale.objects.bulk_create(sales)
+        # Sale.date is stamped on insert (auto_now_add), so capture times go in afterwards.
+        captured = [(sale, entry['captured_at']) for sale, (entry, _c, _a) in zip(sales, accepted) if entry.get('captured_at')]
+        if captured:
+            Sale.objects.filter(pk__in=[sale.pk for sale, _at in captured]).update(date=Case(
+                *[When(pk=sale.pk, then=Value(at)) for sale, at in captured], output_field=DateTimeField(),
+            ))
+            for sale, at in captured:
+                sale.date = at
+        record_sales(sales)
+        post_sales(cashier, sales)
+
+        sale_items, payments, stock_lines, filled = [], [], [], []
+        for sale, (entry, _customer_id, allocations) in zip(sales, accepted):
+            for a in allocations:
+                sale_items.append(SaleItem(
+                    sale=sale,
+                    product_id=a['product_id'],
+                    batch_id=a['batch'].id,
+                    quantity=a['quantity'],
+                    price_per_unit=a['unit_price'],
+                    total_price=a['line_total'],
+                ))
+                stock_lines.append((a['product_id'], a['batch'].id, a['quantity']))
+
+            if sale.paid_amount > 0:
+                payments.append(Payment(
+                    sale=sale,
+                    amount_paid=sale.paid_amount,
+                    cashier=cashier,
+                    payment_method=sale.payment_method,
+                ))
+
+            result = {
+                "idempotency_key": entry['idempotency_key'],
+                "status": "created",
+                "sale_id": sale.id,
+                "final_amount": str(sale.final_amount),
+                "payment_status": sale.payment_status,
+            }
+            results[entry['idempotency_key']] = result
+            receipt = claimed[entry['idempotency_key']]
+            receipt.sale, receipt.result = sale, result
+            filled.append(receipt)
+
+        SaleItem.objects.bulk_create(sale_items)
+        tally_sales(sales, snapshot_sale_items(sale_items))
+        Payment.objects.bulk_create(payments)
+        deduct_stock(stock_lines, cashier)
+        SyncReceipt.objects.bulk_update(filled, ['sale', 'result'])
+        # Conflicts are not recorded, so the terminal can send them again later.
+        SyncReceipt.objects.filter(
+            id__in=[receipt.id for key, receipt in claimed.items() if results[key]["status"] != "created"]
+        ).delete()
+
+        for key, receipt in receipts.items():
+            if key not in claimed:
+                results[key] = {**receipt.result, "status": "duplicate"}
+
+        return [results[entry['idempotency_key']] for entry in entries]
+
+
+class OrderEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderEvent
+        fields = ['id', 'order_id', 'event', 'status', 'summary', 'created_at']
+
+
 class RejectOrderSerializer(serializers.Serializer):
     reason = serializers.CharField(required=False, allow_blank=True)
 
@@ -829,6 +1410,177 @@ class RefundSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+REFUND_WINDOW_DAYS = 50
+
+
+class RefundLineSerializer(serializers.Serializer):
+    item_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class SaleRefundRequestSerializer(serializers.Serializer):
+    sale_id = serializers.IntegerField()
+    items = RefundLineSerializer(many=True, required=False)
+
+
+class BulkRefundSerializer(serializers.Serializer):
+    """
+    Refunds one or many sales, fully or per line, in a fixed number of queries.
+    A sale sent without ``items`` is refunded for everything not refunded yet.
+    """
+    sales = SaleRefundRequestSerializer(many=True, allow_empty=False)
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, data):
+        user = self.context['request'].user
+        sale_ids = [entry['sale_id'] for entry in data['sales']]
+        if len(set(sale_ids)) != len(sale_ids):
+            raise serializers.ValidationError("Each sale can only be listed once.")
+
+        sales_qs = Sale.objects.select_for_update().filter(id__in=sale_ids)
+        if user.role == 'cashier':
+            sales_qs = sales_qs.filter(user=user)
+        sales = sales_qs.in_bulk()
+
+        sale_items = list(
+            SaleItem.objects.filter(sale_id__in=sales)
+            .values('id', 'sale_id', 'product_id', 'batch_id', 'quantity', 'price_per_unit')
+            .order_by('id')
+        )
+        already_refunded = {
+            (row['sale_id'], row['product_id'], row['batch_id']): row['total']
+            for row in Refund.objects.filter(sale_id__in=sales)
+            .values('sale_id', 'product_id', 'batch_id')
+            .annotate(total=Sum('quantity'))
+        }
+
+        # Spread what was refunded before over the sale's lines, oldest line first.
+        remaining = {}
+        items_by_sale = defaultdict(dict)
+        for item in sale_items:
+            key = (item['sale_id'], item['product_id'], item['batch_id'])
+            consumed = min(already_refunded.get(key, 0), item['quantity'])
+            already_refunded[key] = already_refunded.get(key, 0) - consumed
+            remaining[item['id']] = item['quantity'] - consumed
+            items_by_sale[item['sale_id']][item['id']] = item
+
+        deadline_cutoff = timezone.now() - timedelta(days=REFUND_WINDOW_DAYS)
+        errors = {}
+        plan = []
+        for entry in data['sales']:
+            sale = sales.get(entry['sale_id'])
+            if sale is None:
+                errors[entry['sale_id']] = "Sale not found."
+                continue
+            if sale.date < deadline_cutoff:
+                errors[sale.id] = "Refund window expired. Cannot refund this sale."
+                continue
+            if sale.status == 'refunded':
+                errors[sale.id] = "Sale already refunded."
+                continue
+            if sale.paid_amount <= 0:
+                errors[sale.id] = "This sale was not paid. Cannot process refund."
+                continue
+
+            items = items_by_sale[sale.id]
+            if 'items' in entry:
+                requested = defaultdict(int)
+                for line in entry['items']:
+                    requested[line['item_id']] += line['quantity']
+            else:
+                requested = {item_id: remaining[item_id] for item_id in items if remaining[item_id] > 0}
+
+            unknown = [item_id for item_id in requested if item_id not in items]
+            if unknown:
+                errors[sale.id] = f"Items {unknown} are not part of this sale."
+                continue
+            excess = [item_id for item_id, qty in requested.items() if qty > remaining[item_id]]
+            if excess:
+                errors[sale.id] = f"Refund quantity exceeds what is left on items {excess}."
+                continue
+            if not requested:
+                errors[sale.id] = "Nothing left to refund on this sale."
+                continue
+
+            is_full = all(requested.get(item_id, 0) == remaining[item_id] for item_id in items)
+            plan.append({
+                'sale': sale,
+                'lines': [(items[item_id], qty) for item_id, qty in requested.items()],
+                'is_full': is_full,
+            })
+
+        if errors:
+            message = next(iter(errors.values())) if len(errors) == 1 else "Some sales cannot be refunded."
+            raise serializers.ValidationError({"detail": message, "sales": errors})
+
+        data['plan'] = plan
+        return data
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        reason = validated_data.get('reason', '')
+
+        refunds, stock_lines, payments, results, shift_refunds = [], [], [], [], []
+        for entry in validated_data['plan']:
+            sale = entry['sale']
+            # Line refunds carry their share of the sale discount.
+            ratio = (sale.final_amount / sale.total_amount) if sale.total_amount else Decimal('1')
+
+            amount = Decimal('0')
+            for item, quantity in entry['lines']:
+                line_amount = round_two(item['price_per_unit'] * quantity * ratio)
+                amount += line_amount
+                refunds.append(Refund(
+                    sale_id=sale.id,
+                    product_id=item['product_id'],
+                    batch_id=item['batch_id'],
+                    quantity=quantity,
+                    refund_amount=line_amount,
+                    reason=reason,
+                    refunded_by=user,
+                ))
+                stock_lines.append((item['product_id'], item['batch_id'], quantity))
+
+            # Never hand back more than was actually paid in.
+            refundable = max(sale.paid_amount - (sale.refund_total or 0), Decimal('0'))
+            amount = refundable if entry['is_full'] else min(round_two(amount), refundable)
+
+            sale.refund_total = (sale.refund_total or 0) + amount
+            if entry['is_full']:
+                sale.status = 'refunded'
+                sale.payment_status = 'refunded'
+
+            if amount > 0:
+                payments.append(Payment(
+                    sale=sale,
+                    amount_paid=-amount,
+                    cashier=user,
+                    payment_method="refund",
+                ))
+                shift_refunds.append((sale.payment_method, amount))
+
+            results.append({
+                "sale_id": sale.id,
+                "refunded_amount": amount,
+                "status": sale.status,
+                "items": [{"item_id": item['id'], "quantity": quantity} for item, quantity in entry['lines']],
+            })
+
+        Refund.objects.bulk_create(refunds)
+        tally_refunds(refunds)
+        restore_stock(stock_lines, user)
+        Sale.objects.bulk_update(
+            [entry['sale'] for entry in validated_data['plan']],
+            ['status', 'payment_status', 'refund_total'],
+        )
+        # Fully refunded sales leave the hourly sales rollup.
+        record_sales([entry['sale'] for entry in validated_data['plan'] if entry['is_full']], sign=-1)
+        Payment.objects.bulk_create(payments)
+        accumulate(user, 'refund', shift_refunds)
+
+        return results
+
+
 class ExpenseSerializer(serializers.ModelSerializer):
     recorded_by = MeSerializer(read_only=True)
 
@@ -837,6 +1589,44 @@ class ExpenseSerializer(serializers.ModelSerializer):
         fields = ['id', 'description', 'amount', 'category', 'date', 'recorded_by']
 
 
+class ExpenseImportSerializer(serializers.ModelSerializer):
+    # One row of a bulk import; a bare date (YYYY-MM-DD) is taken as local midnight.
+    date = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'])
+
+    class Meta:
+        model = Expense
+        fields = ['description', 'amount', 'category', 'date']
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Amount must be positive.")
+        return value
+
+
+# ------------------------------ SHIFTS ------------------------------
+
+class ShiftSerializer(serializers.ModelSerializer):
+    cashier = serializers.StringRelatedField(read_only=True)
+    closed_by = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = Shift
+        fields = [
+            'id', 'cashier', 'status', 'opening_float', 'counted_cash',
+            'opened_at', 'closed_at', 'closed_by', 'z_report',
+        ]
+        read_only_fields = fields
+
+
+class ShiftOpenSerializer(serializers.Serializer):
+    opening_float = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0, default=Decimal('0'))
+
+
+class ShiftCloseSerializer(serializers.Serializer):
+    # Cash physically counted in the drawer; omit to close without reconciling.
+    counted_cash = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0, required=False, allow_null=True)
+
+
 
 
 class PurchaseSerializer(serializers.ModelSerializer):
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models_ext import Shift, ShiftTotal
+
+
+# ------------------------------ CASHIER SHIFTS ------------------------------
+#
+# While a cashier has an open shift, every sale, loan payment, refund and expense they
+# post adds to the shift's ShiftTotal rows (one per kind and payment method) in the same
+# transaction. Closing reads those few rows into the Z-report; nothing is aggregated
+# from sales at close time. Postings by users without an open shift are not tracked.
+# Editing or deleting a posted payment or refund reverses it (sign=-1) on the shift it
+# went to, as long as that shift is still open.
+
+CASH = 'cash'
+
+
+def open_shift_id(user, lock=True, posted_at=None):
+    shifts = Shift.objects.filter(cashier_id=user.id, status='open')
+    if posted_at is not None:  # only the shift that was already open at ``posted_at``
+        shifts = shifts.filter(opened_at__lte=posted_at)
+    if lock:  # serializes postings against a concurrent close
+        shifts = shifts.select_for_update()
+    return shifts.values_list('id', flat=True).first()
+
+
+@transaction.atomic
+def accumulate(user, kind, entries, sign=1, posted_at=None):
+    """
+    ``entries``: iterable of (payment_method, amount). Adds them to ``user``'s open shift,
+    or with ``sign=-1`` takes them off again; ``posted_at`` limits that to a shift that
+    was open when they were first posted.
+    """
+    if user is None or not user.is_authenticated:
+        return
+    entries = list(entries)
+    if not entries:
+        return
+    shift_id = open_shift_id(user, posted_at=posted_at)
+    if shift_id is None:
+        return
+
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for payment_method, amount in entries:
+        total = totals[payment_method or '']
+        total[0] += sign
+        total[1] += sign * (amount or 0)
+
+    for payment_method, (count, amount) in totals.items():
+        rows = ShiftTotal.objects.filter(shift_id=shift_id, kind=kind, payment_method=payment_method)
+        if not rows.update(count=F('count') + count, amount=F('amount') + amount):
+            ShiftTotal.objects.create(shift_id=shift_id, kind=kind, payment_method=payment_method, count=count, amount=amount)
+
+
+def post_sales(user, sales):
+    """Sales value by payment method, and what was paid in at the till."""
+    accumulate(user, 'sale', [(sale.payment_method, sale.final_amount) for sale in sales])
+    accumulate(user, 'collected', [(sale.payment_method, sale.paid_amount) for sale in sales if sale.paid_amount])
+
+
+def post_payments(payments, sign=1):
+    """Loan payments, on the shift of the cashier who took them (``sign=-1`` reverses)."""
+    for payment in payments:
+        accumulate(
+            payment.cashier, 'loan_payment', [(payment.payment_method, payment.amount_paid)],
+            sign=sign, posted_at=payment.payment_date,
+        )
+
+
+def running_totals(shift):
+    """{kind: {payment_method: {count, amount}}} for ``shift``, from its ShiftTotal rows."""
+    totals = defaultdict(dict)
+    for kind, payment_method, count, amount in shift.totals.values_list('kind', 'payment_method', 'count', 'amount'):
+        totals[kind][payment_method] = {"count": count, "amount": amount}
+    return dict(totals)
+
+
+def z_report(shift, counted_cash=None):
+    totals = running_totals(shift)
+
+    def total(kind, payment_method=None):
+        lines = totals.get(kind, {})
+        if payment_method is not None:
+            return lines.get(payment_method, {}).get("amount", Decimal('0'))
+        return sum((line["amount"] for line in lines.values()), Decimal('0'))
+
+    def count(kind):
+        return sum(line["count"] for line in totals.get(kind, {}).values())
+
+    expected_cash = (
+        shift.opening_float
+        + total('collected', CASH)
+        + total('loan_payment', CASH)
+        - total('refund', CASH)
+        - total('expense')  # expenses are paid out of the till
+    )
+    return {
+        "shift_id": shift.id,
+        "cashier": str(shift.cashier),
+        "opened_at": shift.opened_at,
+        "closed_at": shift.closed_at,
+        "sales_count": count('sale'),
+        "sales_total": total('sale'),
+        "collected_total": total('collected'),
+        "loan_payments_total": total('loan_payment'),
+        "refunds_count": count('refund'),
+        "refunds_total": total('refund'),
+        "expenses_count": count('expense'),
+        "expenses_total": total('expense'),
+        "by_payment_method": totals,
+        "opening_float": shift.opening_float,
+        "expected_cash": expected_cash,
+        "counted_cash": counted_cash,
+        "cash_variance": None if counted_cash is None else counted_cash - expected_cash,
+    }
+
+
+def close_shift(shift, user, counted_cash=None):
+    """Freeze the Z-report on ``shift``. Run inside a transaction with the shift locked."""
+    shift.status = 'closed'
+    shift.closed_at = timezone.now()
+    shift.closed_by = user
+    shift.counted_cash = counted_cash
+    shift.z_report = z_report(shift, counted_cash)
+    shift.save(update_fields=['status', 'closed_at', 'closed_by', 'counted_cash', 'z_report'])
+    return shift
@@ -0,0 +1,112 @@
+from collections import defaultdict
+
+from django.db.models import Case, F, IntegerField, Value, When
+from rest_framework import serializers
+
+from .catalog import record_changes
+from .models import ProductBatch, StockEntry
+from .stock_alerts import refresh_levels
+from .versioning import SALES, bump
+
+
+# ------------------------------ SET-BASED STOCK MOVEMENTS ------------------------------
+#
+# Every helper takes "lines" as (product_id, batch_id, quantity) tuples so callers can
+# move stock for a whole basket, invoice or batch of orders with a single UPDATE plus a
+# single bulk INSERT into StockEntry. Lines without a batch are ignored (stock lives on
+# ProductBatch only).
+
+# Largest CASE expression written in one UPDATE; bigger maps are applied in chunks.
+CASE_CHUNK = 500
+
+
+def batch_totals(lines):
+    """Sum quantities per batch id, skipping lines without a batch."""
+    totals = defaultdict(int)
+    for _product_id, batch_id, quantity in lines:
+        if batch_id:
+            totals[batch_id] += quantity
+    return dict(totals)
+
+
+def per_batch(values, output_field=None):
+    """CASE id WHEN <batch> THEN <value> ... expression for a {batch_id: value} map."""
+    return Case(
+        *[When(id=batch_id, then=Value(value)) for batch_id, value in values.items()],
+        output_field=output_field or IntegerField(),
+    )
+
+
+def log_stock_entries(lines, user, entry_type):
+    entries = [
+        StockEntry(
+            product_id=product_id,
+            batch_id=batch_id,
+            entry_type=entry_type,
+            quantity=quantity,
+            recorded_by=user,
+        )
+        for product_id, batch_id, quantity in lines
+        if batch_id and quantity
+    ]
+    StockEntry.objects.bulk_create(entries)
+    if entries:
+        bump(SALES)
+    return entries
+
+
+def find_shortages(totals):
+    """Return {batch_id: available} for every batch that cannot cover its total."""
+    available = dict(
+        ProductBatch.objects.filter(id__in=totals).values_list('id', 'quantity')
+    )
+    return {
+        batch_id: available.get(batch_id, 0)
+        for batch_id, needed in totals.items()
+        if available.get(batch_id, 0) < needed
+    }
+
+
+def deduct_stock(lines, user, entry_type='sold'):
+    """
+    Take ``lines`` off their batches with one conditional UPDATE.
+
+    The UPDATE only touches batches that still hold enough stock; if any batch falls
+    short nothing is logged and a ValidationError is raised so the surrounding
+    transaction rolls back.
+    """
+    totals = batch_totals(lines)
+    if not totals:
+        return []
+
+    needed = per_batch(totals)
+    updated = ProductBatch.objects.filter(id__in=totals, quantity__gte=needed).update(
+        quantity=F('quantity') - needed
+    )
+    if updated != len(totals):
+        shortages = find_shortages(totals)
+        raise serializers.ValidationError({
+            "detail": "Insufficient stock.",
+            "shortages": [
+                {"batch_id": batch_id, "available": available, "requested": totals[batch_id]}
+                for batch_id, available in shortages.items()
+            ],
+        })
+
+    record_changes('batch', totals)
+    refresh_levels({product_id for product_id, batch_id, _quantity in lines if batch_id})
+    return log_stock_entries(lines, user, entry_type)
+
+
+def restore_stock(lines, user, entry_type='returned'):
+    """Put ``lines`` back on their batches with one UPDATE and log the movement."""
+    totals = batch_totals(lines)
+    if not totals:
+        return []
+
+    ProductBatch.objects.filter(id__in=totals).update(
+        quantity=F('quantity') + per_batch(totals)
+    )
+    record_changes('batch', totals)
+    refresh_levels({product_id for product_id, batch_id, _quantity in lines if batch_id})
+    return log_stock_entries(lines, user, entry_type)
@@ -0,0 +1,144 @@
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, ProductBatch
+from .models_ext import StockAlertEvent, StockLevel
+
+
+# ------------------------------ STOCK LEVEL ALERTS ------------------------------
+#
+# StockLevel holds each product's total stock and state (ok / low / out) as of the last
+# write that touched it; StockAlertEvent records every state change. Set-based stock
+# writers (stock.py, stock takes) call refresh_levels() themselves; ORM saves and
+# deletes of batches and products are picked up by the receivers below.
+
+RECENT_EVENTS = 50
+MAX_EVENTS = 200
+
+
+def level_state(quantity, threshold):
+    """Same rule the product list uses: 0 is out of stock, at or under threshold is low."""
+    if quantity <= 0:
+        return 'out'
+    if quantity <= (threshold or 0):
+        return 'low'
+    return 'ok'
+
+
+@transaction.atomic
+def refresh_levels(product_ids, record_events=True):
+    """
+    Recompute stock levels for ``product_ids`` with one aggregate and write back only
+    what changed. Returns the transition events created.
+
+    The product rows are locked (in id order) before summing, so two writers moving
+    stock of the same product take turns: the second sums after the first committed
+    and neither stores a stale total or loses a transition.
+    """
+    product_ids = {product_id for product_id in product_ids if product_id}
+    if not product_ids:
+        return []
+
+    list(Product.objects.filter(id__in=product_ids).order_by('id').select_for_update().values_list('id', flat=True))
+    totals = (
+        Product.objects.filter(id__in=product_ids)
+        .annotate(total=Coalesce(Sum('batches__quantity'), 0))
+        .values_list('id', 'threshold', 'total')
+    )
+    levels = StockLevel.objects.in_bulk(product_ids)
+
+    created, changed, events = [], [], []
+    for product_id, threshold, total in totals:
+        threshold = threshold or 0
+        state = level_state(total, threshold)
+        level = levels.get(product_id)
+
+        if level is None:
+            created.append(StockLevel(product_id=product_id, state=state, quantity=total, threshold=threshold))
+            from_state = None
+        elif (level.state, level.quantity, level.threshold) != (state, total, threshold):
+            from_state = level.state
+            level.state, level.quantity, level.threshold = state, total, threshold
+            level.updated_at = timezone.now()
+            changed.append(level)
+        else:
+            continue
+
+        if record_events and state != (from_state or 'ok'):
+            events.append(StockAlertEvent(
+                product_id=product_id, from_state=from_state, to_state=state,
+                quantity=total, threshold=threshold,
+            ))
+
+    StockLevel.objects.bulk_create(created, ignore_conflicts=True)
+    StockLevel.objects.bulk_update(changed, ['state', 'quantity', 'threshold', 'updated_at'])
+    return StockAlertEvent.objects.bulk_create(events)
+
+
+@receiver(post_save, sender=ProductBatch)
+@receiver(post_delete, sender=ProductBatch)
+def _batch_stock_changed(sender, instance, **kwargs):
+    refresh_levels([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+def _product_threshold_changed(sender, instance, **kwargs):
+    refresh_levels([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def _product_deleted(sender, instance, **kwargs):
+    StockLevel.objects.filter(product_id=instance.id).delete()
+
+
+def _event_rows(events, names):
+    return [
+        {
+            "id": event.id,
+            "product_id": event.product_id,
+            "product_name": names.get(event.product_id),
+            "from_state": event.from_state,
+            "to_state": event.to_state,
+            "quantity": event.quantity,
+            "threshold": event.threshold,
+            "created_at": event.created_at,
+        }
+        for event in events
+    ]
+
+
+def current_alerts():
+    levels = list(StockLevel.objects.filter(state__in=['low', 'out']).order_by('state', 'quantity'))
+    names = dict(Product.objects.filter(id__in=[level.product_id for level in levels]).values_list('id', 'name'))
+    return [
+        {
+            "product_id": level.product_id,
+            "product_name": names.get(level.product_id),
+            "state": level.state,
+            "quantity": level.quantity,
+            "threshold": level.threshold,
+            "updated_at": level.updated_at,
+        }
+        for level in levels
+        if level.product_id in names
+    ]
+
+
+def alert_feed(since=None):
+    """Current alerts plus transitions after ``since`` (or the most recent ones)."""
+    if since is None:
+        events = list(StockAlertEvent.objects.order_by('-id')[:RECENT_EVENTS])
+    else:
+        events = list(StockAlertEvent.objects.filter(id__gt=since).order_by('id')[:MAX_EVENTS])
+    names = dict(Product.objects.filter(id__in={event.product_id for event in events}).values_list('id', 'name'))
+
+    cursor = max([event.id for event in events], default=since or 0)
+    return {
+        "cursor": cursor,
+        "alerts": current_alerts(),
+        "transitions": _event_rows(events, names),
+    }
@@ -0,0 +1,146 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.utils import timezone
+
+from .models import Product, ProductBatch, StockEntry
+from .models_ext import StockSnapshot, StockSnapshotLine
+
+
+# ------------------------------ POINT-IN-TIME STOCK ------------------------------
+#
+# StockEntry quantities are magnitudes; the direction comes from entry_type. 'added'
+# and 'returned' put stock on a batch, 'sold' and 'deleted' take it off, and
+# 'updated'/'quantity_updated' carry a signed correction. Balances at time T come from
+# the latest snapshot at or before T plus the movements after it; with no such
+# snapshot we walk back from the next snapshot (or live quantities) instead.
+
+IN_TYPES = ('added', 'returned')
+OUT_TYPES = ('sold', 'deleted')
+
+SNAPSHOT_CHUNK = 2000
+
+
+def signed_quantity():
+    return Case(
+        When(entry_type__in=IN_TYPES, then=F('quantity')),
+        When(entry_type__in=OUT_TYPES, then=-F('quantity')),
+        default=F('quantity'),
+        output_field=IntegerField(),
+    )
+
+
+@transaction.atomic
+def take_snapshot(period='daily'):
+    """Copy every batch balance into a new snapshot, in chunked bulk inserts."""
+    snapshot = StockSnapshot.objects.create(taken_at=timezone.now(), period=period)
+    rows = ProductBatch.objects.order_by('id').values_list('id', 'product_id', 'quantity', 'buying_price')
+
+    count, pending = 0, []
+    for batch_id, product_id, quantity, buying_price in rows.iterator(chunk_size=SNAPSHOT_CHUNK):
+        pending.append(StockSnapshotLine(
+            snapshot=snapshot, batch_id=batch_id, product_id=product_id,
+            quantity=quantity, buying_price=buying_price,
+        ))
+        if len(pending) >= SNAPSHOT_CHUNK:
+            StockSnapshotLine.objects.bulk_create(pending)
+            count += len(pending)
+            pending = []
+    StockSnapshotLine.objects.bulk_create(pending)
+    count += len(pending)
+
+    snapshot.batch_count = count
+    snapshot.save(update_fields=['batch_count'])
+    return snapshot
+
+
+def prune_snapshots(keep_daily_days):
+    """Drop daily snapshots older than ``keep_daily_days``; monthly ones are kept."""
+    cutoff = timezone.now() - timedelta(days=keep_daily_days)
+    deleted, _ = StockSnapshot.objects.filter(period='daily', taken_at__lt=cutoff).delete()
+    return deleted
+
+
+def _movements(after, upto, product_ids):
+    entries = StockEntry.objects.filter(batch__isnull=False, date__gt=after)
+    if upto is not None:
+        entries = entries.filter(date__lte=upto)
+    if product_ids is not None:
+        entries = entries.filter(product_id__in=product_ids)
+    return {
+        row['batch_id']: row
+        for row in entries.values('batch_id', 'product_id', 'batch__buying_price').annotate(delta=Sum(signed_quantity()))
+    }
+
+
+def stock_at(at, product_ids=None):
+    """
+    Per-batch balances and buying-price valuation at ``at``.
+    Returns (balances, source) where balances is {batch_id: {product_id, quantity, buying_price}}.
+    """
+    snapshot = StockSnapshot.objects.filter(taken_at__lte=at).order_by('-taken_at').first()
+    direction = 1
+    if snapshot is None:
+        snapshot = StockSnapshot.objects.filter(taken_at__gt=at).order_by('taken_at').first()
+        direction = -1
+
+    if snapshot is not None:
+        lines = StockSnapshotLine.objects.filter(snapshot=snapshot)
+        if product_ids is not None:
+            lines = lines.filter(product_id__in=product_ids)
+        base = lines.values_list('batch_id', 'product_id', 'quantity', 'buying_price')
+        source = {"snapshot_id": snapshot.id, "taken_at": snapshot.taken_at, "direction": "forward" if direction > 0 else "backward"}
+        moves = (
+            _movements(snapshot.taken_at, at, product_ids) if direction > 0
+            else _movements(at, snapshot.taken_at, product_ids)
+        )
+    else:
+        batches = ProductBatch.objects.all()
+        if product_ids is not None:
+            batches = batches.filter(product_id__in=product_ids)
+        base = batches.values_list('id', 'product_id', 'quantity', 'buying_price')
+        source = {"snapshot_id": None, "taken_at": None, "direction": "backward"}
+        moves = _movements(at, None, product_ids)
+
+    balances = {
+        batch_id: {"product_id": product_id, "quantity": quantity, "buying_price": buying_price}
+        for batch_id, product_id, quantity, buying_price in base
+    }
+    for batch_id, move in moves.items():
+        balance = balances.setdefault(batch_id, {
+            "product_id": move['product_id'], "quantity": 0, "buying_price": move['batch__buying_price'],
+        })
+        balance["quantity"] += direction * (move['delta'] or 0)
+
+    return balances, source
+
+
+def stock_report_at(at, product_ids=None):
+    balances, source = stock_at(at, product_ids)
+    balances = {batch_id: b for batch_id, b in balances.items() if b["quantity"]}
+
+    names = dict(Product.objects.filter(id__in={b["product_id"] for b in balances.values()}).values_list('id', 'name'))
+    codes = dict(ProductBatch.objects.filter(id__in=balances).values_list('id', 'batch_code'))
+
+    rows, total_value = [], 0
+    for batch_id, balance in sorted(balances.items()):
+        value = balance["quantity"] * (balance["buying_price"] or 0)
+        total_value += value
+        rows.append({
+            "batch_id": batch_id,
+            "batch_code": codes.get(batch_id),
+            "product_id": balance["product_id"],
+            "product_name": names.get(balance["product_id"]),
+            "quantity": balance["quantity"],
+            "buying_price": balance["buying_price"],
+            "value": value,
+        })
+
+    return {
+        "at": at,
+        "source": source,
+        "total_quantity": sum(row["quantity"] for row in rows),
+        "total_value": total_value,
+        "batches": rows,
+    }
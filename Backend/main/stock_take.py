@@ -0,0 +1,136 @@
+from collections import defaultdict
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .catalog import record_changes
+from .models import ProductBatch
+from .models_ext import StockTakeCount
+from .stock import CASE_CHUNK, log_stock_entries, per_batch
+from .stock_alerts import refresh_levels
+
+
+# ------------------------------ STOCK TAKES ------------------------------
+#
+# Counts are stored per (session, batch, device), each with the batch quantity on record
+# when it was submitted, and summed per batch on close. A batch's variance is its summed
+# count less the quantity on record at its latest count; closing adds that variance to
+# the live quantity (locked, chunked CASE UPDATEs) rather than overwriting it, so sales
+# and receipts between counting and closing are kept. Each adjustment is logged as a
+# signed 'quantity_updated' StockEntry.
+
+VARIANCE_PREVIEW_LIMIT = 200
+
+
+def _scope(take):
+    batches = ProductBatch.objects.all()
+    if take.category_id:
+        batches = batches.filter(product__category_id=take.category_id)
+    return batches
+
+
+def submit_counts(take, device_id, counts, user):
+    """
+    Store ``counts`` ([{batch_id, counted_quantity}]) for one device, replacing that
+    device's earlier counts of the same batches. Unknown or out-of-scope batches are
+    returned as rejected instead of failing the whole submission.
+    """
+    wanted = {entry['batch_id']: entry['counted_quantity'] for entry in counts}
+    known = dict(_scope(take).filter(id__in=wanted).values_list('id', 'quantity'))
+
+    StockTakeCount.objects.filter(stock_take=take, device_id=device_id, batch_id__in=known).delete()
+    StockTakeCount.objects.bulk_create([
+        StockTakeCount(
+            stock_take=take,
+            batch_id=batch_id,
+            device_id=device_id,
+            counted_quantity=quantity,
+            system_quantity=known[batch_id],
+            counted_by=user,
+        )
+        for batch_id, quantity in wanted.items()
+        if batch_id in known
+    ], batch_size=1000)
+
+    return {"accepted": len(known), "rejected": sorted(set(wanted) - set(known))}
+
+
+def count_variance(take, zero_uncounted=False, lock=False):
+    """
+    Differences between the session's counts and live quantities.
+    With ``zero_uncounted`` every in-scope batch nobody counted is expected to be empty.
+    """
+    counted, system_at_count = defaultdict(int), {}
+    for batch_id, counted_quantity, system_quantity in (
+        StockTakeCount.objects.filter(stock_take=take)
+        .order_by('counted_at', 'id')
+        .values_list('batch_id', 'counted_quantity', 'system_quantity')
+    ):
+        counted[batch_id] += counted_quantity
+        system_at_count[batch_id] = system_quantity  # the latest count's snapshot wins
+
+    counted_ids = StockTakeCount.objects.filter(stock_take=take).values('batch_id')
+    batches = ProductBatch.objects.all()
+    if zero_uncounted:
+        batches = batches.filter(Q(id__in=_scope(take).values('id')) | Q(id__in=counted_ids))
+    else:
+        batches = batches.filter(id__in=counted_ids)
+    if lock:
+        batches = batches.select_for_update(of=('self',))
+
+    lines = []
+    for batch_id, product_id, quantity, buying_price in batches.order_by('id').values_list(
+        'id', 'product_id', 'quantity', 'buying_price'
+    ):
+        counted_quantity = counted.get(batch_id, 0)
+        system_quantity = system_at_count.get(batch_id)
+        if system_quantity is None:  # uncounted, or counted before snapshots were kept
+            system_quantity = quantity
+        delta = counted_quantity - system_quantity
+        if delta:
+            lines.append({
+                "batch_id": batch_id,
+                "product_id": product_id,
+                "system_quantity": system_quantity,
+                "counted_quantity": counted_quantity,
+                "live_quantity": quantity,
+                "delta": delta,
+                # What closing changes the live quantity by (it never goes below zero).
+                "adjustment": max(quantity + delta, 0) - quantity,
+                "value_delta": delta * buying_price,
+            })
+    return lines, len(counted)
+
+
+def summarize(lines, counted_batches):
+    return {
+        "counted_batches": counted_batches,
+        "adjusted_batches": len(lines),
+        "units_gained": sum(line["delta"] for line in lines if line["delta"] > 0),
+        "units_lost": -sum(line["delta"] for line in lines if line["delta"] < 0),
+        "value_delta": str(sum((line["value_delta"] for line in lines), 0)),
+    }
+
+
+def close_take(take, user, zero_uncounted=False):
+    """Apply the session's counts to ProductBatch and close it. Run inside a transaction."""
+    lines, counted_batches = count_variance(take, zero_uncounted, lock=True)
+
+    for start in range(0, len(lines), CASE_CHUNK):
+        chunk = lines[start:start + CASE_CHUNK]
+        ProductBatch.objects.filter(id__in=[line["batch_id"] for line in chunk]).update(
+            quantity=F('quantity') + per_batch({line["batch_id"]: line["adjustment"] for line in chunk})
+        )
+    log_stock_entries(
+        [(line["product_id"], line["batch_id"], line["adjustment"]) for line in lines], user, 'quantity_updated'
+    )
+    if lines:
+        record_changes('batch', [line["batch_id"] for line in lines])
+        refresh_levels({line["product_id"] for line in lines})
+
+    take.status = 'closed'
+    take.closed_by = user
+    take.closed_at = timezone.now()
+    take.summary = {**summarize(lines, counted_batches), "zero_uncounted": zero_uncounted}
+    take.save(update_fields=['status', 'closed_by', 'closed_at', 'summary'])
+    return lines
@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from main.models import Category, Product, ProductBatch
+
+
+class PosTestCase(TestCase):
+    """An admin, a cashier and three products with one batch of 100 each (selling at 15.00)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_user('admin', password='x', role='admin')
+        cls.cashier = User.objects.create_user('cashier', password='x', role='cashier')
+        category = Category.objects.create(name='Drugs')
+        cls.products, cls.batches = [], []
+        for index in range(3):
+            product = Product.objects.create(name=f'Product {index}', category=category, threshold=5)
+            cls.products.append(product)
+            cls.batches.append(ProductBatch.objects.create(
+                product=product,
+                batch_code=f'B{index}',
+                expiry_date='2030-01-01',
+                buying_price=Decimal('10.00'),
+                selling_price=Decimal('15.00'),
+                wholesale_price=Decimal('12.00'),
+                quantity=100,
+                recorded_by=cls.admin,
+            ))
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def sell(self, client, lines, paid, payment_method='cash'):
+        """POST a retail sale of ``lines`` [(product, batch, quantity)] and return its id."""
+        response = client.post(reverse('sale-list'), {
+            'sale_type': 'retail',
+            'payment_method': payment_method,
+            'paid_amount': str(paid),
+            'items_input': [
+                {'product_id': product.id, 'batch_id': batch.id, 'quantity': quantity}
+                for product, batch, quantity in lines
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def quantity(self, batch):
+        batch.refresh_from_db()
+        return batch.quantity
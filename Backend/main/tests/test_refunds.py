@@ -0,0 +1,54 @@
+from decimal import Decimal
+
+from django.urls import reverse
+
+from main.models import Payment, Refund, Sale, StockEntry
+
+from .base import PosTestCase
+
+
+class SaleRefundTests(PosTestCase):
+    def test_partial_then_full_refund(self):
+        client = self.client_for(self.cashier)
+        (p0, p1), (b0, b1) = self.products[:2], self.batches[:2]
+        sale_id = self.sell(client, [(p0, b0, 2), (p1, b1, 1)], paid='45.00')
+        item = Sale.objects.get(id=sale_id).items.get(product=p0)
+        self.assertEqual((self.quantity(b0), self.quantity(b1)), (98, 99))
+
+        response = client.post(reverse('sale-refund', args=[sale_id]), {
+            'items': [{'item_id': item.id, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        sale = Sale.objects.get(id=sale_id)
+        self.assertEqual(sale.refund_total, Decimal('15.00'))
+        self.assertEqual(sale.status, 'confirmed')
+        self.assertEqual((self.quantity(b0), self.quantity(b1)), (99, 99))
+
+        response = client.post(reverse('sale-refund', args=[sale_id]), {}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        sale.refresh_from_db()
+        self.assertEqual(sale.refund_total, Decimal('45.00'))
+        self.assertEqual((sale.status, sale.payment_status), ('refunded', 'refunded'))
+        self.assertEqual((self.quantity(b0), self.quantity(b1)), (100, 100))
+
+        self.assertEqual(
+            sorted(Payment.objects.filter(sale=sale, payment_method='refund').values_list('amount_paid', flat=True)),
+            [Decimal('-30.00'), Decimal('-15.00')],
+        )
+        self.assertEqual(Refund.objects.filter(sale=sale).count(), 3)
+        self.assertEqual(StockEntry.objects.filter(batch__in=[b0, b1], entry_type='returned').count(), 3)
+
+        response = client.post(reverse('sale-refund', args=[sale_id]), {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_refund_more_than_sold_is_rejected(self):
+        client = self.client_for(self.cashier)
+        sale_id = self.sell(client, [(self.products[0], self.batches[0], 2)], paid='30.00')
+        item = Sale.objects.get(id=sale_id).items.get()
+
+        response = client.post(reverse('sale-refund', args=[sale_id]), {
+            'items': [{'item_id': item.id, 'quantity': 3}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantity(self.batches[0]), 98)
+        self.assertFalse(Refund.objects.exists())
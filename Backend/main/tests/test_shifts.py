@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from django.urls import reverse
+
+from main.models_ext import Shift
+
+from .base import PosTestCase
+
+
+class ShiftTests(PosTestCase):
+    def test_open_post_edit_close(self):
+        client = self.client_for(self.cashier)
+        response = client.post(reverse('shift-open'), {'opening_float': '100.00'}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        shift_id = response.data['id']
+        self.assertEqual(client.post(reverse('shift-open'), {'opening_float': '0'}, format='json').status_code, 400)
+
+        self.sell(client, [(self.products[0], self.batches[0], 2)], paid='30.00')
+        self.sell(client, [(self.products[1], self.batches[1], 1)], paid='15.00', payment_method='card')
+        response = client.post(reverse('expense-list'), {'description': 'Tea', 'amount': '5.00', 'category': 'office'}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        expense_id = response.data['id']
+        client.patch(reverse('expense-detail', args=[expense_id]), {'amount': '8.00'}, format='json')
+        response = client.post(reverse('expense-list'), {'description': 'Taxi', 'amount': '4.00', 'category': 'office'}, format='json')
+        client.delete(reverse('expense-detail', args=[response.data['id']]))
+
+        response = client.post(reverse('shift-close', args=[shift_id]), {'counted_cash': '120.00'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        report = Shift.objects.get(id=shift_id).z_report
+        self.assertEqual(Decimal(str(report['sales_total'])), Decimal('45.00'))
+        self.assertEqual(Decimal(str(report['expenses_total'])), Decimal('8.00'))
+        self.assertEqual(report['expenses_count'], 1)
+        self.assertEqual(Decimal(str(report['expected_cash'])), Decimal('122.00'))  # 100 + 30 cash - 8
+        self.assertEqual(Decimal(str(report['cash_variance'])), Decimal('-2.00'))
+
+        self.assertEqual(client.post(reverse('shift-close', args=[shift_id]), {}, format='json').status_code, 400)
@@ -0,0 +1,49 @@
+from django.urls import reverse
+
+from main.models import Sale
+
+from .base import PosTestCase
+
+
+class OfflineSyncTests(PosTestCase):
+    def upload(self, sales):
+        response = self.client_for(self.cashier).post(reverse('sale-sync'), {
+            'terminal_id': 'TILL-1',
+            'sales': sales,
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def test_replaying_a_batch_creates_nothing_twice(self):
+        sales = [
+            {
+                'idempotency_key': f'till-1-{index}',
+                'captured_at': '2026-01-05T09:30:00Z',
+                'paid_amount': '30.00',
+                'items': [{'product_id': self.products[index].id, 'quantity': 2}],
+            }
+            for index in range(2)
+        ]
+        first = self.upload(sales)
+        self.assertEqual([result['status'] for result in first], ['created', 'created'])
+
+        replay = self.upload(sales)
+        self.assertEqual([result['status'] for result in replay], ['duplicate', 'duplicate'])
+        self.assertEqual([result['sale_id'] for result in replay], [result['sale_id'] for result in first])
+
+        self.assertEqual(Sale.objects.count(), 2)
+        self.assertEqual([self.quantity(batch) for batch in self.batches[:2]], [98, 98])
+        self.assertEqual(Sale.objects.get(id=first[0]['sale_id']).date.isoformat(), '2026-01-05T09:30:00+00:00')
+
+    def test_short_stock_is_a_per_sale_conflict(self):
+        results = self.upload([
+            {'idempotency_key': 'ok', 'items': [{'product_id': self.products[0].id, 'quantity': 1}]},
+            {'idempotency_key': 'short', 'items': [{'product_id': self.products[1].id, 'quantity': 500}]},
+        ])
+        self.assertEqual([result['status'] for result in results], ['created', 'conflict'])
+
+        # The conflict was not recorded, so it can be sent again once stock arrives.
+        results = self.upload([
+            {'idempotency_key': 'short', 'items': [{'product_id': self.products[1].id, 'quantity': 50}]},
+        ])
+        self.assertEqual(results[0]['status'], 'created')
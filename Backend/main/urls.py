@@ -3,8 +3,8 @@ from django.urls import include, path
 
 from .views import (
     CategoryViewSet, DashboardMetricsView, LoanViewSet, LogoutView, MeView, MonthlySalesAPIView, ProductBatchViewSet, ProfitReportView,
-    RecentLoginsAPIView, RecentSalesAPIView, ReportSummaryAPIView,
-    SalesSummaryAPIView, ShortReportView, StockEntryViewSet, StockReportAPIView, UserViewSet,
+    PeriodComparisonAPIView, PivotReportAPIView, RecentLoginsAPIView, RecentSalesAPIView, ReorderForecastAPIView, ReportSummaryAPIView,
+    SaleLinesExportAPIView, SaleLinesPartitionAPIView, SalesHeatmapAPIView, SalesSummaryAPIView, ShiftViewSet, ShortReportView, StockAtAPIView, StockEntryViewSet, StockReportAPIView, StockTakeViewSet, UserViewSet,
     ProductViewSet, SaleViewSet, ExpenseViewSet,
     PaymentViewSet, RefundViewSet, CustomerViewSet,
     LoginView, WholesaleReportAPIView, customer_purchases, get_csrf_token, OrderViewSet  # <-- Added OrderViewSet here
@@ -17,8 +17,10 @@ router.register(r'products', ProductViewSet, basename='product')
 router.register(r'sales', SaleViewSet, basename='sale')
 router.register(r'loans', LoanViewSet, basename='loans')
 router.register(r'expenses', ExpenseViewSet, basename='expense')
+router.register(r'shifts', ShiftViewSet, basename='shift')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'stock-entries', StockEntryViewSet, basename='stockentry')
+router.register(r'stock-takes', StockTakeViewSet, basename='stocktake')
 
 router.register(r'customers', CustomerViewSet, basename='customer')
 router.register(r'payments', PaymentViewSet, basename='payment')
@@ -40,11 +42,18 @@ urlpatterns += [
     # Reports & dashboard
     path('reports/summary/', ReportSummaryAPIView.as_view(), name='report-summary'),
     path('reports/summary/stock/', StockReportAPIView.as_view(), name='report-summary-stock'),
+    path('reports/stock/at/', StockAtAPIView.as_view(), name='report-stock-at'),
+    path('reports/reorder/', ReorderForecastAPIView.as_view(), name='report-reorder'),
     path('reports/profit/', ProfitReportView.as_view(), name='report-profit'),
     path('reports/wholesale/', WholesaleReportAPIView.as_view(), name='report-wholesale'),
     path('report/short/', ShortReportView.as_view(), name='short-report'),
     path('dashboard/metrics/', DashboardMetricsView.as_view(), name='dashboard-metrics'),
     path('dashboard/monthly-sales/', MonthlySalesAPIView.as_view(), name='monthly-sales'),
+    path('reports/sales/heatmap/', SalesHeatmapAPIView.as_view(), name='report-sales-heatmap'),
+    path('reports/compare/', PeriodComparisonAPIView.as_view(), name='report-compare'),
+    path('reports/pivot/', PivotReportAPIView.as_view(), name='report-pivot'),
+    path('reports/export/sale-lines/', SaleLinesExportAPIView.as_view(), name='export-sale-lines'),
+    path('reports/export/sale-lines/<str:business_date>/', SaleLinesPartitionAPIView.as_view(), name='export-sale-lines-partition'),
     path('dashboard/sales-summary/', SalesSummaryAPIView.as_view(), name='sales-summary'),
     path('dashboard/recent-logins/', RecentLoginsAPIView.as_view(), name='recent-logins'),
     path('dashboard/recent-orders/', RecentSalesAPIView.as_view(), name='recent-sales'),
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+from datetime import datetime, time
+from functools import wraps
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Category, Expense, Payment, Refund, Sale, SaleItem, StockEntry
+from .models_ext import DataVersion
+
+
+# ------------------------------ DATA VERSIONS & CONDITIONAL GET ------------------------------
+#
+# "catalog" covers categories, products and batches; "sales" covers sales, their items,
+# payments, refunds and stock movements; "expenses" covers expenses. Bulk writes that skip
+# signals bump their scope explicitly (see catalog.record_changes,
+# stock.log_stock_entries and expenses.post_expenses).
+#
+# bump() only queues the scope; the DataVersion rows are updated once per scope after
+# the surrounding transaction commits, always in SCOPES order and each in its own
+# autocommit statement. A sale or refund therefore never holds a version row lock while
+# waiting on stock rows (or on the other version row), and the hot rows are locked for
+# one statement rather than for the whole request.
+
+CATALOG = 'catalog'
+SALES = 'sales'
+EXPENSES = 'expenses'
+
+SCOPES = (CATALOG, SALES, EXPENSES)
+
+_pending = threading.local()
+
+
+def _apply_bumps():
+    scopes = getattr(_pending, 'scopes', None)
+    if not scopes:
+        return  # already applied by an earlier callback of the same transaction
+    _pending.scopes = set()
+    moment = timezone.now()
+    for scope in [scope for scope in SCOPES if scope in scopes] + sorted(scopes.difference(SCOPES)):
+        updated = DataVersion.objects.filter(scope=scope).update(version=F('version') + 1, updated_at=moment)
+        if not updated:
+            DataVersion.objects.get_or_create(scope=scope, defaults={'version': 1, 'updated_at': moment})
+
+
+def bump(*scopes):
+    """Move ``scopes`` on once the current transaction commits (at once outside one)."""
+    if not hasattr(_pending, 'scopes'):
+        _pending.scopes = set()
+    _pending.scopes.update(scopes)
+    # Scopes queued by a transaction that rolls back are applied with the next commit
+    # on this thread: a spurious bump only costs clients a refetch.
+    transaction.on_commit(_apply_bumps)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def _catalog_changed(sender, **kwargs):
+    bump(CATALOG)
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+@receiver(post_save, sender=SaleItem)
+@receiver(post_delete, sender=SaleItem)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Refund)
+@receiver(post_delete, sender=Refund)
+@receiver(post_save, sender=StockEntry)
+@receiver(post_delete, sender=StockEntry)
+def _sales_changed(sender, **kwargs):
+    bump(SALES)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def _expenses_changed(sender, **kwargs):
+    bump(EXPENSES)
+
+
+def current_versions(*scopes):
+    """(version, ...) for ``scopes`` in the given order, from one query; 0 if never bumped."""
+    versions = dict(DataVersion.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+    return tuple(versions.get(scope, 0) for scope in scopes)
+
+
+def validators(request, scopes):
+    """Return (etag, last_modified) for ``request`` from one query on DataVersion."""
+    rows = list(DataVersion.objects.filter(scope__in=scopes).values_list('scope', 'version', 'updated_at'))
+    versions = {scope: version for scope, version, _ in rows}
+    updated = [updated_at for _, _, updated_at in rows]
+    today = timezone.localdate()
+
+    # Responses also depend on "today" (expiry windows, default report periods).
+    start_of_day = timezone.make_aware(datetime.combine(today, time.min))
+    last_modified = max([start_of_day, *updated])
+
+    key = "|".join([
+        request.get_full_path(),
+        today.isoformat(),
+        *[f"{scope}:{versions.get(scope, 0)}" for scope in scopes],
+    ])
+    return quote_etag(hashlib.md5(key.encode()).hexdigest()), last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified.timestamp()) <= if_modified_since
+
+
+def conditional_get(*scopes):
+    """
+    Answer GETs with 304 when the client's ETag / If-Modified-Since is still current,
+    without running the view (and its serializer). Fresh responses carry the validators.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            etag, last_modified = validators(request, scopes)
+            if _not_modified(request, etag, last_modified):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = method(self, request, *args, **kwargs)
+
+            if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+                response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
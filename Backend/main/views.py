@@ -1,14 +1,18 @@
+import csv
+import math
+import os
+from collections import defaultdict
 from email.utils import parsedate
 from django.shortcuts import get_object_or_404
 import django_filters
-from rest_framework import viewsets, permissions, filters, status
+from rest_framework import viewsets, mixins, permissions, filters, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.http import JsonResponse
-from django.db import transaction
+from django.http import FileResponse, Http404, JsonResponse
+from django.db import IntegrityError, transaction
 from django.db.models import Sum, Count, F
 from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear, ExtractMonth, Coalesce
 from datetime import timedelta
@@ -20,6 +24,26 @@ from decimal import Decimal, InvalidOperation
 from django_filters.rest_framework import DjangoFilterBackend
 from .pagination import OrderPagination, ProductPagination
 from .rounding import round_two
+from .order_feed import MAX_WAIT, latest_cursor, publish, wait_for_events
+from .catalog import changes_since, full_catalog
+from .versioning import CATALOG, EXPENSES, SALES, conditional_get
+from .pricing import batches_changed
+from .optional import require
+from .scanning import resolve_code, set_barcode
+from .analytics_export import (
+    export_sale_lines, mark_changed as mark_export_changed, partitions as export_partitions,
+)
+from .pivot import DIMENSIONS as PIVOT_DIMENSIONS, MEASURES as PIVOT_MEASURES, pivot
+from .daily_summary import PERIODS as COMPARE_PERIODS, compare as compare_periods, tally_refunds
+from .expenses import GROUPS as EXPENSE_GROUPS, MAX_IMPORT_ROWS, import_expenses, post_expenses, read_csv, summary as expense_summary
+from .sales_rollup import heatmap as sales_heatmap, record_sales
+from .shifts import accumulate, close_shift, open_shift_id, post_payments, z_report
+from .stock import deduct_stock
+from .stock_history import stock_report_at
+from .stock_alerts import alert_feed, current_alerts
+from .forecasting import METHODS as FORECAST_METHODS, forecast
+from .stock_take import VARIANCE_PREVIEW_LIMIT, close_take, count_variance, submit_counts, summarize
+from .models_ext import ABC_CHOICES, ExpenseDaily, PriceRevisionLine, SaleItemSnapshot, ScanCode, Shift, StockTake
 from django_filters.rest_framework import FilterSet
 
 
@@ -30,9 +54,13 @@ from .models import (
 )
 from .serializers import (
     CategorySerializer, ConfirmOrderSerializer, LoanSerializer, OrderSerializer, ProductBatchSerializer, ProductSerializer, RejectOrderSerializer, SaleItemSerializer, StockEntrySerializer,
-    SaleSerializer, ExpenseSerializer, CustomerSerializer,
+    SaleSerializer, ExpenseSerializer, ExpenseImportSerializer, CustomerSerializer,
     PaymentSerializer, RefundSerializer, UserCreateUpdateSerializer,
-    MeSerializer, LoginSerializer,OrderUpdateSerializer
+    MeSerializer, LoginSerializer,OrderUpdateSerializer, BulkRefundSerializer,
+    BatchConfirmOrderSerializer, OrderEventSerializer, OrderListSerializer, QuoteSerializer,
+    SaleSyncSerializer, RepriceSerializer, PriceRevisionLineSerializer,
+    StockTakeSerializer, StockCountSubmitSerializer, StockTakeCloseSerializer,
+    ShiftSerializer, ShiftOpenSerializer, ShiftCloseSerializer, payment_state
 )
 from .permissions import (
     All, IsAdminOnly, IsAdminOrReadOnly, IsCashierOnly,
@@ -149,13 +177,23 @@ class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
 
+    @conditional_get(CATALOG)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(CATALOG)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class ProductFilter(FilterSet):
     out_of_stock = django_filters.BooleanFilter(method='filter_out_of_stock')
+    abc_class = django_filters.ChoiceFilter(field_name='classification__abc_class', choices=ABC_CHOICES)
+    profit_class = django_filters.ChoiceFilter(field_name='classification__profit_class', choices=ABC_CHOICES)
 
     class Meta:
         model = Product
-        fields = ['category', 'out_of_stock']
+        fields = ['category', 'out_of_stock', 'abc_class', 'profit_class']
 
     def filter_out_of_stock(self, queryset, name, value):
         if value:
@@ -169,7 +207,11 @@ class ProductFilter(FilterSet):
 
 # Then in your ViewSet
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    # Ranks come from the nightly ABC classification (main.classification).
+    queryset = Product.objects.select_related('classification').annotate(
+        revenue_rank=F('classification__revenue_rank'),
+        profit_rank=F('classification__profit_rank'),
+    )
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
     filter_backends = [
@@ -179,11 +221,74 @@ class ProductViewSet(viewsets.ModelViewSet):
     ]
     filterset_class = ProductFilter
     search_fields = ['name']
-    ordering_fields = ['created_at']
+    ordering_fields = ['created_at', 'revenue_rank', 'profit_rank']
+
+    @conditional_get(CATALOG)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(CATALOG)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         # Save product and rely on nested batch serializer to handle batches
-        serializer.save()
+        product = serializer.save()
+        batches_changed.send(sender=Product, product_ids=[product.id])
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Delta sync for tills: GET products/changes/?since=<seq> returns only products
+        and batches written after ``seq`` plus deleted ids. Without ``since`` the whole
+        catalog comes back in the same compact shape along with the current cursor.
+        """
+        since = request.query_params.get('since')
+        if since in (None, '', '0'):
+            return Response(full_catalog())
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({"detail": "since must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(changes_since(since))
+
+    @action(detail=False, methods=['get'], url_path='stock-alerts')
+    def stock_alerts(self, request):
+        """
+        Low/out-of-stock alerts plus state transitions: GET products/stock-alerts/?since=<cursor>
+        returns only transitions after the cursor (poll with the returned cursor).
+        """
+        since = request.query_params.get('since')
+        try:
+            since = int(since) if since not in (None, '') else None
+        except ValueError:
+            return Response({"detail": "since must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(alert_feed(since))
+
+    @action(detail=False, methods=['get'])
+    def scan(self, request):
+        """
+        Exact-match scanner lookup: GET products/scan/?code=<batch code or barcode>&order_type=retail|wholesale.
+        """
+        code = (request.query_params.get('code') or '').strip()
+        if not code:
+            return Response({"detail": "code is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = resolve_code(code, request.query_params.get('order_type', 'retail'))
+        if not matches:
+            return Response({"detail": f"No batch or product matches '{code}'."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"code": code, "matches": matches})
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminOrReadOnly])
+    @transaction.atomic
+    def barcode(self, request, pk=None):
+        product = self.get_object()
+        barcode = (request.data.get('barcode') or '').strip()
+        if barcode and ScanCode.objects.filter(code=barcode, batch__isnull=True).exclude(product=product).exists():
+            return Response({"detail": f"Barcode '{barcode}' is already assigned to another product."}, status=400)
+
+        set_barcode(product, barcode)
+        return Response({"product_id": product.id, "barcode": barcode or None}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], url_path='add-batch', permission_classes=[IsAdminOrReadOnly])
     @transaction.atomic
@@ -223,6 +328,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         # ✅ Update quantity
         new_batch.quantity += quantity
         new_batch.save()
+        batches_changed.send(sender=ProductBatch, product_ids=[product.id])
 
         # ✅ Now log stock entry MANUALLY
         StockEntry.objects.create(
@@ -266,6 +372,7 @@ class ProductViewSet(viewsets.ModelViewSet):
             )
 
         batch.delete()
+        batches_changed.send(sender=ProductBatch, product_ids=[product.id])
 
         return Response({"detail": "Batch deleted successfully."}, status=status.HTTP_200_OK)
     
@@ -285,13 +392,15 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductBatchSerializer(batch, data=request.data, partial=True, context={'request': request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        batches_changed.send(sender=ProductBatch, product_ids=[product.id])
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     
     def perform_update(self, serializer):
         # We no longer track stock on the Product level directly
-        serializer.save()
+        product = serializer.save()
+        batches_changed.send(sender=Product, product_ids=[product.id])
 
     def perform_destroy(self, instance):
         # Log deletion (note: quantity is now per batch)
@@ -304,7 +413,9 @@ class ProductViewSet(viewsets.ModelViewSet):
                     quantity=batch.quantity,
                     recorded_by=self.request.user
                 )
+        product_id = instance.id
         instance.delete()
+        batches_changed.send(sender=Product, product_ids=[product_id])
 
 
 class CustomerViewSet(viewsets.ModelViewSet):
@@ -339,6 +450,38 @@ class ProductBatchViewSet(viewsets.ModelViewSet):
         # This handles PATCH /api/batches/{id}/
         return super().partial_update(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'])
+    @transaction.atomic
+    def reprice(self, request):
+        """
+        Bulk price revision, e.g. {"category_id": 3, "selling_pct": 8, "wholesale_pct": 5}
+        or {"prices": [{"batch_id": 1, "selling_price": "120.00"}, ...]}; add "dry_run": true to preview.
+        """
+        serializer = RepriceSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='price-history')
+    def price_history(self, request, pk=None):
+        batch = self.get_object()
+        lines = PriceRevisionLine.objects.filter(batch_id=batch.id).select_related(
+            'revision__created_by'
+        ).order_by('-revision__created_at')
+        return Response(PriceRevisionLineSerializer(lines, many=True).data)
+
+    def perform_create(self, serializer):
+        batch = serializer.save()
+        batches_changed.send(sender=ProductBatch, product_ids=[batch.product_id])
+
+    def perform_update(self, serializer):
+        batch = serializer.save()
+        batches_changed.send(sender=ProductBatch, product_ids=[batch.product_id])
+
+    def perform_destroy(self, instance):
+        product_id = instance.product_id
+        instance.delete()
+        batches_changed.send(sender=ProductBatch, product_ids=[product_id])
+
 class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
@@ -347,11 +490,23 @@ class PaymentViewSet(viewsets.ModelViewSet):
     search_fields = ['sale__id', 'cashier__username']
     ordering_fields = ['payment_date', 'amount_paid']
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(cashier=self.request.user)
+        post_payments([serializer.save(cashier=self.request.user)])
 
+    @transaction.atomic
     def perform_update(self, serializer):
-        serializer.save()
+        previous_sale = serializer.instance.sale
+        post_payments([serializer.instance], sign=-1)
+        payment = serializer.save()
+        post_payments([payment])
+        mark_export_changed({previous_sale, payment.sale})
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        post_payments([instance], sign=-1)
+        mark_export_changed([instance.sale])
+        instance.delete()
 
 
 class RefundViewSet(viewsets.ModelViewSet):
@@ -432,11 +587,35 @@ class OrderViewSet(viewsets.ModelViewSet):
             # Filter orders by date only (ignoring time)
             base_qs = base_qs.filter(created_at__date=date)
 
+        if self.is_compact():
+            base_qs = base_qs.select_related('user', 'customer').prefetch_related('items__product', 'items__batch')
+
         if user.role in ['cashier', 'admin']:
             return base_qs.order_by("-created_at")
 
         return base_qs.filter(user=user).order_by("-created_at", "-id")
 
+    def is_compact(self):
+        # ?compact=true on the list returns flat item rows instead of nested products/batches
+        return self.action == 'list' and self.request.query_params.get('compact') == 'true'
+
+    def get_serializer_class(self):
+        if self.is_compact():
+            return OrderListSerializer
+        return super().get_serializer_class()
+
+    def perform_create(self, serializer):
+        order = serializer.save()
+        publish(order, 'created')
+
+    def perform_update(self, serializer):
+        order = serializer.save()
+        publish(order, 'updated')
+
+    def perform_destroy(self, instance):
+        publish(instance, 'deleted')
+        instance.delete()
+
     def update(self, request, *args, **kwargs):
         user = request.user
         if user.role != 'admin':
@@ -458,8 +637,59 @@ class OrderViewSet(viewsets.ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
         sale = serializer.save()
+        publish(sale.order, 'confirmed')
         return Response(SaleSerializer(sale).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='batch-confirm', permission_classes=[IsCashierOrAdmin])
+    @transaction.atomic
+    def batch_confirm(self, request):
+        # {"orders": [{"order_id": .., "payment_method": "..", "amount_paid": ..}, ...]}
+        serializer = BatchConfirmOrderSerializer(data=request.data, context={'request': request, 'view': self})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        confirmed_ids = [r['order_id'] for r in results if r['status'] == 'confirmed']
+        publish(list(Order.objects.filter(id__in=confirmed_ids)), 'confirmed')
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def quote(self, request):
+        """
+        Price a basket without creating an order: POST orders/quote/ with
+        {"order_type", "discount_amount", "items": [{"product_id", "batch_id"?, "quantity"}]}.
+        """
+        serializer = QuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Long-poll change feed: GET orders/changes/?since=<cursor>&timeout=<seconds>.
+        Without ``since`` it returns the current cursor straight away.
+        """
+        since = request.query_params.get('since')
+        if since in (None, ''):
+            return Response({"cursor": latest_cursor(), "events": []})
+
+        try:
+            since = int(since)
+            timeout = float(request.query_params.get('timeout', MAX_WAIT))
+        except (TypeError, ValueError):
+            return Response({"detail": "since and timeout must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not math.isfinite(timeout) or timeout <= 0:
+            return Response({"detail": "timeout must be a positive number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+        timeout = min(timeout, MAX_WAIT)
+
+        # Staff only follow their own orders; cashiers and admins see everything.
+        owner = None if request.user.role in ['cashier', 'admin'] else request.user
+        events, cursor = wait_for_events(since, timeout=timeout, user=owner)
+
+        return Response({
+            "cursor": cursor,
+            "events": OrderEventSerializer(events, many=True).data,
+        })
+
     @action(detail=True, methods=['patch'], permission_classes=[IsStaffOrAdmin])
     def update_rejected(self, request, pk=None):
         order = self.get_object()
@@ -467,6 +697,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         try:
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            publish(order, 'updated')
         except ValidationError as e:
             return Response({'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -486,7 +717,8 @@ class OrderViewSet(viewsets.ModelViewSet):
             context={'request': request, 'view': self}
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        order = serializer.save()
+        publish(order, 'rejected')
 
         return Response({'message': 'Order rejected successfully'}, status=200)
 
@@ -500,6 +732,7 @@ class OrderViewSet(viewsets.ModelViewSet):
 
         order.status = "updated"
         order.save()
+        publish(order, 'updated')
 
         return Response({"message": "Order moved back to cashier."})
 
@@ -514,12 +747,13 @@ class OrderViewSet(viewsets.ModelViewSet):
         if user.role not in ['staff', 'admin']:
             return Response({"error": "Only staff can delete rejected orders."}, status=403)
 
+        publish(order, 'deleted')
         order.delete()
         return Response({"message": "Rejected order permanently deleted."}, status=204)
 
     
 
-class SaleViewSet(viewsets.ReadOnlyModelViewSet):
+class SaleViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Sale.objects.all()
     serializer_class = SaleSerializer
     permission_classes = [IsCashierOrAdmin]
@@ -544,48 +778,73 @@ class SaleViewSet(viewsets.ReadOnlyModelViewSet):
 
         return qs
 
+    def create(self, request, *args, **kwargs):
+        # Direct till sale: {"sale_type", "items_input": [{"product_id", "batch_id"?, "quantity"}], ...}
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sale = serializer.save()
+        return Response({
+            "id": sale.id,
+            "sale_type": sale.sale_type,
+            "total_amount": sale.total_amount,
+            "discount_amount": sale.discount_amount,
+            "final_amount": sale.final_amount,
+            "paid_amount": sale.paid_amount,
+            "payment_status": sale.payment_status,
+            "items": [
+                {
+                    "product_id": a['product_id'],
+                    "batch_id": a['batch'].id,
+                    "quantity": a['quantity'],
+                    "price_per_unit": a['unit_price'],
+                    "total_price": a['line_total'],
+                }
+                for a in serializer.validated_data['allocations']
+            ],
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsCashierOrAdmin])
+    @transaction.atomic
+    def sync(self, request):
+        # Offline till upload: {"terminal_id": "..", "sales": [{"idempotency_key": "..", "items": [..], ...}]}
+        serializer = SaleSyncSerializer(data=request.data, context={'request': request, 'view': self})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        return Response({
+            "results": results,
+            "conflicts": [r for r in results if r['status'] == 'conflict'],
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], permission_classes=[IsCashierOrAdmin])
     @transaction.atomic
     def refund(self, request, pk=None):
         sale = self.get_object()
 
-        refund_window_days = 50
-        refund_deadline = sale.date + timedelta(days=refund_window_days)
-
-        if now() > refund_deadline:
-            return Response({"detail": "Refund window expired. Cannot refund this sale."}, status=400)
-
-        if sale.status == 'refunded':
-            return Response({"detail": "Sale already refunded."}, status=400)
-
-        if sale.paid_amount <= 0:
-            return Response({"detail": "This sale was not paid. Cannot process refund."}, status=400)
-
-        # 🔁 Create Refunds (stock logic handled in model)
-        for item in sale.items.all():
-            Refund.objects.create(
-                sale=sale,
-                product=item.product,
-                batch=item.batch,
-                quantity=item.quantity,
-                refunded_by=request.user,
-            )
-
-        # 💸 Update sale status
-        sale.status = 'refunded'
-        sale.payment_status = 'refunded'
-        sale.refund_total = sale.paid_amount
-        sale.save()
+        # Full refund unless specific lines are sent: {"items": [{"item_id": .., "quantity": ..}]}
+        entry = {"sale_id": sale.id}
+        if 'items' in request.data:
+            entry["items"] = request.data.get('items')
 
-        # 💳 Reverse payment record
-        Payment.objects.create(
-            sale=sale,
-            amount_paid=-sale.paid_amount,
-            cashier=request.user,
-            payment_method="refund"
+        serializer = BulkRefundSerializer(
+            data={"sales": [entry], "reason": request.data.get('reason', '')},
+            context={'request': request, 'view': self}
         )
+        serializer.is_valid(raise_exception=True)
+        result = serializer.save()[0]
 
-        return Response({"detail": f"Sale refunded. Refunded amount: {sale.paid_amount} TZS"}, status=200)
+        return Response({
+            "detail": f"Sale refunded. Refunded amount: {result['refunded_amount']} TZS",
+            "refund": result,
+        }, status=200)
+
+    @action(detail=False, methods=['post'], url_path='bulk-refund', permission_classes=[IsCashierOrAdmin])
+    @transaction.atomic
+    def bulk_refund(self, request):
+        # {"sales": [{"sale_id": .., "items": [..optional..]}, ...], "reason": ".."}
+        serializer = BulkRefundSerializer(data=request.data, context={'request': request, 'view': self})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        return Response({"results": results}, status=200)
 
 
 
@@ -638,10 +897,24 @@ class LoanViewSet(viewsets.ReadOnlyModelViewSet):
         if amount > remaining:
             return Response({"error": "Payment exceeds remaining balance"}, status=status.HTTP_400_BAD_REQUEST)
 
+        payment_method = request.data.get('payment_method')
+        methods = dict(Sale._meta.get_field('payment_method').flatchoices)
+        if payment_method and methods and payment_method not in methods:
+            return Response(
+                {"error": f"payment_method must be one of: {', '.join(methods)}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
         with transaction.atomic():
             sale.paid_amount += amount
             sale.payment_status = "paid" if sale.paid_amount >= sale.final_amount else "partial"
             sale.save()
+            payment = Payment.objects.create(
+                sale=sale,
+                amount_paid=amount,
+                cashier=request.user,
+                payment_method=payment_method or sale.payment_method or '',
+            )
+            post_payments([payment])
 
         return Response({"message": "Payment recorded successfully"}, status=status.HTTP_200_OK)
 
@@ -650,7 +923,7 @@ class LoanViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 #Update ExpenseViewSet` to filter expenses by date range
-from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_date, parse_datetime
 class ExpenseViewSet(viewsets.ModelViewSet):
     serializer_class = ExpenseSerializer
     permission_classes = [IsCashierOrAdmin]
@@ -674,6 +947,141 @@ class ExpenseViewSet(viewsets.ModelViewSet):
 
         return queryset.filter(date__range=(start_datetime, end_datetime)).order_by('-date')
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        expense = serializer.save(recorded_by=self.request.user)
+        accumulate(self.request.user, 'expense', [('', expense.amount)])
+        post_expenses([expense])
+
+    @staticmethod
+    def _post(expense, sign):
+        accumulate(expense.recorded_by, 'expense', [('', expense.amount)], sign=sign, posted_at=expense.date)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        self._post(serializer.instance, -1)
+        post_expenses([serializer.instance], sign=-1)
+        expense = serializer.save()
+        self._post(expense, 1)
+        post_expenses([expense])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        self._post(instance, -1)
+        post_expenses([instance], sign=-1)
+        instance.delete()
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Expense count and total per category and day or month, from the expense rollup.
+        Query params: start_date, end_date (default: this month so far), group (day|month),
+        category.
+        """
+        today = timezone.localdate()
+        try:
+            start = parse_date(request.query_params.get('start_date', '')) or today.replace(day=1)
+            end = parse_date(request.query_params.get('end_date', '')) or today
+        except ValueError:
+            return Response({"detail": "start_date and end_date must be dates (YYYY-MM-DD)."}, status=400)
+        if start > end:
+            return Response({"detail": "start_date must not be after end_date."}, status=400)
+
+        group = request.query_params.get('group', 'month')
+        if group not in EXPENSE_GROUPS:
+            return Response({"detail": f"group must be one of: {', '.join(EXPENSE_GROUPS)}."}, status=400)
+
+        return Response(expense_summary(start, end, group, request.query_params.get('category')))
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_rows(self, request):
+        """
+        Record many expenses at once, either a JSON list (or {"expenses": [...]}) or a CSV
+        upload in ``file`` with description, amount, category and date columns. All rows are
+        validated first; nothing is saved unless every row is valid.
+        """
+        upload = request.FILES.get('file')
+        if upload is not None:
+            try:
+                rows = read_csv(upload)
+            except (UnicodeDecodeError, csv.Error):
+                return Response({"detail": "file must be a UTF-8 CSV."}, status=400)
+        elif isinstance(request.data, list):
+            rows = request.data
+        else:
+            rows = request.data.get('expenses')
+            if not isinstance(rows, list):
+                return Response({"detail": "Send a list of expenses or a CSV file."}, status=400)
+
+        if not rows:
+            return Response({"detail": "No expenses to import."}, status=400)
+        if len(rows) > MAX_IMPORT_ROWS:
+            return Response({"detail": f"At most {MAX_IMPORT_ROWS} expenses can be imported at once."}, status=400)
+
+        serializer = ExpenseImportSerializer(data=rows, many=True)
+        if not serializer.is_valid():
+            row_errors = serializer.errors
+            if not isinstance(row_errors, dict):  # older DRF lists an entry for every row
+                row_errors = dict(enumerate(row_errors))
+            errors = [{"row": index + 1, "errors": detail} for index, detail in sorted(row_errors.items()) if detail]
+            return Response({"detail": "Some rows are invalid; nothing was imported.", "errors": errors}, status=400)
+
+        expenses = import_expenses(serializer.validated_data, request.user)
+        return Response({
+            "created": len(expenses),
+            "total": sum((expense.amount for expense in expenses), Decimal('0')),
+        }, status=status.HTTP_201_CREATED)
+
+
+class ShiftViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Cashier shifts: open one, post as usual (totals accumulate on the shift), then close
+    it for the Z-report. Cashiers see and close only their own shifts.
+    """
+    serializer_class = ShiftSerializer
+    permission_classes = [IsCashierOrAdmin]
+
+    def get_queryset(self):
+        qs = Shift.objects.select_related('cashier', 'closed_by')
+        if self.request.user.role == 'cashier':
+            qs = qs.filter(cashier=self.request.user)
+        return qs
+
+    @action(detail=False, methods=['post'])
+    @transaction.atomic
+    def open(self, request):
+        # {"opening_float": "50000.00"}
+        if open_shift_id(request.user) is not None:
+            return Response({"detail": "You already have an open shift."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ShiftOpenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            with transaction.atomic():  # a concurrent open (double click) hits one_open_shift_per_cashier
+                shift = Shift.objects.create(cashier=request.user, opening_float=serializer.validated_data['opening_float'])
+        except IntegrityError:
+            return Response({"detail": "You already have an open shift."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ShiftSerializer(shift).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def current(self, request):
+        """The caller's open shift with its running Z-report."""
+        shift = Shift.objects.filter(cashier=request.user, status='open').select_related('cashier').first()
+        if shift is None:
+            return Response({"detail": "No open shift."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({**ShiftSerializer(shift).data, "z_report": z_report(shift)})
+
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def close(self, request, pk=None):
+        # {"counted_cash": "123500.00"} (optional)
+        shift = get_object_or_404(self.get_queryset().select_for_update(of=('self',)), pk=pk)
+        if shift.status != 'open':
+            return Response({"detail": "Shift is already closed."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ShiftCloseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        close_shift(shift, request.user, serializer.validated_data.get('counted_cash'))
+        return Response(ShiftSerializer(shift).data, status=status.HTTP_200_OK)
+
 
 
 
@@ -704,6 +1112,61 @@ class StockEntryViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             qs = qs.filter(date__date=now().date())  # default: today
         return qs
+
+
+class StockTakeViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Stock-take sessions: admins open and close them, any signed-in counter submits
+    counts (in bulk, from any number of devices) while a session is open.
+    """
+    queryset = StockTake.objects.all().select_related('category', 'created_by', 'closed_by')
+    serializer_class = StockTakeSerializer
+    permission_classes = [IsAdminOrReadOnly]
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+    def get_open_take(self):
+        take = get_object_or_404(StockTake.objects.select_for_update(), pk=self.kwargs['pk'])
+        if take.status != 'open':
+            raise ValidationError({"detail": f"Stock take is {take.status}."})
+        return take
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    @transaction.atomic
+    def counts(self, request, pk=None):
+        # {"device_id": "..", "counts": [{"batch_id": .., "counted_quantity": ..}, ...]}
+        take = self.get_open_take()
+        serializer = StockCountSubmitSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = submit_counts(take, serializer.validated_data['device_id'], serializer.validated_data['counts'], request.user)
+        return Response(result, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def variance(self, request, pk=None):
+        take = self.get_object()
+        zero_uncounted = request.query_params.get('zero_uncounted') == 'true'
+        lines, counted_batches = count_variance(take, zero_uncounted)
+        return Response({**summarize(lines, counted_batches), "lines": lines[:VARIANCE_PREVIEW_LIMIT]})
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminOnly])
+    @transaction.atomic
+    def close(self, request, pk=None):
+        take = self.get_open_take()
+        serializer = StockTakeCloseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        close_take(take, request.user, serializer.validated_data['zero_uncounted'])
+        return Response(StockTakeSerializer(take).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminOnly])
+    @transaction.atomic
+    def cancel(self, request, pk=None):
+        take = self.get_open_take()
+        take.status = 'cancelled'
+        take.closed_by = request.user
+        take.closed_at = timezone.now()
+        take.save(update_fields=['status', 'closed_by', 'closed_at'])
+        return Response(StockTakeSerializer(take).data, status=status.HTTP_200_OK)
 # REPORTS AND DASHBOARD
 
 
@@ -722,6 +1185,7 @@ from rest_framework import permissions
 class ReportSummaryAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_get(CATALOG, SALES, EXPENSES)
     def get(self, request):
         period = request.query_params.get('period', 'daily').lower()
         today = now().date()
@@ -744,7 +1208,7 @@ class ReportSummaryAPIView(APIView):
         # Base queries
         base_sales_qs = Sale.objects.filter(date__date__gte=start_date)
         sales_qs = base_sales_qs.exclude(status='refunded')
-        expenses_qs = Expense.objects.filter(date__gte=start_date)
+        expenses_qs = ExpenseDaily.objects.filter(day__gte=start_date)
         refunded_sales_qs = base_sales_qs.filter(status='refunded')
         loan_sales = sales_qs.filter(is_loan=True)
 
@@ -757,7 +1221,7 @@ class ReportSummaryAPIView(APIView):
         total_sales = sales_qs.aggregate(total=Sum('paid_amount'))['total'] or 0
         wholesaler_sales = sales_qs.filter(sale_type='wholesale').aggregate(total=Sum('paid_amount'))['total'] or 0
         retailer_sales = sales_qs.filter(sale_type='retail').aggregate(total=Sum('paid_amount'))['total'] or 0
-        total_expenses = expenses_qs.aggregate(total=Sum('amount'))['total'] or 0
+        total_expenses = expenses_qs.aggregate(total=Sum('total_amount'))['total'] or 0
         orders_count = sales_qs.aggregate(count=Count('id'))['count'] or 0
 
         # Stock value
@@ -782,40 +1246,33 @@ class ReportSummaryAPIView(APIView):
         refund_amount = refunded_sales_qs.aggregate(total=Sum('total_amount'))['total'] or 0
         refund_count = refunded_sales_qs.count()
 
-        # Profit calculation (confirmed + paid sales only)
+        # Profit calculation (confirmed + paid sales only), from the cost snapshots
         profit_expr = ExpressionWrapper(
-            F('quantity') * (F('price_per_unit') - F('batch__buying_price')),
+            F('quantity') * (F('unit_price') - F('unit_cost')),
             output_field=DecimalField(max_digits=12, decimal_places=2)
         )
 
-        wholesale_profit = SaleItem.objects.filter(
+        profits = SaleItemSnapshot.objects.filter(
             sale__date__date__gte=start_date,
             sale__status='confirmed',
             sale__payment_status='paid',
-            sale__sale_type='wholesale'
-        ).annotate(profit=profit_expr).aggregate(total=Sum('profit'))['total'] or 0
-
-        retail_profit = SaleItem.objects.filter(
-            sale__date__date__gte=start_date,
-            sale__status='confirmed',
-            sale__payment_status='paid',
-            sale__sale_type='retail'
-        ).annotate(profit=profit_expr).aggregate(total=Sum('profit'))['total'] or 0
-
-        net_profit = SaleItem.objects.filter(
-            sale__date__date__gte=start_date,
-            sale__status='confirmed',
-            sale__payment_status='paid'
-        ).annotate(profit=profit_expr).aggregate(total=Sum('profit'))['total'] or 0
+        ).aggregate(
+            wholesale=Sum(profit_expr, filter=Q(sale__sale_type='wholesale')),
+            retail=Sum(profit_expr, filter=Q(sale__sale_type='retail')),
+            net=Sum(profit_expr),
+        )
+        wholesale_profit = profits['wholesale'] or 0
+        retail_profit = profits['retail'] or 0
+        net_profit = profits['net'] or 0
 
         # Time series
-        def group_series(queryset, value_field, label='total'):
-            return queryset.annotate(period=trunc_func('date')).values('period').annotate(
+        def group_series(queryset, value_field, label='total', date_field='date'):
+            return queryset.annotate(period=trunc_func(date_field)).values('period').annotate(
                 total=Sum(value_field)
             ).order_by('period')
 
         sales_time_series = group_series(sales_qs, 'paid_amount')
-        expenses_time_series = group_series(expenses_qs, 'amount')
+        expenses_time_series = group_series(expenses_qs, 'total_amount', date_field='day')
         loan_paid_time_series = group_series(loan_paid, 'paid_amount')
         loan_unpaid_time_series = loan_unpaid.annotate(
             period=trunc_func('date')
@@ -891,24 +1348,62 @@ class RefundViewSet(viewsets.ModelViewSet):
 
     @transaction.atomic
     def perform_create(self, serializer):
-        # Just save, model will handle stock and refund_total updates
-        serializer.save(refunded_by=self.request.user)
+        # One refund line goes through the same engine as sale and bulk refunds.
+        data = serializer.validated_data
+        items = SaleItem.objects.filter(sale=data['sale'], product=data['product'])
+        if data.get('batch') is not None:
+            items = items.filter(batch=data['batch'])
+        item = items.order_by('id').first()
+        if item is None:
+            raise ValidationError("Product was not part of the sale.")
+
+        engine = BulkRefundSerializer(
+            data={
+                "sales": [{"sale_id": item.sale_id, "items": [{"item_id": item.id, "quantity": data['quantity']}]}],
+                "reason": data.get('reason', ''),
+            },
+            context=self.get_serializer_context(),
+        )
+        engine.is_valid(raise_exception=True)
+        engine.save()
+        serializer.instance = Refund.objects.filter(
+            sale_id=item.sale_id, product_id=item.product_id, batch_id=item.batch_id,
+        ).latest('id')
+
+    @staticmethod
+    def _post(refund, sign):
+        accumulate(
+            refund.refunded_by, 'refund', [(refund.sale.payment_method, refund.refund_amount)],
+            sign=sign, posted_at=refund.refund_date,
+        )
+        tally_refunds([refund], sign)
+        mark_export_changed([refund.sale])
 
     @transaction.atomic
     def perform_update(self, serializer):
-        # Keep it simple, no special handling for update now
-        serializer.save()
+        self._post(serializer.instance, -1)
+        self._post(serializer.save(), 1)
 
     @transaction.atomic
     def perform_destroy(self, instance):
-        # If you want, handle rollback of stock and refund_total here
-        product = instance.product
-        product.quantity_in_stock -= instance.quantity
-        product.save()
+        """Undo the refund: the goods leave the batch again and the money is owed back."""
+        self._post(instance, -1)
+        deduct_stock([(instance.product_id, instance.batch_id, instance.quantity)], self.request.user)
 
-        sale = instance.sale
+        sale = Sale.objects.select_for_update().get(pk=instance.sale_id)
         sale.refund_total = (sale.refund_total or 0) - instance.refund_amount
-        sale.save()
+        if sale.status == 'refunded':
+            sale.status = 'confirmed'
+            sale.payment_status, _is_loan = payment_state(sale.paid_amount, sale.final_amount)
+            record_sales([sale])  # fully refunded sales had left the hourly rollup
+        sale.save(update_fields=['refund_total', 'status', 'payment_status'])
+        if instance.refund_amount:
+            Payment.objects.create(
+                sale=sale,
+                amount_paid=instance.refund_amount,
+                cashier=self.request.user,
+                payment_method="refund",
+            )
 
         instance.delete()
 
@@ -955,6 +1450,155 @@ class MonthlySalesAPIView(APIView):
         return Response({"sales": sales_data})
 
 
+class PivotReportAPIView(APIView):
+    """
+    Ad-hoc pivot over confirmed sale lines, answered from in-memory arrays:
+    GET reports/pivot/?rows=month,category&measures=revenue,profit&start_date=&end_date=
+        &cashier=&customer=&category=&product=&sale_type=&order=revenue&limit=100
+    rows: day, week, month, cashier, customer, category, product, sale_type (up to 3).
+    measures: qty, revenue, cost, profit, discount.
+    """
+    permission_classes = [IsAdminOnly]
+    max_dimensions = 3
+
+    @conditional_get(CATALOG, SALES)
+    def get(self, request):
+        require('numpy', "Pivots")
+
+        params = request.query_params
+        dimensions = [d for d in (params.get('rows') or '').split(',') if d]
+        measures = [m for m in (params.get('measures') or 'revenue').split(',') if m]
+        unknown = [d for d in dimensions if d not in PIVOT_DIMENSIONS] + [m for m in measures if m not in PIVOT_MEASURES]
+        if unknown:
+            return Response({
+                "detail": f"Unknown rows/measures: {', '.join(unknown)}.",
+                "rows": PIVOT_DIMENSIONS,
+                "measures": PIVOT_MEASURES,
+            }, status=400)
+        if len(dimensions) > self.max_dimensions or len(set(dimensions)) != len(dimensions):
+            return Response({"detail": f"Use up to {self.max_dimensions} distinct rows."}, status=400)
+
+        order = params.get('order')
+        if order and order not in measures:
+            return Response({"detail": "order must be one of the requested measures."}, status=400)
+
+        try:
+            start = parse_date(params.get('start_date') or '')
+            end = parse_date(params.get('end_date') or '')
+            filters = {
+                name: int(params[name])
+                for name in ('cashier', 'customer', 'category', 'product')
+                if params.get(name)
+            }
+            limit = int(params.get('limit') or 1000)
+        except ValueError:
+            return Response({"detail": "Dates must be YYYY-MM-DD; ids and limit must be integers."}, status=400)
+        if params.get('sale_type'):
+            if params['sale_type'] not in ('retail', 'wholesale'):
+                return Response({"detail": "sale_type must be retail or wholesale."}, status=400)
+            filters['sale_type'] = params['sale_type']
+
+        return Response(pivot(dimensions, measures, start, end, filters, order, max(1, min(limit, 10000))))
+
+
+class SaleLinesExportAPIView(APIView):
+    """
+    Parquet export of sale-line facts, one partition per business date.
+    GET lists the partitions on disk; POST appends the closed days not exported yet and
+    rewrites exported days that gained sale lines, refunds or payments since.
+    """
+    permission_classes = [IsAdminOnly]
+
+    def get(self, request):
+        return Response({
+            "partitions": [
+                {
+                    "business_date": day,
+                    "size": os.path.getsize(path),
+                    "url": request.build_absolute_uri(f"{day.isoformat()}/"),
+                }
+                for day, path in sorted(export_partitions().items())
+            ],
+        })
+
+    def post(self, request):
+        require('pyarrow', "Parquet export")
+        written = export_sale_lines()
+        return Response({
+            "written": [{"business_date": day, "rows": rows} for day, rows in sorted(written.items())],
+        }, status=status.HTTP_200_OK)
+
+
+class SaleLinesPartitionAPIView(APIView):
+    """Download one exported partition: GET reports/export/sale-lines/YYYY-MM-DD/."""
+    permission_classes = [IsAdminOnly]
+
+    def get(self, request, business_date):
+        try:
+            path = export_partitions().get(parse_date(business_date))
+        except ValueError:
+            path = None
+        if path is None:
+            raise Http404("No export for that date.")
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f"sale_lines_{business_date}.parquet")
+
+
+class PeriodComparisonAPIView(APIView):
+    """
+    Current vs previous vs year-ago figures from the daily summary (one query):
+    GET reports/compare/?period=day|week|month|year&date=YYYY-MM-DD&to_date=true|false
+    ``date`` defaults to today; with to_date (default) every span stops at the same
+    point into its period.
+    """
+    permission_classes = [IsAdminOnly]
+
+    def get(self, request):
+        period = request.query_params.get('period', 'month').lower()
+        if period not in COMPARE_PERIODS:
+            return Response({"detail": f"period must be one of {', '.join(COMPARE_PERIODS)}."}, status=400)
+        try:
+            anchor = parse_date(request.query_params.get('date') or '') or timezone.localdate()
+        except ValueError:
+            return Response({"detail": "Invalid date. Use YYYY-MM-DD."}, status=400)
+        to_date = request.query_params.get('to_date', 'true').lower() != 'false'
+        return Response(compare_periods(period, anchor, to_date))
+
+
+class SalesHeatmapAPIView(APIView):
+    """
+    Sales count and value by weekday x hour from the hourly rollup:
+    GET reports/sales/heatmap/?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD&user_id=&sale_type=retail|wholesale
+    Defaults to the last 90 days; cashiers only see their own sales.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            end = parse_date(params.get('end_date') or '') or timezone.localdate()
+            start = parse_date(params.get('start_date') or '') or end - timedelta(days=89)
+        except ValueError:
+            return Response({"detail": "Invalid date. Use YYYY-MM-DD."}, status=400)
+        if start > end:
+            return Response({"detail": "start_date must not be after end_date."}, status=400)
+
+        user_id = params.get('user_id')
+        try:
+            user_id = int(user_id) if user_id else None
+        except ValueError:
+            return Response({"detail": "user_id must be an integer."}, status=400)
+        if request.user.role == 'cashier':
+            user_id = request.user.id
+
+        sale_type = params.get('sale_type') or None
+        if sale_type not in (None, 'retail', 'wholesale'):
+            return Response({"detail": "sale_type must be retail or wholesale."}, status=400)
+
+        data = sales_heatmap(start, end, user_id, sale_type)
+        data.update(user_id=user_id, sale_type=sale_type)
+        return Response(data)
+
+
 from datetime import datetime
 from django.utils.timezone import now
 from rest_framework.views import APIView
@@ -1086,6 +1730,7 @@ class RecentSalesAPIView(APIView):
 class StockReportAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_get(CATALOG, SALES)
     def get(self, request):
         period = request.query_params.get('period', 'daily').lower()
         today = now().date()
@@ -1134,20 +1779,25 @@ class StockReportAPIView(APIView):
         for batch in expired_batches:
             total_expired_loss += float(batch['buying_price']) * batch['quantity']
 
-        # --- LOW STOCK PRODUCTS (full details) ---
-        low_stock_products = Product.objects.annotate(
-            total_stock=Coalesce(Sum('batches__quantity'), 0)
-        ).filter(total_stock__lte=F('threshold')).values(
-            'id', 'name', 'threshold', 'total_stock'
-        )
+        # --- LOW STOCK PRODUCTS (maintained by stock_alerts, no catalog rescan) ---
+        low_stock_products = [
+            {
+                "id": alert["product_id"],
+                "name": alert["product_name"],
+                "threshold": alert["threshold"],
+                "total_stock": alert["quantity"],
+            }
+            for alert in current_alerts()
+        ]
 
-        # --- MOST SOLD ITEMS ---
+        # --- MOST SOLD ITEMS (ranked by sales value, with the nightly ABC class) ---
         most_sold_qs = SaleItem.objects.filter(
             sale__status='confirmed',
             sale__date__date__gte=start_date
-        ).values('product__id', 'product__name').annotate(
-            total_sold=Coalesce(Sum('quantity'), 0)
-        ).order_by('-total_sold')[:10]
+        ).values('product__id', 'product__name', abc_class=F('product__classification__abc_class')).annotate(
+            total_sold=Coalesce(Sum('quantity'), 0),
+            total_value=Coalesce(Sum('total_price'), Decimal('0')),
+        ).order_by('-total_value', '-total_sold')[:10]
 
         # --- STOCK MOVEMENT TIME SERIES ---
         restock_qs = StockEntry.objects.filter(
@@ -1197,6 +1847,84 @@ class StockReportAPIView(APIView):
         return Response(response)
 
 
+class StockAtAPIView(APIView):
+    """
+    Point-in-time stock: GET reports/stock/at/?at=YYYY-MM-DD[THH:MM]&product_id=&category_id=.
+    A bare date means the end of that day.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        at_param = request.query_params.get('at')
+        if not at_param:
+            return Response({"detail": "at is required (YYYY-MM-DD or ISO datetime)."}, status=400)
+
+        try:
+            day = parse_date(at_param)
+            at = datetime.combine(day, datetime.max.time()) if day else parse_datetime(at_param)
+        except ValueError:
+            at = None
+        if at is None:
+            return Response({"detail": "Invalid at. Use YYYY-MM-DD or an ISO datetime."}, status=400)
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+
+        product_ids = None
+        product_id = request.query_params.get('product_id')
+        category_id = request.query_params.get('category_id')
+        try:
+            if product_id:
+                product_ids = [int(product_id)]
+            elif category_id:
+                product_ids = list(Product.objects.filter(category_id=int(category_id)).values_list('id', flat=True))
+        except ValueError:
+            return Response({"detail": "product_id and category_id must be integers."}, status=400)
+
+        return Response(stock_report_at(at, product_ids))
+
+
+class ReorderForecastAPIView(APIView):
+    """
+    Demand forecast and reorder suggestions for the whole catalog:
+    GET reports/reorder/?method=sma|ses&window=28&alpha=0.3&history_days=365
+        &lead_time=7&cover_days=30&needs_reorder=true&limit=100
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        require('numpy', "Forecasting")
+
+        params = request.query_params
+        method = params.get('method', 'sma')
+        if method not in FORECAST_METHODS:
+            return Response({"detail": f"method must be one of {', '.join(FORECAST_METHODS)}."}, status=400)
+        try:
+            options = {
+                "method": method,
+                "history_days": int(params['history_days']) if 'history_days' in params else None,
+                "window": int(params['window']) if 'window' in params else None,
+                "alpha": float(params['alpha']) if 'alpha' in params else None,
+                "lead_time": float(params['lead_time']) if 'lead_time' in params else None,
+                "cover_days": float(params['cover_days']) if 'cover_days' in params else None,
+            }
+            limit = int(params.get('limit', 0))
+        except ValueError:
+            return Response({"detail": "Numeric parameters must be numbers."}, status=400)
+        if options["alpha"] is not None and not 0 < options["alpha"] <= 1:
+            return Response({"detail": "alpha must be in (0, 1]."}, status=400)
+        if any(options[key] is not None and options[key] <= 0 for key in ('history_days', 'window')):
+            return Response({"detail": "history_days and window must be positive."}, status=400)
+        if any(options[key] is not None and not (math.isfinite(options[key]) and options[key] >= 0) for key in ('lead_time', 'cover_days')):
+            return Response({"detail": "lead_time and cover_days must be finite and not negative."}, status=400)
+
+        rows, used = forecast(**options)
+        if params.get('needs_reorder') == 'true':
+            rows = [row for row in rows if row['needs_reorder']]
+        if limit > 0:
+            rows = rows[:limit]
+        return Response({"options": used, "count": len(rows), "results": rows})
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def edit_batch(request, product_id, batch_id):
@@ -1215,6 +1943,7 @@ def edit_batch(request, product_id, batch_id):
     batch.wholesale_price = data.get('wholesale_price', batch.wholesale_price)
 
     batch.save()
+    batches_changed.send(sender=ProductBatch, product_ids=[batch.product_id])
 
     return Response({'message': 'Batch updated successfully.'})
 
@@ -1249,8 +1978,8 @@ class ProfitReportView(APIView):
         except Exception:
             return Response({"detail": "Invalid date format. Use YYYY-MM-DD."}, status=400)
 
-        # Filter sale items
-        sale_items = SaleItem.objects.select_related("sale", "batch", "product").filter(
+        # One flat read of the cost snapshots; no batch join, so later batch edits don't leak in
+        rows = SaleItemSnapshot.objects.filter(
             sale__status="confirmed",
             sale__date__gte=start_date,
             sale__date__lt=end_date
@@ -1258,36 +1987,32 @@ class ProfitReportView(APIView):
 
         # Filter by user if provided
         if user_id:
-            sale_items = sale_items.filter(sale__user_id=user_id)
+            rows = rows.filter(sale__user_id=user_id)
+
+        rows = list(rows.values_list(
+            "sale_id", "sale__final_amount", "product__name", "quantity", "list_price", "unit_cost"
+        ))
 
         # Calculate total selling price per sale (without discount)
-        sale_totals = SaleItem.objects.filter(
-            id__in=[item.id for item in sale_items]
-        ).values("sale").annotate(
-            sale_total=Sum(F("quantity") * F("batch__selling_price"), output_field=DecimalField(max_digits=12, decimal_places=2))
-        )
-        sale_totals_map = {item["sale"]: item["sale_total"] for item in sale_totals}
+        sale_totals_map = defaultdict(Decimal)
+        for sale_id, _final, _name, quantity, list_price, _cost in rows:
+            sale_totals_map[sale_id] += quantity * list_price
 
         total_selling = Decimal(0)
         total_buying = Decimal(0)
         total_profit = Decimal(0)
         product_summary = {}
 
-        for item in sale_items:
-            sale_id = item.sale_id
-            sale = item.sale
-            batch = item.batch
-            product_name = item.product.name
-
+        for sale_id, final_amount, product_name, quantity, list_price, unit_cost in rows:
             sale_total = sale_totals_map.get(sale_id) or 0
             if sale_total == 0:
                 discounted_selling = 0
             else:
-                item_selling_price = item.quantity * batch.selling_price
+                item_selling_price = quantity * list_price
                 proportion = item_selling_price / sale_total
-                discounted_selling = proportion * sale.final_amount
+                discounted_selling = proportion * final_amount
 
-            buying = item.quantity * batch.buying_price
+            buying = quantity * unit_cost
             profit = discounted_selling - buying
 
             total_selling += discounted_selling